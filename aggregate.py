@@ -0,0 +1,406 @@
+import heapq
+import math
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+
+# user ids in [0, DENSE_USERS) are kept in arrays indexed by id, other int64
+# ids in sorted arrays of ids, sums and counts, and ids beyond int64 in a dict
+# of [sum, count]; add() puts every id in the dict until compact()
+DENSE_USERS = 1 << 24
+
+MAGIC = b'AGG1'
+HEADER = struct.Struct('<4sdqqqqq')
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+# SpillingAggregate: users are spread over PARTITIONS files by a multiplicative
+# hash, and an entry of the dict is taken to cost SPARSE_ENTRY_BYTES
+PARTITION_BITS = 6
+PARTITIONS = 1 << PARTITION_BITS
+PARTITION_MULTIPLIER = 0x9e3779b97f4a7c15
+SPARSE_ENTRY_BYTES = 200
+RECORD = struct.Struct('<qq')
+
+def _rank(item):
+    # larger totals first, NaN totals last, ties by the smaller user id
+    user_id, total, count = item
+    return (not math.isnan(total), total, -user_id)
+
+def _top_candidates(user_ids, totals, counts, k):
+    # (user_id, total, count) of the users in the arrays that can be among
+    # the k largest totals, found with a partition instead of a sort
+    if k <= 0:
+        return []
+    if len(user_ids) > k:
+        ranked = np.where(np.isnan(totals), -np.inf, totals)
+        kth = np.partition(ranked, len(ranked) - k)[len(ranked) - k]
+        keep = ranked >= kth
+        user_ids, totals, counts = user_ids[keep], totals[keep], counts[keep]
+    return list(zip(user_ids.tolist(), totals.tolist(), counts.tolist()))
+
+class Aggregate:
+    def __init__(self):
+        self.sums = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.sparse_ids = np.zeros(0, dtype=np.int64)
+        self.sparse_sums = np.zeros(0)
+        self.sparse_counts = np.zeros(0, dtype=np.int64)
+        self.sparse = {}
+        self.total_sum = 0.0
+        self.total_rows = 0
+        self.invalid_rows = 0
+
+    def add(self, user_id, amount):
+        # one valid row; the per-line engines call this in their hot loop
+        self.total_rows += 1
+        self.total_sum += amount
+        entry = self.sparse.get(user_id)
+        if entry is None:
+            self.sparse[user_id] = [amount, 1]
+        else:
+            entry[0] += amount
+            entry[1] += 1
+
+    def add_invalid(self, rows=1):
+        self.total_rows += rows
+        self.invalid_rows += rows
+
+    def add_many(self, user_ids, amounts):
+        # valid rows as int64 / float64 arrays
+        self.total_rows += len(user_ids)
+        # inf and nan amounts are valid, their sums need no warning
+        with np.errstate(over='ignore', invalid='ignore'):
+            self.total_sum += float(amounts.sum())
+        self.add_totals(user_ids, amounts)
+
+    def add_totals(self, user_ids, sums, counts=None):
+        # per-user partial sums (counts=None means one row each); does not
+        # touch the global totals
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        sums = np.asarray(sums, dtype=np.float64)
+        counts = None if counts is None else np.asarray(counts, dtype=np.int64)
+        dense = (user_ids >= 0) & (user_ids < DENSE_USERS)
+        if dense.any():
+            self._grow(int(user_ids[dense].max()) + 1)
+            # unbuffered adds in place, the cost follows the rows rather than the id range
+            with np.errstate(over='ignore', invalid='ignore'):
+                np.add.at(self.sums, user_ids[dense], sums[dense])
+            np.add.at(self.counts, user_ids[dense], 1 if counts is None else counts[dense])
+        if not dense.all():
+            self._add_sparse_totals(user_ids[~dense], sums[~dense], 1 if counts is None else counts[~dense])
+
+    def _add_sparse_totals(self, user_ids, sums, counts):
+        # int64 ids outside the dense range into the sorted arrays: the ids
+        # already there are added to in place, the new ones inserted in order
+        keys, inverse = np.unique(user_ids, return_inverse=True)
+        key_sums = np.zeros(len(keys))
+        key_counts = np.zeros(len(keys), dtype=np.int64)
+        with np.errstate(over='ignore', invalid='ignore'):
+            np.add.at(key_sums, inverse, sums)
+        np.add.at(key_counts, inverse, counts)
+        positions = np.searchsorted(self.sparse_ids, keys)
+        found = positions < len(self.sparse_ids)
+        found[found] = self.sparse_ids[positions[found]] == keys[found]
+        with np.errstate(over='ignore', invalid='ignore'):
+            self.sparse_sums[positions[found]] += key_sums[found]
+        self.sparse_counts[positions[found]] += key_counts[found]
+        if not found.all():
+            new = ~found
+            self.sparse_ids = np.insert(self.sparse_ids, positions[new], keys[new])
+            self.sparse_sums = np.insert(self.sparse_sums, positions[new], key_sums[new])
+            self.sparse_counts = np.insert(self.sparse_counts, positions[new], key_counts[new])
+
+    def _add_sparse(self, user_id, total, count):
+        entry = self.sparse.get(user_id)
+        if entry is None:
+            self.sparse[user_id] = [total, count]
+        else:
+            entry[0] += total
+            entry[1] += count
+
+    def check_memory(self):
+        # called by the engines once per block; only SpillingAggregate acts on it
+        pass
+
+    def _grow(self, size):
+        if size > len(self.sums):
+            self.sums = np.concatenate((self.sums, np.zeros(size - len(self.sums))))
+            self.counts = np.concatenate((self.counts, np.zeros(size - len(self.counts), dtype=np.int64)))
+
+    def _split_sparse(self):
+        # the dict as (int64 ids, sums, counts) and a dict of the ids beyond
+        # int64, leaving the dict as it is
+        large = {}
+        try:
+            ids = np.fromiter(self.sparse, dtype=np.int64, count=len(self.sparse))
+            entries = list(self.sparse.values())
+        except OverflowError:
+            small = [user_id for user_id in self.sparse if INT64_MIN <= user_id <= INT64_MAX]
+            large = {user_id: entry for user_id, entry in self.sparse.items() if not INT64_MIN <= user_id <= INT64_MAX}
+            ids = np.array(small, dtype=np.int64)
+            entries = [self.sparse[user_id] for user_id in small]
+        return ids, [entry[0] for entry in entries], [entry[1] for entry in entries], large
+
+    def compact(self):
+        # moves the dict entries with int64 ids into the arrays, the dict
+        # keeps the ids beyond int64
+        if not self.sparse:
+            return
+        ids, sums, counts, self.sparse = self._split_sparse()
+        self.add_totals(ids, sums, counts)
+
+    def merge(self, other):
+        # adds `other` in, which is only read
+        self.total_sum += other.total_sum
+        self.total_rows += other.total_rows
+        self.invalid_rows += other.invalid_rows
+        if len(other.sums):
+            self._grow(len(other.sums))
+            with np.errstate(over='ignore', invalid='ignore'):
+                self.sums[:len(other.sums)] += other.sums
+            self.counts[:len(other.counts)] += other.counts
+        if len(other.sparse_ids):
+            self._add_sparse_totals(other.sparse_ids, other.sparse_sums, other.sparse_counts)
+        # the dict as arrays, not one dict update per user
+        if other.sparse:
+            ids, sums, counts, large = other._split_sparse()
+            self.add_totals(ids, sums, counts)
+            for user_id, (total, count) in large.items():
+                self._add_sparse(user_id, total, count)
+        return self
+
+    @property
+    def users(self):
+        self.compact()
+        return int(np.count_nonzero(self.counts)) + len(self.sparse_ids) + len(self.sparse)
+
+    def top(self, k=5):
+        # (user_id, total, count) of the k largest totals, without sorting
+        # every user: a partition over the arrays and a heap over the dict
+        self.compact()
+        present = np.flatnonzero(self.counts)
+        candidates = _top_candidates(present, self.sums[present], self.counts[present], k)
+        candidates += _top_candidates(self.sparse_ids, self.sparse_sums, self.sparse_counts, k)
+        candidates += heapq.nlargest(k, ((user_id, total, count) for user_id, (total, count) in self.sparse.items()),
+                                     key=_rank)
+        return sorted(candidates, key=_rank, reverse=True)[:k]
+
+    def to_bytes(self):
+        # header, then the present dense users, the other int64 ids and the
+        # ids beyond int64 as decimal text
+        self.compact()
+        present = np.flatnonzero(self.counts)
+        large = list(self.sparse)
+        large_text = '\n'.join(map(str, large)).encode()
+        entries = [self.sparse[user_id] for user_id in large]
+        return b''.join((
+            HEADER.pack(MAGIC, self.total_sum, self.total_rows, self.invalid_rows,
+                        len(present), len(self.sparse_ids) + len(large), len(large_text)),
+            present.astype('<i8').tobytes(),
+            self.sums[present].astype('<f8').tobytes(),
+            self.counts[present].astype('<i8').tobytes(),
+            self.sparse_ids.astype('<i8').tobytes(),
+            self.sparse_sums.astype('<f8').tobytes(),
+            np.array([entry[0] for entry in entries], dtype='<f8').tobytes(),
+            self.sparse_counts.astype('<i8').tobytes(),
+            np.array([entry[1] for entry in entries], dtype='<i8').tobytes(),
+            large_text
+        ))
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, total_sum, total_rows, invalid_rows, dense, sparse, text_size = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not a serialized aggregate")
+        aggregate = cls()
+        aggregate.total_sum = total_sum
+        aggregate.total_rows = total_rows
+        aggregate.invalid_rows = invalid_rows
+
+        offset = HEADER.size
+        def read(dtype, count):
+            nonlocal offset
+            values = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += values.nbytes
+            return values
+
+        ids = read('<i8', dense)
+        sums = read('<f8', dense)
+        counts = read('<i8', dense)
+        if dense:
+            aggregate._grow(int(ids[-1]) + 1)
+            aggregate.sums[ids] = sums
+            aggregate.counts[ids] = counts
+
+        large_text = bytes(data[len(data) - text_size:]) if text_size else b''
+        large = [int(value) for value in large_text.split(b'\n')] if large_text else []
+        small = read('<i8', sparse - len(large))
+        sums = read('<f8', sparse)
+        counts = read('<i8', sparse)
+        if len(small):
+            aggregate._add_sparse_totals(small, sums[:len(small)], counts[:len(small)])
+        for user_id, total, count in zip(large, sums[len(small):].tolist(), counts[len(small):].tolist()):
+            aggregate.sparse[user_id] = [total, count]
+        return aggregate
+
+def _partitions_of(user_ids):
+    # partition of each int64 user id; the same as _partition_of for one id
+    mixed = user_ids.astype(np.uint64) * np.uint64(PARTITION_MULTIPLIER)
+    return (mixed >> np.uint64(64 - PARTITION_BITS)).astype(np.int64)
+
+def _partition_of(user_id):
+    return (user_id * PARTITION_MULTIPLIER) % 2 ** 64 >> (64 - PARTITION_BITS)
+
+class SpillingAggregate(Aggregate):
+    # an Aggregate whose users move to partition files on disk whenever its
+    # in-memory part outgrows `memory_budget` bytes; the engines check once
+    # per block. The totals stay in memory, and top() and users go through
+    # the partitions one at a time, so a partition rather than every user
+    # has to fit. to_bytes() covers the in-memory part only, the parallel
+    # engine's workers hand their `files` over separately.
+    def __init__(self, memory_budget, spill_dir=None, directory=None):
+        super().__init__()
+        self.memory_budget = memory_budget
+        # a directory given by the caller is shared and left to the caller
+        self.owns_directory = directory is None
+        self.spill_dir = spill_dir
+        self.directory = directory
+        self.files = [[] for _ in range(PARTITIONS)]
+        self.own_files = {}
+        self.spills = 0
+        self.spilled_bytes = 0
+        # the user count of the last pass over the partitions
+        self.partition_users = None
+
+    @property
+    def spilled(self):
+        return any(self.files)
+
+    def memory(self):
+        return (self.sums.nbytes + self.counts.nbytes + self.sparse_ids.nbytes + self.sparse_sums.nbytes
+                + self.sparse_counts.nbytes + len(self.sparse) * SPARSE_ENTRY_BYTES)
+
+    def check_memory(self):
+        if self.memory() > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        # appends every in-memory user to its partition's file as one record
+        # of int64 ids, sums and counts plus the ids beyond int64 as text; an
+        # id can be in both the arrays and the dict, the partitions add them up
+        present = np.flatnonzero(self.counts)
+        small = [user_id for user_id in self.sparse if INT64_MIN <= user_id <= INT64_MAX]
+        large = [user_id for user_id in self.sparse if not INT64_MIN <= user_id <= INT64_MAX]
+        if not len(present) and not len(self.sparse_ids) and not self.sparse:
+            return
+        ids = np.concatenate((present, self.sparse_ids, np.array(small, dtype=np.int64)))
+        sums = np.concatenate((self.sums[present], self.sparse_sums, [self.sparse[user_id][0] for user_id in small]))
+        counts = np.concatenate((self.counts[present], self.sparse_counts,
+                                 np.array([self.sparse[user_id][1] for user_id in small], dtype=np.int64)))
+        partitions = _partitions_of(ids)
+        order = np.argsort(partitions, kind='stable')
+        bounds = np.searchsorted(partitions[order], np.arange(PARTITIONS + 1))
+        large_lines = [[] for _ in range(PARTITIONS)]
+        for user_id in large:
+            total, count = self.sparse[user_id]
+            large_lines[_partition_of(user_id)].append(f"{user_id} {total!r} {count}")
+
+        for partition in range(PARTITIONS):
+            rows = order[bounds[partition]:bounds[partition + 1]]
+            if not len(rows) and not large_lines[partition]:
+                continue
+            text = '\n'.join(large_lines[partition]).encode()
+            record = b''.join((RECORD.pack(len(rows), len(text)), ids[rows].astype('<i8').tobytes(),
+                               sums[rows].astype('<f8').tobytes(), counts[rows].astype('<i8').tobytes(), text))
+            with open(self._file(partition), 'ab') as f:
+                f.write(record)
+            self.spilled_bytes += len(record)
+
+        self.spills += 1
+        self.partition_users = None
+        self.sums = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.sparse_ids = np.zeros(0, dtype=np.int64)
+        self.sparse_sums = np.zeros(0)
+        self.sparse_counts = np.zeros(0, dtype=np.int64)
+        self.sparse = {}
+
+    def spill_directory(self):
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='aggregate-', dir=self.spill_dir)
+        return self.directory
+
+    def _file(self, partition):
+        path = self.own_files.get(partition)
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix=f"part{partition:02d}-", suffix='.agg', dir=self.spill_directory())
+            os.close(fd)
+            self.own_files[partition] = path
+            self.files[partition].append(path)
+        return path
+
+    def adopt(self, files):
+        # partition files spilled by another SpillingAggregate, as its `files`
+        for partition, paths in enumerate(files):
+            self.files[partition].extend(paths)
+        self.partition_users = None
+
+    def _load(self, partition):
+        # (int64 ids, sums, counts, {larger id: [sum, count]}) of the users of
+        # one partition, each user once
+        ids, sums, counts, large = [], [], [], {}
+        for path in self.files[partition]:
+            with open(path, 'rb') as f:
+                data = f.read()
+            offset = 0
+            while offset < len(data):
+                rows, text_size = RECORD.unpack_from(data, offset)
+                offset += RECORD.size
+                for values, dtype in ((ids, '<i8'), (sums, '<f8'), (counts, '<i8')):
+                    values.append(np.frombuffer(data, dtype=dtype, count=rows, offset=offset))
+                    offset += rows * 8
+                for line in data[offset:offset + text_size].split(b'\n') if text_size else []:
+                    user_id, total, count = line.split()
+                    entry = large.setdefault(int(user_id), [0.0, 0])
+                    entry[0] += float(total)
+                    entry[1] += int(count)
+                offset += text_size
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64), large
+        unique, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        with np.errstate(over='ignore', invalid='ignore'):
+            totals = np.bincount(inverse, weights=np.concatenate(sums), minlength=len(unique))
+        user_counts = np.bincount(inverse, weights=np.concatenate(counts), minlength=len(unique)).astype(np.int64)
+        return unique, totals, user_counts, large
+
+    @property
+    def users(self):
+        if not self.spilled:
+            return super().users
+        self.spill()
+        if self.partition_users is None:
+            self.top(0)
+        return self.partition_users
+
+    def top(self, k=5):
+        if not self.spilled:
+            return super().top(k)
+        self.spill()
+        candidates = []
+        users = 0
+        for partition in range(PARTITIONS):
+            user_ids, totals, counts, large = self._load(partition)
+            users += len(user_ids) + len(large)
+            candidates += _top_candidates(user_ids, totals, counts, k)
+            candidates += heapq.nlargest(k, ((user_id, total, count) for user_id, (total, count) in large.items()),
+                                         key=_rank)
+        self.partition_users = users
+        return sorted(candidates, key=_rank, reverse=True)[:k]
+
+    def close(self):
+        if self.owns_directory and self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
@@ -0,0 +1,194 @@
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+CSV_ENGINES = ['native', 'numpy', 'parallel', 'chunked', 'pandas', 'pandas_fast']
+
+# totals are float sums taken in a different order by every engine
+SUM_TOLERANCE = 1e-9
+
+def dataset_path(data_dir, size, error_rate, duplicate_rate, seed):
+    return Path(data_dir) / f"transactions_{size:g}mb_e{error_rate:g}_d{duplicate_rate:g}_s{seed}.csv"
+
+def generate_dataset(path, size, error_rate, duplicate_rate, seed):
+    # a seeded gen_csv run writes the same bytes every time, so an existing
+    # file of the right size is reused
+    if path.exists() and path.stat().st_size == int(size * 1024 * 1024):
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    subprocess.run([sys.executable, str(ROOT / 'gen_csv.py'), '--size', str(size), '--seed', str(seed),
+                    '--error-rate', str(error_rate), '--duplicate-rate', str(duplicate_rate),
+                    '--output', str(path)], check=True, stdout=subprocess.DEVNULL)
+
+def run_engine(path, engine, workers=None, timeout=None):
+    # one analyze.py process; ru_maxrss is the peak of the largest process,
+    # for the parallel engine that is the parent or its biggest worker
+    command = [sys.executable, str(ROOT / 'analyze.py'), str(path), '--engine', engine, '--json']
+    if workers:
+        command += ['--workers', str(workers)]
+    started = time.perf_counter()
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
+        # reaped with wait4 rather than by Popen to get the child's rusage
+        timer = threading.Timer(timeout, process.kill) if timeout else None
+        if timer:
+            timer.start()
+        stdout = process.stdout.read()
+        process.stdout.close()
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.perf_counter() - started
+        if timer:
+            timer.cancel()
+        errors.seek(0)
+        stderr = errors.read()
+
+    if timeout and process.returncode < 0 and wall >= timeout:
+        return {'error': f"timed out after {timeout} s"}
+    if process.returncode != 0:
+        lines = (stdout + stderr).decode(errors='replace').strip().splitlines()
+        return {'error': lines[-1] if lines else f"exit code {process.returncode}"}
+    result = json.loads(stdout)
+    result['wall'] = wall
+    result['max_rss'] = usage.ru_maxrss * 1024
+    return result
+
+def summarize(runs, file_size):
+    # median over the repeats; elapsed is the engine's own time, wall also
+    # counts interpreter start-up and imports
+    elapsed = statistics.median(run['elapsed'] for run in runs)
+    last = runs[-1]
+    return {
+        'elapsed': elapsed,
+        'elapsed_min': min(run['elapsed'] for run in runs),
+        'wall': statistics.median(run['wall'] for run in runs),
+        'rows_per_second': last['total_rows'] / elapsed if elapsed else None,
+        'mb_per_second': file_size / (1024 * 1024) / elapsed if elapsed else None,
+        'max_rss': max(run['max_rss'] for run in runs),
+        'total_rows': last['total_rows'],
+        'invalid_rows': last['invalid_rows'],
+        'users': last['users'],
+        'total_sum': last['total_sum'],
+        'top_users': last['top_users']
+    }
+
+def _same_number(a, b):
+    if isinstance(a, str) or isinstance(b, str):
+        return a == b
+    return math.isclose(a, b, rel_tol=SUM_TOLERANCE, abs_tol=SUM_TOLERANCE)
+
+def compare(reference, other):
+    # differences between two summaries in what the report shows
+    differences = [key for key in ('total_rows', 'invalid_rows', 'users') if reference[key] != other[key]]
+    if not _same_number(reference['total_sum'], other['total_sum']):
+        differences.append('total_sum')
+    top = [(user['user_id'], user['count']) for user in reference['top_users']]
+    if top != [(user['user_id'], user['count']) for user in other['top_users']] or not all(
+            _same_number(a['total'], b['total']) for a, b in zip(reference['top_users'], other['top_users'])):
+        differences.append('top_users')
+    return differences
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(sizes, error_rates, duplicate_rates, engines, repeat=3, seed=42, data_dir='bench_data',
+                  workers=None, timeout=None):
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': repeat,
+        'seed': seed,
+        'results': [],
+        'mismatches': []
+    }
+
+    for size in sizes:
+        for error_rate in error_rates:
+            for duplicate_rate in duplicate_rates:
+                path = dataset_path(data_dir, size, error_rate, duplicate_rate, seed)
+                generate_dataset(path, size, error_rate, duplicate_rate, seed)
+                file_size = path.stat().st_size
+                dataset = {'size_mb': size, 'error_rate': error_rate, 'duplicate_rate': duplicate_rate,
+                           'file': str(path)}
+
+                reference = None
+                for engine in engines:
+                    runs = []
+                    for _ in range(repeat):
+                        runs.append(run_engine(path, engine, workers, timeout))
+                        if 'error' in runs[-1]:
+                            break
+
+                    entry = dict(dataset, engine=engine)
+                    if 'error' in runs[-1]:
+                        entry['error'] = runs[-1]['error']
+                    else:
+                        entry.update(summarize(runs, file_size))
+                        if reference is None:
+                            reference = entry
+                        else:
+                            differences = compare(reference, entry)
+                            if differences:
+                                report['mismatches'].append(dict(dataset, engine=engine,
+                                                                  reference=reference['engine'],
+                                                                  fields=differences))
+                    report['results'].append(entry)
+                    print_entry(entry)
+    return report
+
+def print_entry(entry):
+    dataset = f"{entry['size_mb']:g} MB e={entry['error_rate']:g} d={entry['duplicate_rate']:g}"
+    if 'error' in entry:
+        print(f"{dataset:<26} {entry['engine']:<12} failed: {entry['error']}")
+        return
+    rss = f"{entry['max_rss'] / (1024 * 1024):,.0f} MB"
+    print(f"{dataset:<26} {entry['engine']:<12} {entry['elapsed']:>8.2f} s {entry['wall']:>8.2f} s "
+          f"{entry['rows_per_second']:>13,.0f} rows/s {entry['mb_per_second']:>8.1f} MB/s {rss:>9}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the analyzer engines on seeded gen_csv datasets')
+    parser.add_argument('--sizes', type=float, nargs='+', default=[10, 100], help='Dataset sizes in MB')
+    parser.add_argument('--error-rates', type=float, nargs='+', default=[0.0, 0.01])
+    parser.add_argument('--duplicate-rates', type=float, nargs='+', default=[0.0])
+    parser.add_argument('--engines', nargs='+', choices=CSV_ENGINES, default=CSV_ENGINES)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per engine and dataset')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=None, help='Processes for the parallel engine')
+    parser.add_argument('--timeout', type=float, default=None, help='Seconds before a run is abandoned')
+    parser.add_argument('--data-dir', default='bench_data', help='Where generated datasets are kept and reused')
+    parser.add_argument('--output', default='bench.json', help='JSON file for the results')
+    args = parser.parse_args()
+
+    if args.repeat < 1:
+        print("Error: --repeat must be at least 1")
+        sys.exit(1)
+
+    print(f"{'Dataset':<26} {'Engine':<12} {'Elapsed':>10} {'Wall':>10} {'Throughput':>20} {'':>13} {'Peak RSS':>9}")
+    report = run_benchmark(args.sizes, args.error_rates, args.duplicate_rates, args.engines, args.repeat,
+                           args.seed, args.data_dir, args.workers, args.timeout)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for mismatch in report['mismatches']:
+        print(f"Mismatch: {mismatch['engine']} differs from {mismatch['reference']} on "
+              f"{mismatch['size_mb']:g} MB e={mismatch['error_rate']:g} in {', '.join(mismatch['fields'])}")
+    print(f"Results saved to {args.output}")
+    sys.exit(1 if report['mismatches'] else 0)
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import struct
+from aggregate import Aggregate
+from inputs import detect_compression
+
+# a checkpoint stores the aggregate of every complete line before `offset`
+# plus fingerprints of the file head and of the bytes just before `offset`;
+# if either no longer matches, the file was rewritten rather than appended to
+MAGIC = b'CKP1'
+HEADER = struct.Struct('<4sqq16sq16s')
+HEAD_SIZE = 64 * 1024
+TAIL_SIZE = 64 * 1024
+
+def checkpoint_path(csv_file):
+    return f"{csv_file}.checkpoint"
+
+def _digest(f, start, size):
+    f.seek(start)
+    data = f.read(size)
+    if len(data) != size:
+        return None
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def load(csv_file, path=None):
+    # returns (offset, aggregate, status) with status 'resumed', 'missing' or
+    # 'rewritten'; anything but 'resumed' means a full scan from byte 0.
+    # Offsets into compressed input cannot be resumed from
+    if detect_compression(csv_file) is not None:
+        raise ValueError("чекпоинт не поддерживается для сжатых файлов")
+    path = path or checkpoint_path(csv_file)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, offset, head_size, head, tail_size, tail = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not a checkpoint")
+        aggregate = Aggregate.from_bytes(data[HEADER.size:])
+    except FileNotFoundError:
+        return 0, Aggregate(), 'missing'
+    except (ValueError, struct.error):
+        return 0, Aggregate(), 'rewritten'
+
+    with open(csv_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < offset or \
+                _digest(f, 0, head_size) != head or _digest(f, offset - tail_size, tail_size) != tail:
+            return 0, Aggregate(), 'rewritten'
+    return offset, aggregate, 'resumed'
+
+def save(csv_file, offset, aggregate, path=None):
+    # `offset` must follow a '\n', or a '\r' with a byte after it: nothing
+    # appended later can extend a line that ends before it
+    path = path or checkpoint_path(csv_file)
+    head_size = min(HEAD_SIZE, offset)
+    tail_size = min(TAIL_SIZE, offset)
+    with open(csv_file, 'rb') as f:
+        head = _digest(f, 0, head_size)
+        tail = _digest(f, offset - tail_size, tail_size)
+
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, offset, head_size, head, tail_size, tail))
+        f.write(aggregate.to_bytes())
+    os.replace(temporary, path)
+
+def last_line_end(mm):
+    # the offset just after the last '\n' of a mapped file
+    return mm.rfind(b'\n') + 1
+
+def describe(status, offset):
+    if status == 'resumed':
+        return f"Продолжение с чекпоинта: пропущено {offset:,} байт"
+    if status == 'rewritten':
+        return "Файл был перезаписан, чекпоинт сброшен - полный пересчёт"
+    return "Чекпоинт не найден - полный пересчёт"
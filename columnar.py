@@ -0,0 +1,79 @@
+import os
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+FORMATS = ['records', 'columns']
+
+# one fixed-width little-endian record per transaction, 45 bytes each;
+# `valid` tells whether parse_native would count the row (its user id and
+# amount parse), as no value of the amount column can mean "invalid"
+RECORD_DTYPE = np.dtype([
+    ('transaction_id', 'S20'),
+    ('user_id', '<i8'),
+    ('transaction_amount', '<f8'),
+    ('transaction_date', '<M8[s]'),
+    ('valid', '?')
+])
+COLUMNS = list(RECORD_DTYPE.names)
+
+# values stored for what could not be represented in their binary column
+INVALID_USER_ID = np.iinfo(np.int64).min
+INVALID_AMOUNT = np.nan
+INVALID_DATE = np.datetime64('NaT', 's')
+
+# rough size of an .npy header, used to turn a byte budget into a row count
+NPY_HEADER_SIZE = 128
+
+def detect_format(path):
+    path = Path(path)
+    if path.is_dir() and (path / f'{COLUMNS[0]}.npy').exists():
+        return 'columns'
+    if path.suffix == '.npy':
+        return 'records'
+    return None
+
+def rows_for_size(target_size, output_format):
+    if output_format == 'records':
+        return max(target_size - NPY_HEADER_SIZE, 0) // RECORD_DTYPE.itemsize
+    return max(target_size - NPY_HEADER_SIZE * len(COLUMNS), 0) // RECORD_DTYPE.itemsize
+
+def create(path, output_format, rows):
+    if output_format == 'records':
+        np.lib.format.open_memmap(path, mode='w+', dtype=RECORD_DTYPE, shape=(rows,)).flush()
+        return
+    os.makedirs(path, exist_ok=True)
+    for name in COLUMNS:
+        np.lib.format.open_memmap(
+            os.path.join(path, f'{name}.npy'), mode='w+', dtype=RECORD_DTYPE[name], shape=(rows,)
+        ).flush()
+
+def open_columns(path, mode='r'):
+    # every column is a view straight into the memory-mapped file(s)
+    if detect_format(path) == 'columns':
+        return {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mode) for name in COLUMNS}
+    records = np.load(path, mmap_mode=mode)
+    return {name: records[name] for name in COLUMNS}
+
+def parse_user_id(value):
+    # (user id, valid); ids beyond int64 cannot be stored and count as invalid
+    try:
+        user_id = int(value)
+    except (ValueError, TypeError, OverflowError):
+        return INVALID_USER_ID, False
+    if not np.iinfo(np.int64).min <= user_id <= np.iinfo(np.int64).max:
+        return INVALID_USER_ID, False
+    return user_id, True
+
+def parse_amount(value):
+    # (amount, valid); 'nan' and 'inf' are valid floats, exactly as in parse_native
+    try:
+        return float(value), True
+    except (ValueError, TypeError):
+        return INVALID_AMOUNT, False
+
+def parse_date(value):
+    try:
+        return np.datetime64(datetime.strptime(value, '%Y-%m-%d %H:%M:%S'), 's')
+    except (ValueError, TypeError):
+        return INVALID_DATE
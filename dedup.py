@@ -0,0 +1,371 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+from sketches import gather, hash_ids, to_matrix
+
+# transaction ids are keyed by a 64-bit hash of their first KEY_WIDTH bytes,
+# mixed with a hash of the whole id for the few longer ones; ids with the
+# same key are told apart by comparing the whole ids, so collisions only
+# cost a comparison
+KEY_WIDTH = 64
+MEMORY_BUDGET = 256 * 1024 * 1024
+# bit positions per key in the Bloom filter over the spilled keys
+BLOOM_HASHES = 3
+BLOOM_CHUNK = 1 << 20
+# the spilled runs are merged into one when there are more of them
+MAX_RUNS = 8
+
+def keys_of(ids):
+    # keys of a list of transaction ids as bytes
+    keys = hash_ids(to_matrix(ids, KEY_WIDTH), KEY_WIDTH)
+    mix_long(keys, ids, [i for i, transaction_id in enumerate(ids) if len(transaction_id) > KEY_WIDTH])
+    return keys
+
+def mix_long(keys, ids, rows):
+    # keys[rows], of ids longer than KEY_WIDTH, mixed with a hash of the
+    # whole id, so that ids sharing their first KEY_WIDTH bytes rarely share
+    # a key; `ids` is a list or Ids
+    if len(rows):
+        keys[rows] ^= np.array([int.from_bytes(hashlib.blake2b(ids[i], digest_size=8).digest(), 'little')
+                                for i in rows], dtype=np.uint64)
+
+class Ids:
+    # transaction ids as data[starts[i]:stops[i]] of a uint8 array, so rows
+    # are picked without copying the ids
+    def __init__(self, data=None, starts=None, stops=None):
+        self.data = np.zeros(0, dtype=np.uint8) if data is None else data
+        self.starts = np.zeros(0, dtype=np.int64) if starts is None else starts
+        self.stops = self.starts if stops is None else stops
+
+    @classmethod
+    def from_list(cls, ids):
+        offsets = np.cumsum([0] + [len(i) for i in ids], dtype=np.int64)
+        return cls(np.frombuffer(b''.join(ids), dtype=np.uint8), offsets[:-1], offsets[1:])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        return self.data[self.starts[i]:self.stops[i]].tobytes()
+
+    def lengths(self):
+        return self.stops - self.starts
+
+    def matrix(self, rows, width):
+        # the zero padded (len(rows), width) matrix of the ids of `rows`
+        if not width:
+            return np.zeros((len(rows), 0), dtype=np.uint8)
+        return gather(self.data, self.starts[rows], self.lengths()[rows], width)
+
+    def take(self, rows):
+        return Ids(self.data, self.starts[rows], self.stops[rows])
+
+    def __add__(self, other):
+        if not len(other):
+            return self
+        data = np.concatenate((self.data, other.data))
+        return Ids(data, np.concatenate((self.starts, other.starts + len(self.data))),
+                   np.concatenate((self.stops, other.stops + len(self.data))))
+
+    def packed(self):
+        # the same ids back to back in a buffer of their own
+        lengths = self.lengths()
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        width = int(lengths.max()) if len(lengths) else 0
+        if width <= KEY_WIDTH:
+            # a column at a time, like sketches.gather
+            matrix = self.matrix(np.arange(len(self)), width)
+            data = matrix.ravel() if (lengths == width).all() else matrix[np.arange(width) < lengths[:, None]]
+        else:
+            data = self.data[np.repeat(self.starts - offsets[:-1], lengths) + np.arange(offsets[-1])]
+        return Ids(np.ascontiguousarray(data), offsets[:-1], offsets[1:])
+
+def same_ids(a, rows_a, b, rows_b):
+    # whether a[rows_a[i]] == b[rows_b[i]], for every i; ids past KEY_WIDTH
+    # bytes are compared one by one
+    lengths = a.lengths()[rows_a]
+    same = lengths == b.lengths()[rows_b]
+    width = min(int(lengths.max()) if len(lengths) else 0, KEY_WIDTH)
+    same &= (a.matrix(rows_a, width) == b.matrix(rows_b, width)).all(axis=1)
+    for i in np.flatnonzero(same & (lengths > KEY_WIDTH)).tolist():
+        same[i] = a[rows_a[i]] == b[rows_b[i]]
+    return same
+
+class IdLog:
+    # the distinct ids in order of arrival, found by their number: the newest
+    # in memory, the rest appended to two files, the ids and their offsets,
+    # once they pass `memory` bytes
+    def __init__(self, memory, path_of):
+        self.memory = memory
+        self.path_of = path_of
+        self.files = None
+        self.maps = None
+        self.flushed = 0
+        self.flushed_size = 0
+        self.chunks = []
+        self.starts = []
+        self.count = 0
+        self.size = 0
+
+    def append(self, ids):
+        # the numbers of `ids`
+        numbers = np.arange(self.count, self.count + len(ids), dtype=np.int64)
+        if len(ids):
+            ids = ids.packed()
+            self.chunks.append(ids)
+            self.starts.append(self.count)
+            self.count += len(ids)
+            self.size += len(ids.data)
+        if self.size - self.flushed_size > self.memory:
+            self._flush()
+        return numbers
+
+    def _flush(self):
+        if self.files is None:
+            self.files = tuple(open(self.path_of(), 'w+b') for _ in range(2))
+        data, offsets = self.files
+        for ids in self.chunks:
+            ids.data.tofile(data)
+            (ids.starts + self.flushed_size).astype('<i8').tofile(offsets)
+            self.flushed_size += len(ids.data)
+        data.flush()
+        offsets.flush()
+        self.flushed = self.count
+        self.chunks, self.starts = [], []
+        self.maps = (np.memmap(data.name, dtype=np.uint8, mode='r') if self.flushed_size else np.zeros(0, np.uint8),
+                     np.memmap(offsets.name, dtype='<i8', mode='r'))
+
+    def _parts(self, numbers):
+        # (Ids, positions in it, indices into `numbers`) for the flushed ids
+        # and each chunk in memory the numbers fall in
+        flushed = np.flatnonzero(numbers < self.flushed)
+        if len(flushed):
+            data, offsets = self.maps
+            # the last id on disk ends where the file does
+            following = numbers[flushed] + 1
+            stops = np.where(following < self.flushed, offsets[np.minimum(following, self.flushed - 1)],
+                             self.flushed_size)
+            yield Ids(data, offsets[numbers[flushed]], stops), np.arange(len(flushed)), flushed
+        chunk = np.searchsorted(self.starts, numbers, side='right') - 1
+        chunk[numbers < self.flushed] = -1
+        for k in np.unique(chunk[chunk >= 0]).tolist():
+            inside = np.flatnonzero(chunk == k)
+            yield self.chunks[k], numbers[inside] - self.starts[k], inside
+
+    def same(self, numbers, ids, rows):
+        # whether the id of numbers[i] is ids[rows[i]], for every i
+        result = np.zeros(len(numbers), dtype=bool)
+        for part, positions, inside in self._parts(numbers):
+            result[inside] = same_ids(part, positions, ids, rows[inside])
+        return result
+
+    def __getitem__(self, number):
+        for part, positions, _ in self._parts(np.array([number], dtype=np.int64)):
+            return part[positions[0]]
+
+    def close(self):
+        self.maps = None
+        for f in self.files or ():
+            f.close()
+        self.files = None
+
+def _find(keys, queries):
+    # (first, stop) positions in the sorted `keys` of each of `queries`
+    return np.searchsorted(keys, queries), np.searchsorted(keys, queries, side='right')
+
+def _union(a, b):
+    # two sorted (keys, numbers) runs as one; the stable sort keeps the
+    # numbers of equal keys in order
+    keys = np.concatenate((a[0], b[0]))
+    order = np.argsort(keys, kind='stable')
+    return keys[order], np.concatenate((a[1], b[1]))[order]
+
+def _empty():
+    return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+
+class Deduplicator:
+    # the exact set of ids seen so far in about `memory_budget` bytes: half
+    # holds sorted keys with the numbers of their ids in an IdLog, a quarter
+    # a Bloom filter over the keys spilled to sorted run files, so only keys
+    # the filter cannot rule out are looked up on disk, and a quarter the
+    # newest ids of the log. A key found is confirmed by comparing the ids;
+    # past a few bits per spilled key the filter lets more keys through,
+    # which costs lookups but never exactness
+    def __init__(self, memory_budget=MEMORY_BUDGET, spill_dir=None):
+        self.spill_dir = spill_dir
+        self.max_keys = max(memory_budget // 2 // 16, 1 << 16)
+        self.bloom_bits = 1 << max((memory_budget // 4 * 8).bit_length() - 1, 16)
+        self.bloom = None
+        self.log = IdLog(memory_budget // 4, self._run_path)
+        self.keys = _empty()
+        # recent keys, merged into self.keys once they are a fair share of it
+        self.pending = _empty()
+        self.runs = []
+        self.directory = None
+        self.files = 0
+        self.duplicates = 0
+        self.distinct = 0
+        self.spills = 0
+        self.lookups = 0
+        self.collisions = 0
+
+    def check_and_add(self, keys, ids):
+        # a mask of the rows whose id (`ids`, an Ids, `keys` their keys) was
+        # seen before, earlier in `ids` included; the others are remembered
+        keys = np.asarray(keys, dtype=np.uint64)
+        order = np.argsort(keys, kind='stable')
+        ordered = keys[order]
+        first = np.ones(len(ordered), dtype=bool)
+        first[1:] = ordered[1:] != ordered[:-1]
+        # a row with the key of an earlier row of the batch repeats the first
+        # row of the key when the ids match, which they do but for collisions
+        duplicate = ~first
+        group = np.maximum.accumulate(np.where(first, np.arange(len(ordered)), 0))
+        repeats = np.flatnonzero(duplicate)
+        other = repeats[~same_ids(ids, order[repeats], ids, order[group[repeats]])]
+        for start in np.unique(group[other]).tolist():
+            distinct = {ids[order[start]]}
+            stop = start + 1
+            while stop < len(ordered) and not first[stop]:
+                row_id = ids[order[stop]]
+                if row_id not in distinct:
+                    distinct.add(row_id)
+                    duplicate[stop] = False
+                    self.collisions += 1
+                stop += 1
+        candidates = np.flatnonzero(~duplicate)
+        rows, unique = order[candidates], ordered[candidates]
+
+        # where each key is in the keys in memory and in the runs the Bloom
+        # filter does not rule it out for
+        stores = [self.keys, self.pending]
+        found = [_find(store_keys, unique) for store_keys, _ in stores]
+        if self.runs:
+            spilled = np.flatnonzero(self._bloom_test(unique))
+            self.lookups += len(spilled)
+            for run in self.runs:
+                start, stop = np.zeros(len(unique), dtype=np.int64), np.zeros(len(unique), dtype=np.int64)
+                start[spilled], stop[spilled] = _find(run[0], unique[spilled])
+                stores.append(run)
+                found.append((start, stop))
+        # every id logged under a candidate's key is compared with it, all at once
+        seen = np.zeros(len(unique), dtype=bool)
+        hits = np.zeros(len(unique), dtype=np.int64)
+        for (_, store_numbers), (start, stop) in zip(stores, found):
+            counts = stop - start
+            hits += counts
+            pairs = np.repeat(np.arange(len(unique)), counts)
+            offsets = np.cumsum(counts) - counts
+            numbers = store_numbers[np.repeat(start - offsets, counts) + np.arange(len(pairs))]
+            seen[pairs[self.log.same(numbers, ids, rows[pairs])]] = True
+        self.collisions += int(np.count_nonzero(~seen & (hits > 0)))
+
+        # the new ids go to the log in row order, which reads `ids` in order
+        fresh = np.zeros(len(keys), dtype=bool)
+        fresh[rows[~seen]] = True
+        fresh = np.flatnonzero(fresh)
+        self.distinct += len(fresh)
+        self.pending = _union(self.pending, (keys[fresh], self.log.append(ids.take(fresh))))
+        if len(self.pending[0]) > max(len(self.keys[0]) // 4, 1 << 16):
+            self.keys = _union(self.keys, self.pending)
+            self.pending = _empty()
+        if len(self.keys[0]) + len(self.pending[0]) > self.max_keys:
+            self._spill()
+
+        duplicate[candidates] = seen
+        result = np.empty(len(keys), dtype=bool)
+        result[order] = duplicate
+        self.duplicates += int(np.count_nonzero(result))
+        return result
+
+    def _bloom_positions(self, keys):
+        # double hashing from the two halves of the already mixed keys
+        step = (keys >> np.uint64(32)) | np.uint64(1)
+        mask = np.uint64(self.bloom_bits - 1)
+        for i in range(BLOOM_HASHES):
+            yield (keys + np.uint64(i) * step) & mask
+
+    def _bloom_add(self, keys):
+        if self.bloom is None:
+            self.bloom = np.zeros(self.bloom_bits // 64, dtype=np.uint64)
+        for start in range(0, len(keys), BLOOM_CHUNK):
+            for positions in self._bloom_positions(keys[start:start + BLOOM_CHUNK]):
+                np.bitwise_or.at(self.bloom, (positions >> np.uint64(6)).astype(np.intp),
+                                 np.uint64(1) << (positions & np.uint64(63)))
+
+    def _bloom_test(self, keys):
+        result = np.ones(len(keys), dtype=bool)
+        for positions in self._bloom_positions(keys):
+            words = self.bloom[(positions >> np.uint64(6)).astype(np.intp)]
+            result &= (words >> (positions & np.uint64(63))) & np.uint64(1) == 1
+        return result
+
+    def _run_path(self):
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='dedup-', dir=self.spill_dir)
+        self.files += 1
+        return os.path.join(self.directory, f"run-{self.files}.u64")
+
+    def _open_run(self, keys_path, numbers_path):
+        return (np.memmap(keys_path, dtype=np.uint64, mode='r'), np.memmap(numbers_path, dtype=np.int64, mode='r'))
+
+    def _spill(self):
+        keys, numbers = _union(self.keys, self.pending)
+        self.spills += 1
+        paths = self._run_path(), self._run_path()
+        keys.tofile(paths[0])
+        numbers.tofile(paths[1])
+        self._bloom_add(keys)
+        self.runs.append(self._open_run(*paths))
+        self.keys = _empty()
+        self.pending = _empty()
+        if len(self.runs) > MAX_RUNS:
+            self._compact()
+
+    def _compact(self):
+        # a chunked merge of all runs into one; every key up to the smallest
+        # last key of the loaded chunks is loaded, and the stable sort keeps
+        # the numbers of a key that is in several runs in run order
+        paths = self._run_path(), self._run_path()
+        chunk = max(self.max_keys // len(self.runs), 1 << 16)
+        positions = [0] * len(self.runs)
+        with open(paths[0], 'wb') as keys_out, open(paths[1], 'wb') as numbers_out:
+            while True:
+                heads = [(i, keys[position:position + chunk])
+                         for i, ((keys, _), position) in enumerate(zip(self.runs, positions)) if position < len(keys)]
+                if not heads:
+                    break
+                limit = min(head[-1] for _, head in heads)
+                parts = []
+                for i, head in heads:
+                    taken = int(np.searchsorted(head, limit, side='right'))
+                    parts.append((head[:taken], self.runs[i][1][positions[i]:positions[i] + taken]))
+                    positions[i] += taken
+                keys = np.concatenate([keys for keys, _ in parts])
+                order = np.argsort(keys, kind='stable')
+                keys[order].tofile(keys_out)
+                np.concatenate([numbers for _, numbers in parts])[order].tofile(numbers_out)
+        old = [run.filename for run_files in self.runs for run in run_files]
+        self.runs = [self._open_run(*paths)]
+        for run_path in old:
+            os.remove(run_path)
+
+    def to_dict(self):
+        return {'duplicates': self.duplicates, 'distinct': self.distinct, 'spills': self.spills,
+                'runs': len(self.runs), 'lookups': self.lookups, 'collisions': self.collisions}
+
+    def close(self):
+        self.runs = []
+        self.log.close()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
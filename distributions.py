@@ -0,0 +1,113 @@
+from datetime import datetime
+import numpy as np
+
+MIN_USERS = 10
+MAX_USERS = 100_000_000
+MAX_AMOUNT = 100000
+
+# an odd prime above MAX_USERS is coprime with every cardinality, so
+# rank * SCRAMBLE % users is a permutation of the ranks
+SCRAMBLE = 2654435761
+
+AMOUNT_DISTRIBUTIONS = {
+    # name: default parameters
+    'loguniform': (1.0, MAX_AMOUNT),  # low, high
+    'lognormal': (3.0, 1.5),          # mu, sigma of log(amount)
+    'pareto': (1.16, 1.0)             # alpha (1.16 is the 80/20 rule), scale
+}
+
+class UserSampler:
+    def __init__(self, users=9999, skew=0.0, hot_users=0, hot_share=0.0):
+        if not MIN_USERS <= users <= MAX_USERS:
+            raise ValueError(f"users must be between {MIN_USERS:,} and {MAX_USERS:,}")
+        if skew < 0 or not 0 <= hot_share <= 1 or not 0 <= hot_users <= users:
+            raise ValueError("skew must be >= 0, hot_share within 0..1 and hot_users within 0..users")
+        self.users = users
+        self.skew = skew
+        self.hot_users = hot_users
+        self.hot_share = hot_share if hot_users else 0.0
+
+    @property
+    def digits(self):
+        return len(str(self.users))
+
+    def user_ids(self, ranks):
+        # popularity ranks 0..users-1 -> ids 1..users; without the scramble the
+        # hottest users would all be small ids next to each other
+        if self.skew == 0 and not self.hot_share:
+            return ranks + 1
+        return ranks * SCRAMBLE % self.users + 1
+
+    def sample(self, rng, n):
+        if self.skew == 0:
+            ranks = rng.integers(0, self.users, size=n)
+        else:
+            # inverse CDF of a power law bounded to [1, users + 1)
+            u = rng.random(n)
+            if self.skew == 1:
+                x = (self.users + 1.0) ** u
+            else:
+                e = 1 - self.skew
+                x = ((self.users + 1.0) ** e * u + (1 - u)) ** (1 / e)
+            ranks = np.minimum(x.astype(np.int64), self.users) - 1
+
+        if self.hot_share:
+            hot = rng.random(n) < self.hot_share
+            ranks[hot] = rng.integers(0, self.hot_users, size=int(hot.sum()))
+        return self.user_ids(ranks)
+
+class AmountSampler:
+    def __init__(self, distribution='loguniform', params=None):
+        if distribution not in AMOUNT_DISTRIBUTIONS:
+            raise ValueError(f"unknown amount distribution: {distribution}")
+        defaults = AMOUNT_DISTRIBUTIONS[distribution]
+        params = tuple(params or ())
+        self.distribution = distribution
+        self.params = params + defaults[len(params):]
+        if len(self.params) != len(defaults):
+            raise ValueError(f"{distribution} takes {len(defaults)} parameters")
+        if distribution == 'loguniform' and not 0 < self.params[0] <= self.params[1]:
+            raise ValueError("loguniform needs 0 < low <= high")
+        if distribution == 'lognormal' and not self.params[1] > 0:
+            raise ValueError("lognormal needs sigma > 0")
+        if distribution == 'pareto' and not (self.params[0] > 0 and self.params[1] >= 0):
+            raise ValueError("pareto needs alpha > 0 and scale >= 0")
+
+    def sample(self, rng, n):
+        a, b = self.params
+        if self.distribution == 'loguniform':
+            amounts = 10 ** rng.uniform(np.log10(a), np.log10(b), size=n)
+        elif self.distribution == 'lognormal':
+            amounts = rng.lognormal(a, b, size=n)
+        else:
+            amounts = (rng.pareto(a, size=n) + 1) * b
+        # the cap keeps every amount within the 4-9 characters rows are sized
+        # for, the floor keeps it a non-negative number the encoder can write
+        return np.round(np.clip(amounts, 0, MAX_AMOUNT), 2)
+
+class DateSampler:
+    def __init__(self, start_date='2024-01-01', days=366, seasonality=0.0, peak_day=350):
+        if isinstance(start_date, str):
+            start_date = datetime.strptime(start_date, '%Y-%m-%d')
+        if days < 1 or not 0 <= seasonality <= 1:
+            raise ValueError("days must be >= 1 and seasonality within 0..1")
+        self.start_date = start_date
+        self.days = days
+        self.seasonality = seasonality
+
+        # daily volume follows a yearly cycle peaking on day `peak_day` of the
+        # year, between 1 - seasonality and 1 + seasonality of the mean
+        self._cumulative = None
+        if seasonality:
+            day_of_year = np.arange(days) + start_date.timetuple().tm_yday - 1
+            weights = 1 + seasonality * np.cos(2 * np.pi * (day_of_year - peak_day) / 365.25)
+            self._cumulative = np.cumsum(weights) / weights.sum()
+
+    def sample(self, rng, n):
+        if self._cumulative is None:
+            days = rng.integers(0, self.days, size=n)
+        else:
+            days = np.minimum(np.searchsorted(self._cumulative, rng.random(n), side='right'), self.days - 1)
+        return np.datetime64(self.start_date, 's') + (
+            days * 86400 + rng.integers(0, 86400, size=n)
+        ).astype('timedelta64[s]')
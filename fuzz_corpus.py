@@ -0,0 +1,146 @@
+import bisect
+import json
+import random
+from datetime import datetime
+from itertools import accumulate
+
+# A case is a literal value or a dict:
+#   {"value": <any>, "weight": 2}
+#   {"repeat": "a", "sizes": [1000, 1000000], "size_weights": [9, 1], "weight": 1}
+# "repeat" cases are oversized payloads; each size is built once and shared.
+
+DATE_CASES = [
+    '2024-13-32 25:61:61',
+    '0000-00-00 00:00:00',
+    '9999-99-99 99:99:99',
+    '',
+    'Not a date',
+    '2024-01-01T00:00:00Z',
+    '1970-01-01 00:00:00',
+    datetime.max.strftime('%Y-%m-%d %H:%M:%S')
+]
+
+# values as they end up in gen_csv's CSV text
+CSV_CASES = {
+    'string': [
+        {'repeat': 'a', 'sizes': [1000000]},
+        '',
+        'NULL',
+        '"\'\\/\b\f\n\r\t',
+        '诶比伊艾弗吉',
+        '★☆⚡⚔',
+        ' ',
+        '\x00\x01\x02\x03'
+    ],
+    'number': [
+        'inf',
+        '-inf',
+        'nan',
+        str(2**53 + 1),
+        str(-(2**53 + 1)),
+        str(2**64),
+        '0.30000000000000004',
+        '-0',
+        '1e308',
+        '1e-308'
+    ],
+    'date': DATE_CASES
+}
+
+# values as they are passed to json.dumps by the websocket servers
+WS_CASES = {
+    'string': [
+        {'repeat': 'a', 'sizes': [1000000]},
+        '',
+        None,
+        '"\'\\/\b\f\n\r\t',
+        '诶比伊艾弗吉',
+        '★☆⚡⚔',
+        ' ',
+        '\x00\x01\x02\x03'
+    ],
+    'number': [
+        float('inf'),
+        float('-inf'),
+        float('nan'),
+        2**53 + 1,
+        -(2**53 + 1),
+        2**64,
+        0.1 + 0.2,
+        -0,
+        1e308,
+        1e-308
+    ],
+    'date': DATE_CASES
+}
+
+DEFAULT_MAX_PAYLOAD_BYTES = 64 * 1024 * 1024
+
+class FuzzCorpus:
+    def __init__(self, cases, max_payload_bytes=DEFAULT_MAX_PAYLOAD_BYTES):
+        self.max_payload_bytes = max_payload_bytes
+        self.payload_bytes = 0
+        self.dropped = []
+        self._payloads = {}
+        self.values = {}
+        self._cumulative = {}
+
+        for field_type, field_cases in cases.items():
+            values = []
+            weights = []
+            for case in field_cases:
+                for value, weight in self._expand(case):
+                    values.append(value)
+                    weights.append(weight)
+            total = sum(weights)
+            self.values[field_type] = values
+            self._cumulative[field_type] = [weight / total for weight in accumulate(weights)]
+
+    @classmethod
+    def from_file(cls, path, defaults=CSV_CASES, max_payload_bytes=DEFAULT_MAX_PAYLOAD_BYTES):
+        # {"extend": true, "string": [...], "number": [...], "date": [...]};
+        # with "extend": false the file replaces the built-in cases
+        with open(path, encoding='utf-8') as f:
+            extra = json.load(f)
+        cases = {} if not extra.pop('extend', True) else {key: list(value) for key, value in defaults.items()}
+        for field_type, field_cases in extra.items():
+            cases.setdefault(field_type, []).extend(field_cases)
+        return cls(cases, max_payload_bytes=max_payload_bytes)
+
+    def _expand(self, case):
+        if not isinstance(case, dict):
+            return [(case, 1.0)]
+        weight = float(case.get('weight', 1.0))
+        if 'repeat' not in case:
+            return [(case['value'], weight)]
+
+        sizes = case['sizes']
+        size_weights = case.get('size_weights', [1.0] * len(sizes))
+        total = sum(size_weights)
+        expanded = []
+        for size, size_weight in zip(sizes, size_weights):
+            payload = self._payload(case['repeat'], size)
+            if payload is None:
+                self.dropped.append((case['repeat'], size))
+                continue
+            expanded.append((payload, weight * size_weight / total))
+        return expanded
+
+    def _payload(self, text, size):
+        key = (text, size)
+        if key not in self._payloads:
+            payload = (text * (size // len(text) + 1))[:size]
+            cost = len(payload.encode())
+            if self.payload_bytes + cost > self.max_payload_bytes:
+                return None
+            self.payload_bytes += cost
+            self._payloads[key] = payload
+        return self._payloads[key]
+
+    def choose(self, field_type, choice=None):
+        # `choice` is a uniform draw in [0, 1); the global random module is
+        # used when the caller does not bring its own
+        if choice is None:
+            choice = random.random()
+        values = self.values[field_type]
+        return values[min(bisect.bisect_right(self._cumulative[field_type], choice), len(values) - 1)]
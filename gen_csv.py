@@ -1,103 +1,192 @@
-import random
 import sys
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
 from pathlib import Path
 import argparse
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import socket
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import columnar
+import rowindex
+from distributions import AMOUNT_DISTRIBUTIONS, AmountSampler, DateSampler, UserSampler
+from timestamps import TimestampEncoder
+from fuzz_corpus import CSV_CASES, DEFAULT_MAX_PAYLOAD_BYTES, FuzzCorpus
+
+FUZZ_FIELDS = ['transaction_id', 'user_id', 'amount', 'date']
+FUZZ_FIELD_TYPES = {
+    'transaction_id': 'string',
+    'user_id': 'number',
+    'amount': 'number',
+    'date': 'date'
+}
+
+# shared by every encoder in the process; the day table grows on demand
+TIMESTAMPS = TimestampEncoder()
+
+# rows are generated in fixed blocks, each from its own counter-based
+# stream keyed by (seed, block), so any row range can be regenerated directly
+ROWS_PER_BLOCK = 65536
+# shard k of a multi-process run generates rows from k * SHARD_ROW_STRIDE on
+SHARD_ROW_STRIDE = 2 ** 40
+# the block columns drawn per row position rather than carried by duplicates
+ROW_COLUMNS = ('error', 'fuzz_field', 'fuzz_choice')
 
 class TransactionGenerator:
-    def __init__(self, error_rate=0.1, duplicate_rate=0.1):
-        self.start_date = datetime(2024, 1, 1)
+    def __init__(self, error_rate=0.1, duplicate_rate=0.1, seed=None, position=0, fuzz_corpus=None,
+                 users=9999, user_skew=0.0, hot_users=0, hot_share=0.0, amount_distribution='loguniform',
+                 amount_params=None, start_date=datetime(2024, 1, 1), days=366, seasonality=0.0):
+        self.user_ids = UserSampler(users, user_skew, hot_users, hot_share)
+        self.amounts = AmountSampler(amount_distribution, amount_params)
+        self.dates = DateSampler(start_date, days, seasonality)
+        self.start_date = self.dates.start_date
         self.error_rate = error_rate
         self.duplicate_rate = duplicate_rate
+        self.fuzz_corpus = fuzz_corpus if fuzz_corpus is not None else FuzzCorpus(CSV_CASES)
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.position = position
+        self._block_cache = (None, None)
         self.last_transaction = None
         
-    def generate_fuzzed_value(self, field_type):
-        fuzz_types = {
-            'string': [
-                lambda: 'a' * 1000000,  
-                lambda: '', 
-                lambda: 'NULL',
-                lambda: '"\'\\/\b\f\n\r\t',
-                lambda: '诶比伊艾弗吉',
-                lambda: '★☆⚡⚔',
-                lambda: ' ',
-                lambda: '\x00\x01\x02\x03'
-            ],
-            'number': [
-                lambda: 'inf',
-                lambda: '-inf',
-                lambda: 'nan',
-                lambda: str(2**53 + 1),
-                lambda: str(-(2**53 + 1)),
-                lambda: str(2**64),
-                lambda: '0.30000000000000004',
-                lambda: '-0',
-                lambda: '1e308',
-                lambda: '1e-308'
-            ],
-            'date': [
-                lambda: '2024-13-32 25:61:61',   
-                lambda: '0000-00-00 00:00:00', 
-                lambda: '9999-99-99 99:99:99', 
-                lambda: '',  
-                lambda: 'Not a date',
-                lambda: '2024-01-01T00:00:00Z',
-                lambda: '1970-01-01 00:00:00', 
-                lambda: datetime.max.strftime('%Y-%m-%d %H:%M:%S')
-            ]
-        }
-        return random.choice(fuzz_types[field_type])()
-
-    def generate_valid_transaction(self):
-        transaction_id = ''.join(random.choices('0123456789', k=20))
-        user_id = random.randint(1, 9999)
-        log_amount = random.uniform(0, 5) 
-        amount = round(min(100000, 10 ** log_amount), 2)
-        
-        random_days = random.randint(0, 365)
-        random_seconds = random.randint(0, 86399)
-        date = self.start_date + timedelta(days=random_days, seconds=random_seconds)
+        # a row is 43 bytes plus the user_id digits plus a 4-9 character amount
+        self.max_row_size = 52 + self.user_ids.digits
+        # the smallest remainder that can always be filled exactly: from there
+        # on the size ranges of k and k + 1 rows overlap
+        self.min_fill_size = -(-MIN_ROW_SIZE // (self.max_row_size - MIN_ROW_SIZE)) * MIN_ROW_SIZE
         
-        transaction = {
-            'transaction_id': transaction_id,
-            'user_id': user_id,
-            'amount': amount,
-            'date': date.strftime('%Y-%m-%d %H:%M:%S')
-        }
+    def stream(self, *key):
+        return np.random.Generator(np.random.Philox(np.random.SeedSequence(self.seed, spawn_key=key)))
         
+    def generate_fuzzed_value(self, field_type, choice=None):
+        return self.fuzz_corpus.choose(field_type, choice)
+
+    def generate_valid_transaction(self):
+        # a fresh row: no duplicate, no fuzzing
+        transaction = batch_row(self.generate_batch(1, duplicates=False), 0)
         self.last_transaction = transaction.copy()
         return transaction
 
     def generate_transaction(self, enable_fuzzing=False):
-        if self.last_transaction and random.random() < self.duplicate_rate:
-            return self.last_transaction
-            
-        transaction = self.generate_valid_transaction()
-        
-        if not enable_fuzzing:
-            return transaction
-            
-        if random.random() < self.error_rate:
-            field = random.choice(['transaction_id', 'user_id', 'amount', 'date'])
-            field_type = {
-                'transaction_id': 'string',
-                'user_id': 'number',
-                'amount': 'number',
-                'date': 'date'
-            }[field]
-            
-            transaction[field] = self.generate_fuzzed_value(field_type)
-            
+        batch = self.generate_batch(1, enable_fuzzing=enable_fuzzing)
+        # last_transaction is the row as generated, before any fuzzing
+        transaction = batch_row(batch, 0, fuzzed=False)
+        self.last_transaction = transaction.copy()
+        if batch['fuzz_value']:
+            transaction[FUZZ_FIELDS[batch['fuzz_field'][0]]] = batch['fuzz_value'][0]
         return transaction
 
-def get_exact_row_size():
-    transaction_id = ''.join(['9'] * 20)
-    user_id = '1000000' 
-    amount = '999999.99'
-    date = '2024-12-31 23:59:59' 
-    
-    row = f"{transaction_id},{user_id},{amount},{date}\n"
-    return len(row.encode()) 
+    def generate_batch(self, n, enable_fuzzing=False, duplicates=True):
+        batch = self.generate_rows(self.position, self.position + n, enable_fuzzing, duplicates)
+        self.position += n
+        return batch
+
+    def generate_rows(self, start, stop, enable_fuzzing=False, duplicates=True):
+        # rows start..stop-1; without `duplicates` every row keeps its own
+        # values instead of replaying the row it duplicates
+        parts = []
+        for block in range(start // ROWS_PER_BLOCK, (stop - 1) // ROWS_PER_BLOCK + 1):
+            columns = self._generate_block(block)
+            first = block * ROWS_PER_BLOCK
+            rows = slice(max(start, first) - first, min(stop, first + ROWS_PER_BLOCK) - first)
+            source = columns['source'][rows] if duplicates else rows
+            parts.append({name: values[rows] if name in ROW_COLUMNS else values[source]
+                          for name, values in columns.items() if name != 'source'})
+        # a range within one block, like every per-row call, is sliced as is
+        columns = parts[0] if len(parts) == 1 else {
+            name: np.concatenate([part[name] for part in parts]) for name in parts[0]
+        }
+
+        errors = columns.pop('error')
+        field = columns.pop('fuzz_field')
+        choice = columns.pop('fuzz_choice')
+        columns['fuzz_field'] = np.where(errors, field, -1).astype(np.int8) if enable_fuzzing \
+            else np.full(stop - start, -1, dtype=np.int8)
+        columns['fuzz_value'] = {
+            int(i): self.generate_fuzzed_value(FUZZ_FIELD_TYPES[FUZZ_FIELDS[field[i]]], choice[i])
+            for i in np.flatnonzero(columns['fuzz_field'] >= 0)
+        }
+        return columns
+
+    def _generate_block(self, block):
+        cached_block, columns = self._block_cache
+        if cached_block == block:
+            return columns
+
+        n = ROWS_PER_BLOCK
+        rng = self.stream(0, block)
+        digits = rng.integers(ord('0'), ord('9') + 1, size=(n, 20), dtype=np.uint8)
+        columns = {
+            'transaction_id': digits.view('S20').ravel(),
+            'user_id': self.user_ids.sample(rng, n),
+            'amount': self.amounts.sample(rng, n),
+            'date': self.dates.sample(rng, n)
+        }
+
+        # a duplicate replays the closest preceding fresh row of its block;
+        # `source` is the row whose values each row carries
+        duplicate = rng.random(n) < self.duplicate_rate
+        duplicate[0] = False
+        columns['source'] = np.maximum.accumulate(np.where(duplicate, 0, np.arange(n)))
+
+        columns['error'] = ~duplicate & (rng.random(n) < self.error_rate)
+        columns['fuzz_field'] = rng.integers(0, len(FUZZ_FIELDS), size=n, dtype=np.int8)
+        columns['fuzz_choice'] = rng.random(n)
+
+        self._block_cache = (block, columns)
+        return columns
+
+    def generate_fill_batch(self, size):
+        # clean rows whose CSV encoding is exactly `size` bytes, with user ids
+        # and amounts picked by their digit count rather than the distributions
+        count = -(-size // self.max_row_size)
+        if not size or count * MIN_ROW_SIZE > size:
+            return None
+
+        lengths = np.full(count, size // count)
+        lengths[:size % count] += 1
+        variable = lengths - 43
+        rng = self.stream(1, self.position)
+        user_digits = rng.integers(np.maximum(1, variable - 9), np.minimum(self.user_ids.digits, variable - 4) + 1)
+        whole_digits = variable - user_digits - 3
+
+        user_low = 10 ** (user_digits - 1)
+        whole_low = 10 ** (whole_digits - 1)
+        whole = rng.integers(whole_low, np.minimum(10 * whole_low, 100001))
+        whole[whole_digits == 6] = 100000
+        cents = np.where(whole == 100000, 0, rng.integers(0, 100, size=count))
+
+        return {
+            'transaction_id': rng.integers(ord('0'), ord('9') + 1, size=(count, 20),
+                                           dtype=np.uint8).view('S20').ravel(),
+            'user_id': rng.integers(user_low, np.minimum(10 * user_low, self.user_ids.users + 1)),
+            'amount': whole + cents / 100,
+            'date': self.dates.sample(rng, count),
+            'fuzz_field': np.full(count, -1, dtype=np.int8),
+            'fuzz_value': {}
+        }
+
+def batch_row(batch, i, fuzzed=True):
+    transaction = {
+        'transaction_id': batch['transaction_id'][i].decode(),
+        'user_id': int(batch['user_id'][i]),
+        'amount': float(batch['amount'][i]),
+        'date': TIMESTAMPS.format_datetime64(batch['date'][i])
+    }
+    if fuzzed and 'fuzz_field' in batch and batch['fuzz_field'][i] >= 0:
+        transaction[FUZZ_FIELDS[batch['fuzz_field'][i]]] = batch['fuzz_value'][i]
+    return transaction
+
+# row size bounds over every generator configuration
+MIN_ROW_SIZE = 48
+MAX_ROW_SIZE = 61
+
+# rows of the first batch of a --size-of compressed shard, which measures the ratio
+CALIBRATION_ROWS = 4096
 
 def transaction_to_csv_line(transaction):
     try:
@@ -110,54 +199,610 @@ def transaction_to_csv_line(transaction):
     except Exception as e:
         return f"{str(transaction['transaction_id'])},{str(transaction['user_id'])},{str(transaction['amount'])},{str(transaction['date'])}\n"
 
-def generate_transactions(target_size_mb, output_file='transactions.csv', error_rate=0, duplicate_rate=0):
-    target_size = target_size_mb * 1024 * 1024
+class CsvEncoder:
+    def __init__(self):
+        self._buffers = {}
+
+    def _buffer(self, name, size, dtype):
+        # grow-only scratch buffers shared by every batch this encoder sees
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.size < size:
+            buffer = self._buffers[name] = np.empty(max(size, 1), dtype=dtype)
+        return buffer[:size]
+
+    def _put_digits(self, out, values, pad=False):
+        scratch = self._buffer('digits', len(values), np.int64)
+        width = out.shape[1]
+        for column in range(width):
+            power = 10 ** (width - 1 - column)
+            np.floor_divide(values, power, out=scratch)
+            np.remainder(scratch, 10, out=scratch)
+            out[:, column] = scratch
+            out[:, column] += ord('0')
+            # leading zeros become zero bytes, squeezed out with the padding
+            if not pad and power > 1:
+                out[values < power, column] = 0
+
+    def encode(self, batch):
+        # returns the batch as a list of byte pieces plus per-row lengths;
+        # the pieces point into buffers reused by the next call
+        n = len(batch['user_id'])
+        cents = np.rint(batch['amount'] * 100).astype(np.int64)
+        whole = cents // 100
+        user_width = len(str(int(batch['user_id'].max())))
+        whole_width = len(str(int(whole.max())))
+        width = 20 + 1 + user_width + 1 + whole_width + 3 + 1 + 19 + 1
+
+        matrix = self._buffer('matrix', n * width, np.uint8).reshape(n, width)
+        matrix[:, :20] = batch['transaction_id'].view(np.uint8).reshape(n, 20)
+        matrix[:, 20] = ord(',')
+        column = 21
+        self._put_digits(matrix[:, column:column + user_width], batch['user_id'])
+        column += user_width
+        matrix[:, column] = ord(',')
+        column += 1
+        self._put_digits(matrix[:, column:column + whole_width], whole)
+        column += whole_width
+        matrix[:, column] = ord('.')
+        self._put_digits(matrix[:, column + 1:column + 3], cents % 100, pad=True)
+        matrix[:, column + 3] = ord(',')
+        TIMESTAMPS.encode(batch['date'], out=matrix[:, -20:-1])
+        matrix[:, -1] = ord('\n')
+
+        keep = np.not_equal(matrix, 0, out=self._buffer('keep', n * width, bool).reshape(n, width))
+        lengths = keep.sum(axis=1)
+        out = self._buffer('out', int(lengths.sum()), np.uint8)
+        np.compress(keep.ravel(), matrix.ravel(), out=out)
+        data = memoryview(out)
+
+        fuzzed = np.flatnonzero(batch['fuzz_field'] >= 0)
+        if not len(fuzzed):
+            return [data], lengths
+
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        pieces = []
+        previous = 0
+        for i in fuzzed:
+            line = transaction_to_csv_line(batch_row(batch, i)).encode()
+            pieces.append(data[offsets[previous]:offsets[i]])
+            pieces.append(line)
+            lengths[i] = len(line)
+            previous = i + 1
+        pieces.append(data[offsets[previous]:])
+        return pieces, lengths
+
+class CsvWriter:
+    def __init__(self, f, size, report_interval=None):
+        self.f = f
+        self.size = size
+        self.written_size = 0
+        self.encoder = CsvEncoder()
+        self.report_interval = report_interval
+        self.started = self._reported = time.perf_counter()
+
+    @property
+    def remaining(self):
+        if self.size is None:
+            return float('inf')
+        return self.size - self.written_size
+
+    def write_batch(self, batch, reserve=0, limit=None):
+        # writes the longest prefix of the batch that leaves `reserve` bytes
+        # of the budget free, or fits in `limit` bytes, and returns the number
+        # of rows written
+        pieces, lengths = self.encoder.encode(batch)
+        rows = len(lengths)
+        total = int(lengths.sum())
+        limit = self.remaining - reserve if limit is None else limit
+        if total > limit:
+            ends = np.cumsum(lengths)
+            rows = int(np.searchsorted(ends, limit, side='right'))
+            total = int(ends[rows - 1]) if rows else 0
+
+        left = total
+        for piece in pieces:
+            if left <= 0:
+                break
+            piece = piece[:left]
+            self.f.write(piece)
+            left -= len(piece)
+
+        self.written_size += total
+        if self.report_interval is not None:
+            self.report()
+        return rows
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self._reported < self.report_interval:
+            return
+        self._reported = now
+        written_mb = self.written_size / (1024*1024)
+        progress = ''
+        if self.size is not None:
+            progress = f" ({(self.written_size / self.size) * 100 if self.size else 100.0:.1f}%)"
+        print(f"\rWritten {written_mb:.1f} MB{progress} - "
+              f"{written_mb / max(now - self.started, 1e-9):.1f} MB/s", end='')
+
+def fill_exactly(writer, generator, enable_fuzzing=False):
+    while writer.remaining >= 1024:
+        rows = min(ROWS_PER_BLOCK, writer.remaining // MIN_ROW_SIZE + 1)
+        batch = generator.generate_batch(rows, enable_fuzzing=enable_fuzzing)
+        
+        # stop early enough that the remainder can still be filled exactly;
+        # only the row that did not fit is skipped, the rest are retried
+        written_rows = writer.write_batch(batch, reserve=generator.min_fill_size)
+        if written_rows < rows:
+            generator.position -= rows - written_rows - 1
+            
+    fill = generator.generate_fill_batch(writer.remaining)
+    if fill is not None:
+        writer.write_batch(fill)
+        
+    if writer.report_interval is not None:
+        writer.report(force=True)
+
+def write_shard(output_file, offset, size, options, start_row=0, report_interval=None):
+    generator = TransactionGenerator(position=start_row, **options)
     
-    row_size = get_exact_row_size()
-    header = 'transaction_id,user_id,transaction_amount,transaction_date\n'
-    header_size = len(header.encode())
+    with open(output_file, 'r+b', buffering=8192*1024) as f:
+        f.seek(offset)
+        writer = CsvWriter(f, size, report_interval=report_interval)
+        fill_exactly(writer, generator, enable_fuzzing=generator.error_rate > 0)
+            
+    return writer.written_size
+
+# each block becomes an independent gzip member / bz2 or xz stream; the
+# concatenation is a valid file for the stdlib modules and command line tools
+CODECS = {
+    'gzip': ('.gz', lambda data, level: gzip.compress(data, compresslevel=level or 6, mtime=0)),
+    'bz2': ('.bz2', lambda data, level: bz2.compress(data, compresslevel=level or 9)),
+    'xz': ('.xz', lambda data, level: lzma.compress(data, preset=level if level is not None else 6))
+}
+
+class BlockCompressor:
+    def __init__(self, f, codec, level=None, threads=None, block_size=4*1024*1024):
+        self.f = f
+        self.codec = codec
+        self.level = level
+        self.block_size = block_size
+        self.raw_size = 0
+        self.compressed_size = 0
+        self._compressed_raw_size = 0
+        self._sample_ratio = None
+        self._buffer = bytearray()
+        self._pending = deque()
+        threads = threads or os.cpu_count() or 1
+        self._max_pending = 2 * threads
+        # zlib, bz2 and lzma release the GIL, so threads compress in parallel
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+
+    def write(self, data):
+        self._buffer += data
+        self.raw_size += len(data)
+        if len(self._buffer) >= self.block_size:
+            self._submit()
+
+    def _submit(self):
+        block, self._buffer = bytes(self._buffer), bytearray()
+        self._pending.append((len(block), self._executor.submit(CODECS[self.codec][1], block, self.level)))
+        while len(self._pending) > self._max_pending:
+            self._write_next()
+
+    def _write_next(self):
+        raw_length, future = self._pending.popleft()
+        data = future.result()
+        self.f.write(data)
+        self.compressed_size += len(data)
+        self._compressed_raw_size += raw_length
+
+    def ratio(self):
+        # the ratio seen so far; before the first block is done a sample of
+        # the buffer is compressed once, so small targets are not sized at a guess
+        if self._compressed_raw_size:
+            return self.compressed_size / self._compressed_raw_size
+        if self._sample_ratio is None and self._buffer:
+            sample = bytes(self._buffer[:self.block_size])
+            self._sample_ratio = len(CODECS[self.codec][1](sample, self.level)) / len(sample)
+        return self._sample_ratio or 0.5
+
+    def estimated_size(self):
+        # compressed bytes so far plus the not yet compressed tail at the ratio
+        return self.compressed_size + (self.raw_size - self._compressed_raw_size) * self.ratio()
+
+    def flush(self):
+        # compresses and writes everything so far, compressed_size is then exact
+        if self._buffer:
+            self._submit()
+        while self._pending:
+            self._write_next()
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_compressed_shard(output_file, size, options, start_row=0, codec='gzip', level=None, threads=None,
+                           size_of='uncompressed', report_interval=None):
+    generator = TransactionGenerator(position=start_row, **options)
+    error_rate = generator.error_rate
+    
+    with open(output_file, 'ab') as raw, BlockCompressor(raw, codec, level, threads) as f:
+        if size_of == 'uncompressed':
+            writer = CsvWriter(f, size, report_interval=report_interval)
+            fill_exactly(writer, generator, enable_fuzzing=error_rate > 0)
+        else:
+            writer = CsvWriter(f, None, report_interval=report_interval)
+            written = 0
+            while f.compressed_size < size:
+                while f.estimated_size() < size:
+                    # a small first batch measures the row size and the ratio,
+                    # then the batches shrink as the estimate approaches the target
+                    budget = max(int((size - f.estimated_size()) / f.ratio()), 1024)
+                    rows = min(ROWS_PER_BLOCK, budget * written // f.raw_size + 1 if written else CALIBRATION_ROWS)
+                    batch = generator.generate_batch(rows, enable_fuzzing=error_rate > 0)
+                    
+                    # like fill_exactly, only the row that did not fit is skipped
+                    written_rows = writer.write_batch(batch, limit=budget)
+                    if written_rows < rows:
+                        generator.position -= rows - written_rows - 1
+                    written += written_rows
+                # the estimate can still fall short; top up with more blocks
+                # until the flushed size reaches the target
+                f.flush()
+            if report_interval is not None:
+                writer.report(force=True)
+                
+    return writer.written_size
+
+def batch_to_columns(batch):
+    columns = {
+        'transaction_id': batch['transaction_id'],
+        'user_id': batch['user_id'].astype(np.int64),
+        'transaction_amount': batch['amount'].astype(np.float64),
+        'transaction_date': batch['date'].astype('datetime64[s]'),
+        'valid': np.ones(len(batch['user_id']), dtype=bool)
+    }
+    # the user id and amount parsers also tell whether the row stays valid
+    parsers = {
+        'transaction_id': lambda value: (value.encode()[:20], True),
+        'user_id': columnar.parse_user_id,
+        'amount': columnar.parse_amount,
+        'date': lambda value: (columnar.parse_date(value), True)
+    }
+    names = dict(zip(FUZZ_FIELDS, columnar.COLUMNS))
+    for i, value in batch['fuzz_value'].items():
+        field = FUZZ_FIELDS[batch['fuzz_field'][i]]
+        columns[names[field]][i], valid = parsers[field](value)
+        columns['valid'][i] &= valid
+    return columns
+
+def write_columnar_shard(output_file, start_row, stop_row, options):
+    generator = TransactionGenerator(**options)
+    columns = columnar.open_columns(output_file, mode='r+')
+    
+    for start in range(start_row, stop_row, ROWS_PER_BLOCK):
+        stop = min(start + ROWS_PER_BLOCK, stop_row)
+        batch = generator.generate_rows(start, stop, enable_fuzzing=generator.error_rate > 0)
+        for name, values in batch_to_columns(batch).items():
+            columns[name][start:stop] = values
+            
+    return stop_row - start_row
+
+def generate_columnar(target_size_mb, output_file, output_format, options, workers=1):
+    rows = columnar.rows_for_size(int(target_size_mb * 1024 * 1024), output_format)
     
-    block_size = 1000
+    # shards cover whole generator blocks, so the rows do not depend on --workers
+    blocks = -(-rows // ROWS_PER_BLOCK)
+    workers = max(1, min(workers, blocks))
+    bounds = [min(rows, blocks * shard // workers * ROWS_PER_BLOCK) for shard in range(workers + 1)]
     
-    generator = TransactionGenerator(error_rate=error_rate, duplicate_rate=duplicate_rate)
+    started = time.perf_counter()
+    columnar.create(output_file, output_format, rows)
     
-    with open(output_file, 'w', buffering=8192*1024) as f:
-        f.write(header)
-        written_size = header_size
+    if workers == 1:
+        write_columnar_shard(output_file, 0, rows, options)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(write_columnar_shard, output_file, start, stop, options)
+                for start, stop in zip(bounds, bounds[1:])
+            ]
+            for done, future in enumerate(futures, 1):
+                future.result()
+                print(f"\rShards done - {done}/{workers}", end='')
+    
+    elapsed = time.perf_counter() - started
+    paths = list(Path(output_file).glob('*.npy')) if output_format == 'columns' else [Path(output_file)]
+    final_size = sum(path.stat().st_size for path in paths)
+    print(f"\nGenerated {rows:,} {output_format} rows, {final_size / (1024*1024):.2f} MB "
+          f"in {elapsed:.2f} s ({final_size / (1024*1024) / max(elapsed, 1e-9):.1f} MB/s)")
+
+def generate_compressed(target_size_mb, output_file, codec, options, workers=1, level=None, threads=None,
+                        size_of='uncompressed'):
+    target_size = int(target_size_mb * 1024 * 1024)
+    
+    header = b'transaction_id,user_id,transaction_amount,transaction_date\n'
+    header_member = CODECS[codec][1](header, level)
+    body_size = max(target_size - len(header if size_of == 'uncompressed' else header_member), 0)
+    
+    workers = max(1, min(workers, body_size // (1024 * 1024)))
+    shard_sizes = [body_size // workers] * workers
+    shard_sizes[-1] += body_size % workers
+    threads = threads or os.cpu_count() or 1
+    
+    started = time.perf_counter()
+    with open(output_file, 'wb') as f:
+        f.write(header_member)
         
-        while written_size < target_size:
-            block = ''
-            for _ in range(block_size):
-                transaction = generator.generate_transaction(enable_fuzzing=error_rate > 0)
-                line = transaction_to_csv_line(transaction)
+    if workers == 1:
+        raw_size = write_compressed_shard(output_file, body_size, options, 0, codec, level, threads, size_of,
+                                          report_interval=1.0)
+    else:
+        # shards compress into part files that are appended in order afterwards
+        parts = [f"{output_file}.part{shard}" for shard in range(workers)]
+        raw_size = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(write_compressed_shard, part, size, options, shard * SHARD_ROW_STRIDE,
+                                codec, level, max(1, threads // workers), size_of)
+                for shard, (part, size) in enumerate(zip(parts, shard_sizes))
+            ]
+            for done, future in enumerate(futures, 1):
+                raw_size += future.result()
+                print(f"\rShards done - {done}/{workers}", end='')
                 
-                if written_size + len((block + line).encode()) > target_size:
-                    break
-                    
-                block += line
-            
-            if not block:  
+        with open(output_file, 'ab') as f:
+            for part in parts:
+                with open(part, 'rb') as part_file:
+                    shutil.copyfileobj(part_file, f, 16 * 1024 * 1024)
+                os.remove(part)
+    
+    elapsed = time.perf_counter() - started
+    raw_size += len(header)
+    final_size = Path(output_file).stat().st_size
+    print(f"\nGenerated file size: {final_size / (1024*1024):.2f} MB {codec} "
+          f"({raw_size / (1024*1024):.2f} MB uncompressed, targeting the {size_of} size) "
+          f"in {elapsed:.2f} s ({raw_size / (1024*1024) / max(elapsed, 1e-9):.1f} MB/s uncompressed)")
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.perf_counter()
+
+    def consume(self, amount):
+        # tokens may go negative; the debt is paid off by sleeping, and a
+        # stalled reader only ever refills the bucket up to `burst`
+        now = time.perf_counter()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.rate)
+
+def open_stream(output):
+    if output == '-':
+        return sys.stdout.buffer
+    if output.startswith('tcp://'):
+        host, port = output[len('tcp://'):].rsplit(':', 1)
+        with socket.create_connection((host, int(port))) as sock:
+            # the file object keeps the connection open after `sock` is closed
+            return sock.makefile('wb')
+    # regular files and named pipes; opening a FIFO waits for its reader
+    rowindex.discard(output)
+    return open(output, 'wb')
+
+def stream_transactions(output='-', rate_rows=None, rate_mb=None, duration=None, limit_mb=None,
+                        error_rate=0, duplicate_rate=0, seed=None, report_interval=5.0, **generator_options):
+    header = b'transaction_id,user_id,transaction_amount,transaction_date\n'
+    seed = np.random.SeedSequence(seed).entropy
+    print(f"Seed: {seed}", file=sys.stderr)
+    
+    # about twenty batches per second keeps the output smooth at any rate
+    rows = ROWS_PER_BLOCK
+    buckets = []
+    requested = []
+    if rate_rows:
+        rows = min(rows, max(1, int(rate_rows / 20)))
+        buckets.append((TokenBucket(rate_rows, max(rate_rows / 10, rows)), 'rows'))
+        requested.append(f"{rate_rows:,.0f} rows/s")
+    if rate_mb:
+        rate_bytes = rate_mb * 1024 * 1024
+        rows = min(rows, max(1, int(rate_bytes / 20 / MIN_ROW_SIZE)))
+        buckets.append((TokenBucket(rate_bytes, max(rate_bytes / 10, rows * MAX_ROW_SIZE)), 'bytes'))
+        requested.append(f"{rate_mb:.2f} MB/s")
+    requested = ' and '.join(requested) or 'unlimited'
+    
+    generator = TransactionGenerator(error_rate=error_rate, duplicate_rate=duplicate_rate, seed=seed,
+                                     **generator_options)
+    f = open_stream(output)
+    limit = int(limit_mb * 1024 * 1024) - len(header) if limit_mb is not None else None
+    writer = CsvWriter(f, limit)
+    total_rows = 0
+    reason = 'done'
+    
+    started = reported = time.perf_counter()
+    reported_rows = reported_bytes = 0
+    try:
+        f.write(header)
+        while writer.remaining >= MIN_ROW_SIZE:
+            now = time.perf_counter()
+            if duration is not None and now - started >= duration:
                 break
                 
-            f.write(block)
-            written_size += len(block.encode())
+            before = writer.written_size
+            batch = generator.generate_batch(rows, enable_fuzzing=generator.error_rate > 0)
+            written_rows = writer.write_batch(batch)
+            f.flush()
+            total_rows += written_rows
+            if not written_rows:
+                break
+            
+            for bucket, unit in buckets:
+                bucket.consume(written_rows if unit == 'rows' else writer.written_size - before)
             
-            progress = (written_size / target_size) * 100
-            print(f"\rProgress - {progress:.1f}%", end='')
+            now = time.perf_counter()
+            if now - reported >= report_interval:
+                interval = now - reported
+                print(f"Streamed {total_rows:,} rows, {writer.written_size / (1024*1024):.1f} MB - "
+                      f"{(total_rows - reported_rows) / interval:,.0f} rows/s, "
+                      f"{(writer.written_size - reported_bytes) / (1024*1024) / interval:.2f} MB/s "
+                      f"(requested {requested})", file=sys.stderr)
+                reported, reported_rows, reported_bytes = now, total_rows, writer.written_size
+    except (BrokenPipeError, ConnectionResetError):
+        reason = 'reader closed the stream'
+    except KeyboardInterrupt:
+        reason = 'interrupted'
+    finally:
+        try:
+            if f is not sys.stdout.buffer:
+                f.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+            
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    print(f"Stream finished ({reason}): {total_rows:,} rows, {writer.written_size / (1024*1024):.2f} MB "
+          f"in {elapsed:.1f} s - {total_rows / elapsed:,.0f} rows/s, "
+          f"{writer.written_size / (1024*1024) / elapsed:.2f} MB/s (requested {requested})", file=sys.stderr)
+
+def generate_transactions(target_size_mb, output_file='transactions.csv', error_rate=0, duplicate_rate=0,
+                          workers=1, seed=None, output_format='csv', compression=None, compression_level=None,
+                          compression_threads=None, size_of='uncompressed', index_every=None, **generator_options):
+    # everything a shard needs to rebuild the same TransactionGenerator
+    options = dict(error_rate=error_rate, duplicate_rate=duplicate_rate,
+                   seed=np.random.SeedSequence(seed).entropy, **generator_options)
+    print(f"Seed: {options['seed']}")
+    # an index of the file being replaced must not outlive it
+    rowindex.discard(output_file)
     
+    if output_format != 'csv':
+        return generate_columnar(target_size_mb, output_file, output_format, options, workers)
+    if compression is not None:
+        return generate_compressed(target_size_mb, output_file, compression, options, workers,
+                                   compression_level, compression_threads, size_of)
+    
+    target_size = int(target_size_mb * 1024 * 1024)
+    
+    header = b'transaction_id,user_id,transaction_amount,transaction_date\n'
+    body_size = max(target_size - len(header), 0)
+    
+    # every shard needs enough room to be filled up to its exact budget
+    workers = max(1, min(workers, body_size // (1024 * 1024)))
+    shard_sizes = [body_size // workers] * workers
+    shard_sizes[-1] += body_size % workers
+    shard_offsets = np.cumsum([len(header)] + shard_sizes[:-1])
+    
+    started = time.perf_counter()
+    with open(output_file, 'wb') as f:
+        f.write(header)
+        f.truncate(len(header) + body_size)
+        
+    if workers == 1:
+        written_size = write_shard(output_file, len(header), body_size, options, report_interval=1.0)
+        index_shards = [rowindex.scan(output_file, len(header), len(header) + written_size, index_every)] \
+            if index_every else []
+    else:
+        written_size = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(write_shard, output_file, int(offset), size, options, shard * SHARD_ROW_STRIDE)
+                for shard, (offset, size) in enumerate(zip(shard_offsets, shard_sizes))
+            ]
+            for done, future in enumerate(futures, 1):
+                written_size += future.result()
+                print(f"\rShards done - {done}/{workers}", end='')
+                
+            # every shard ends with a complete row, so each one is indexed on
+            # its own and the row numbers are offset afterwards
+            futures = [
+                executor.submit(rowindex.scan, output_file, int(offset), int(offset) + size, index_every)
+                for offset, size in zip(shard_offsets, shard_sizes)
+            ] if index_every else []
+            index_shards = [future.result() for future in futures]
+                
+    if written_size < body_size:
+        # only a tiny single-shard target can fall short of an exact fill
+        with open(output_file, 'r+b') as f:
+            f.truncate(len(header) + written_size)
+    
+    elapsed = time.perf_counter() - started
     final_size = Path(output_file).stat().st_size
-    print(f"\nGenerated file size: {final_size / (1024*1024):.2f} MB")
+    print(f"\nGenerated file size: {final_size / (1024*1024):.2f} MB "
+          f"in {elapsed:.2f} s ({final_size / (1024*1024) / max(elapsed, 1e-9):.1f} MB/s)")
+    
+    if index_every:
+        index = rowindex.RowIndex.from_shards(index_every, final_size, index_shards)
+        index.save(output_file)
+        print(f"Indexed {index.rows:,} rows every {index_every:,} rows into {rowindex.index_path(output_file)}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Generate CSV file with transactions')
-    parser.add_argument('--size', type=float, required=True,
-                        help='Target file size in MB')
+    parser.add_argument('--size', type=float, default=None,
+                        help='Target file size in MB (an optional limit with --stream)')
     parser.add_argument('--error-rate', type=float, default=0.0,
                         help='Probability of generating fuzzy data (0.0 to 1.0)')
     parser.add_argument('--duplicate-rate', type=float, default=0.0,
                         help='Probability of duplicating previous transaction (0.0 to 1.0)')
+    parser.add_argument('--users', type=int, default=9999,
+                        help='Number of distinct user ids (10 to 100,000,000)')
+    parser.add_argument('--user-skew', type=float, default=0.0,
+                        help='Zipf exponent of user popularity (0 is uniform, 1 is classic Zipf)')
+    parser.add_argument('--hot-users', type=int, default=0,
+                        help='Number of hot users receiving --hot-share of all transactions')
+    parser.add_argument('--hot-share', type=float, default=0.0,
+                        help='Share of transactions going to the --hot-users (0.0 to 1.0)')
+    parser.add_argument('--amount-dist', choices=list(AMOUNT_DISTRIBUTIONS), default='loguniform',
+                        help='Amount distribution, capped at 100000')
+    parser.add_argument('--amount-params', type=float, nargs='+', default=None,
+                        help='loguniform: LOW HIGH (1 100000), lognormal: MU SIGMA (3 1.5), '
+                             'pareto: ALPHA SCALE (1.16 1)')
+    parser.add_argument('--start-date', type=str, default='2024-01-01',
+                        help='First transaction date (YYYY-MM-DD)')
+    parser.add_argument('--days', type=int, default=366,
+                        help='Number of days covered by the transaction dates')
+    parser.add_argument('--seasonality', type=float, default=0.0,
+                        help='Amplitude of the yearly volume cycle peaking in mid-December (0.0 to 1.0)')
     parser.add_argument('--output', type=str, default='transactions.csv',
                         help='Output file name')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes writing independent shards of the file')
+    parser.add_argument('--format', choices=['csv'] + columnar.FORMATS, default='csv',
+                        help='csv text, one .npy file of fixed-width records, or a directory of per-column .npy files')
+    parser.add_argument('--compress', choices=list(CODECS), default=None,
+                        help='Compress the CSV output in independent blocks on a thread pool')
+    parser.add_argument('--compress-level', type=int, default=None,
+                        help='Compression level (codec default if omitted)')
+    parser.add_argument('--compress-threads', type=int, default=None,
+                        help='Compression threads in total (default: number of cores)')
+    parser.add_argument('--size-of', choices=['uncompressed', 'compressed'], default='uncompressed',
+                        help='Whether --size is the exact uncompressed CSV size or the approximate '
+                             'compressed file size (within about one block)')
+    parser.add_argument('--index', type=int, default=None, metavar='K',
+                        help='Also write a <output>.idx sidecar with the byte offset of every K-th row')
+    parser.add_argument('--fuzz-corpus', type=str, default=None,
+                        help='JSON file with extra (or replacement) fuzz cases and weights')
+    parser.add_argument('--fuzz-max-payload', type=float, default=DEFAULT_MAX_PAYLOAD_BYTES / (1024 * 1024),
+                        help='Memory cap in MB for the shared oversized fuzz payloads')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for reproducible output (same seed, size and workers give identical files)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream CSV to --output (a file, a named pipe, - for stdout or tcp://host:port) '
+                             'until --duration or --size is reached')
+    parser.add_argument('--rate-rows', type=float, default=None,
+                        help='Target stream rate in rows per second')
+    parser.add_argument('--rate-mb', type=float, default=None,
+                        help='Target stream rate in MB per second')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='Stop streaming after this many seconds')
+    parser.add_argument('--report-interval', type=float, default=5.0,
+                        help='Seconds between achieved vs. requested rate reports on stderr')
     
     args = parser.parse_args()
     
@@ -165,9 +810,75 @@ if __name__ == "__main__":
         print("Error: rates must be between 0.0 and 1.0")
         sys.exit(1)
         
+    distribution_options = dict(
+        users=args.users,
+        user_skew=args.user_skew,
+        hot_users=args.hot_users,
+        hot_share=args.hot_share,
+        amount_distribution=args.amount_dist,
+        amount_params=args.amount_params,
+        start_date=args.start_date,
+        days=args.days,
+        seasonality=args.seasonality
+    )
+    try:
+        TransactionGenerator(**distribution_options)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+        
+    max_payload = int(args.fuzz_max_payload * 1024 * 1024)
+    if args.fuzz_corpus:
+        fuzz_corpus = FuzzCorpus.from_file(args.fuzz_corpus, max_payload_bytes=max_payload)
+    else:
+        fuzz_corpus = FuzzCorpus(CSV_CASES, max_payload_bytes=max_payload)
+    for text, size in fuzz_corpus.dropped:
+        print(f"Warning: skipping {size:,}-character fuzz payload, over the --fuzz-max-payload cap")
+        
+    if args.stream:
+        stream_transactions(
+            args.output,
+            rate_rows=args.rate_rows,
+            rate_mb=args.rate_mb,
+            duration=args.duration,
+            limit_mb=args.size,
+            error_rate=args.error_rate,
+            duplicate_rate=args.duplicate_rate,
+            seed=args.seed,
+            report_interval=args.report_interval,
+            fuzz_corpus=fuzz_corpus,
+            **distribution_options
+        )
+        sys.exit(0)
+        
+    if args.size is None:
+        print("Error: --size is required unless --stream is used")
+        sys.exit(1)
+        
+    if args.compress and args.format != 'csv':
+        print("Error: --compress only applies to csv output")
+        sys.exit(1)
+        
+    if args.index is not None and (args.index < 1 or args.compress or args.format != 'csv'):
+        print("Error: --index needs a positive K and uncompressed csv output")
+        sys.exit(1)
+        
+    if args.compress and not args.output.endswith(CODECS[args.compress][0]):
+        args.output += CODECS[args.compress][0]
+        
     generate_transactions(
         args.size,
         output_file=args.output,
         error_rate=args.error_rate,
-        duplicate_rate=args.duplicate_rate
+        duplicate_rate=args.duplicate_rate,
+        workers=args.workers,
+        seed=args.seed,
+        output_format=args.format,
+        compression=args.compress,
+        compression_level=args.compress_level,
+        compression_threads=args.compress_threads,
+        size_of=args.size_of,
+        index_every=args.index,
+        fuzz_corpus=fuzz_corpus,
+        **distribution_options
     )
\ No newline at end of file
@@ -0,0 +1,215 @@
+import bz2
+import io
+import itertools
+import lzma
+import mmap
+import os
+import queue
+import threading
+import zlib
+
+# the codecs gen_csv --compress writes: every block is its own gzip member or
+# bz2/xz stream, which is what lets the parallel engine split such files
+MAGIC = {'gzip': b'\x1f\x8b', 'bz2': b'BZh', 'xz': b'\xfd7zXZ\x00'}
+EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+# where a member can start: the gzip magic with deflate, a bz2 stream with
+# its first block, an xz stream
+MEMBER_START = {'gzip': b'\x1f\x8b\x08', 'bz2': b'BZh', 'xz': b'\xfd7zXZ\x00'}
+BZ2_BLOCK_MAGIC = b'1AY&SY'
+DECOMPRESS_ERRORS = (zlib.error, OSError, EOFError, lzma.LZMAError)
+
+# compressed bytes read at a time, and decompressed blocks waiting for the
+# parser at most
+READ_SIZE = 4 * 1024 * 1024
+QUEUE_BLOCKS = 4
+BUFFER_SIZE = 1024 * 1024
+# compressed bytes decompressed to tell a real member start from a lookalike
+PROBE_SIZE = 64 * 1024
+# compressed bytes searched for a member start after each split point
+# first; gen_csv writes a member per 4 MiB of rows
+SCAN_WINDOW = 1024 * 1024
+
+def detect_compression(path):
+    # codec of a file from its magic bytes, else from its extension; None
+    # for plain files and directories
+    if os.path.isdir(path):
+        return None
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    for codec, magic in MAGIC.items():
+        if head.startswith(magic):
+            return codec
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+def decompressor(codec):
+    if codec == 'gzip':
+        return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    if codec == 'bz2':
+        return bz2.BZ2Decompressor()
+    return lzma.LZMADecompressor()
+
+def decompress_range(path, codec, start=0, end=None):
+    # the decompressed bytes of the members in path[start:end], one after
+    # another; `start` and `end` must be member boundaries, a member running
+    # past `end` raises EOFError
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        current = decompressor(codec)
+        fed = False
+        while remaining is None or remaining > 0:
+            data = f.read(READ_SIZE if remaining is None else min(READ_SIZE, remaining))
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            while data:
+                fed = True
+                output = current.decompress(data)
+                if output:
+                    yield output
+                if not current.eof:
+                    break
+                data = current.unused_data
+                current = decompressor(codec)
+                fed = False
+        if fed and not current.eof:
+            raise EOFError("сжатый файл оборван посреди потока")
+
+def read_range(path, start=0, end=None, buffers=QUEUE_BLOCKS + 2):
+    # the bytes of path[start:end] as views of `buffers` preallocated
+    # READ_SIZE buffers filled with readinto() in turn, so a view is only
+    # valid until `buffers` - 1 more blocks were taken
+    views = [memoryview(bytearray(READ_SIZE)) for _ in range(buffers)]
+    with open(path, 'rb', buffering=0) as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        for block in itertools.count():
+            view = views[block % buffers]
+            if remaining is not None:
+                view = view[:min(READ_SIZE, remaining)]
+            size = f.readinto(view)
+            if not size:
+                break
+            if remaining is not None:
+                remaining -= size
+            yield view[:size]
+
+class _PrefetchRaw(io.RawIOBase):
+    # decompress_range(), or read_range() for plain files, run by a thread
+    # into a bounded queue, so that reading and decompression overlap with
+    # parsing (file reads, zlib, bz2 and lzma release the GIL). The queue
+    # holds at most queue_blocks views, so with queue_blocks + 2 buffers the
+    # thread never fills the one still being read from
+    def __init__(self, path, codec, start=0, end=None, queue_blocks=QUEUE_BLOCKS):
+        super().__init__()
+        self.blocks = queue.Queue(maxsize=queue_blocks)
+        self.block = b''
+        self.offset = 0
+        self.position = 0
+        self.finished = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(path, codec, start, end), daemon=True)
+        self.thread.start()
+
+    def _run(self, path, codec, start, end):
+        try:
+            if codec is None:
+                blocks = read_range(path, start, end, self.blocks.maxsize + 2)
+            else:
+                blocks = decompress_range(path, codec, start, end)
+            for block in blocks:
+                if not self._put(block):
+                    return
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(None)
+
+    def _put(self, item):
+        # False once the reader was closed before the end
+        while not self.stopping.is_set():
+            try:
+                self.blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.offset >= len(self.block):
+            if self.finished:
+                return 0
+            item = self.blocks.get()
+            if item is None or isinstance(item, Exception):
+                self.finished = True
+                if item is not None:
+                    raise item
+                return 0
+            self.block, self.offset = item, 0
+        size = min(len(buffer), len(self.block) - self.offset)
+        buffer[:size] = memoryview(self.block)[self.offset:self.offset + size]
+        self.offset += size
+        self.position += size
+        return size
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.stopping.set()
+        super().close()
+
+def open_input(path, codec=None, start=0, end=None, prefetch=False):
+    # a binary file over the (decompressed) content of `path`; compressed
+    # input is read from path[start:end], which must be member boundaries.
+    # Plain files are read by a thread from `start` too with `prefetch`
+    codec = codec or detect_compression(path)
+    if codec is None and not prefetch:
+        return open(path, 'rb')
+    return io.BufferedReader(_PrefetchRaw(path, codec, start, end), BUFFER_SIZE)
+
+def _is_member_start(data, offset, codec):
+    # whether decompressing from `offset` gets past a probe without errors
+    if codec == 'bz2' and data[offset + 4:offset + 10] != BZ2_BLOCK_MAGIC:
+        return False
+    try:
+        decompressor(codec).decompress(data[offset:offset + PROBE_SIZE])
+    except DECOMPRESS_ERRORS:
+        return False
+    return True
+
+def _next_member(data, start, size, codec):
+    # the first member start at or after `start`, None if there is none; the
+    # search looks at a window after `start` that doubles while it finds none
+    magic = MEMBER_START[codec]
+    window = SCAN_WINDOW
+    while start < size:
+        stop = min(start + window, size)
+        # a magic may run past the window, not start after it
+        offset = data.find(magic, start, stop + len(magic) - 1)
+        while offset >= 0:
+            if _is_member_start(data, offset, codec):
+                return offset
+            offset = data.find(magic, offset + 1, stop + len(magic) - 1)
+        start, window = stop, window * 2
+    return None
+
+def member_bounds(path, codec, parts):
+    # up to `parts` + 1 offsets of member starts, from 0 to the file size,
+    # that cut the file into ranges of about equal compressed size; a file
+    # of one member stays one range
+    size = os.path.getsize(path)
+    if size == 0 or parts <= 1:
+        return [0, size]
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        bounds = [0]
+        for target in range(1, parts):
+            offset = _next_member(mm, max(size * target // parts, bounds[-1] + 1), size, codec)
+            if offset is None:
+                break
+            bounds.append(offset)
+    return sorted(set(bounds)) + [size]
@@ -0,0 +1,128 @@
+import cProfile
+import os
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+
+# stages are timed per block or chunk, never per row, so that even enabled
+# instrumentation costs a few calls per megabyte; disabled it is NULL_STATS,
+# whose methods do nothing
+class _Stage:
+    __slots__ = ('stats', 'name', 'started')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.timings[self.name] += time.perf_counter() - self.started
+        return False
+
+class Stats:
+    enabled = True
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.workers = {}
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def add_worker(self, worker_stats):
+        # the to_dict() of a Stats filled in a worker process, summed per pid
+        if worker_stats is None:
+            return
+        worker = self.workers.setdefault(worker_stats['pid'], {'chunks': 0, 'timings': defaultdict(float),
+                                                               'counters': defaultdict(int)})
+        worker['chunks'] += 1
+        for name, value in worker_stats['timings'].items():
+            worker['timings'][name] += value
+        for name, value in worker_stats['counters'].items():
+            worker['counters'][name] += value
+
+    def to_dict(self):
+        return {
+            'pid': os.getpid(),
+            'timings': dict(self.timings),
+            'counters': dict(self.counters),
+            'workers': {pid: {'chunks': worker['chunks'], 'timings': dict(worker['timings']),
+                              'counters': dict(worker['counters'])}
+                        for pid, worker in self.workers.items()}
+        }
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class NullStats:
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def count(self, name, value=1):
+        pass
+
+    def add_worker(self, worker_stats):
+        pass
+
+    def to_dict(self):
+        return None
+
+NULL_STATS = NullStats()
+
+class Profiler:
+    # opt-in cProfile and tracemalloc capture around the analysis; both only
+    # see the current process, not the parallel engine's workers
+    def __init__(self, profile_path=None, trace_memory=False, limit=15):
+        self.profile_path = profile_path
+        self.trace_memory = trace_memory
+        self.limit = limit
+        self.profile = cProfile.Profile() if profile_path else None
+        self.report = {}
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profile:
+            self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile:
+            self.profile.disable()
+            self.profile.dump_stats(self.profile_path)
+            self.report['profile'] = self._profile_report()
+        if self.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.report['memory'] = {
+                'peak': peak,
+                'top': [{'where': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                         'size': stat.size, 'count': stat.count}
+                        for stat in snapshot.statistics('lineno')[:self.limit]]
+            }
+        return False
+
+    def _profile_report(self):
+        stats = pstats.Stats(self.profile)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:self.limit]
+        return [{'function': f"{os.path.basename(filename)}:{line}({name})", 'calls': calls,
+                 'total': total, 'cumulative': cumulative}
+                for (filename, line, name), (_, calls, total, cumulative, _) in rows]
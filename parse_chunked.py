@@ -1,59 +1,53 @@
-import pandas as pd
+import numpy as np
 import sys
 import time
-from typing import Dict, Tuple
+from aggregate import Aggregate
+from inputs import open_input
+from instrument import NULL_STATS
+from parse_pandas import BLOCK_SIZE, COLUMNS, add_rows, read_rows, valid_rows
+from report import AnalysisResult, print_report
+from tokenizer import rows
 
-def process_chunk(chunk: pd.DataFrame, totals: Dict[int, Tuple[float, int]]):
-    for _, row in chunk.iterrows():
-        try:
-            user_id = int(row['user_id'])
-            amount = float(row['transaction_amount'])
-            
-            if user_id in totals:
-                total_sum, count = totals[user_id]
-                totals[user_id] = (total_sum + amount, count + 1)
-            else:
-                totals[user_id] = (amount, 1)
-                
-        except (ValueError, TypeError):
-            continue
+def process_chunk(data, totals: Aggregate, stats=NULL_STATS):
+    # only the per-user sums of the chunk reach the aggregate
+    with stats.stage('read'):
+        frame = read_rows(data, COLUMNS)
+    with stats.stage('validate'):
+        block = valid_rows(data, frame)
+    with stats.stage('aggregate'):
+        add_rows(totals, *block)
     
     return totals
 
+def aggregate_file(csv_file: str, chunk_size: int = 100000, stats=NULL_STATS, aggregate=None) -> Aggregate:
+    # chunks of `chunk_size` rows, read as int64 / float64 columns where
+    # they convert (see parse_pandas.read_rows)
+    user_totals = Aggregate() if aggregate is None else aggregate
+    with open_input(csv_file) as f:
+        blocks = rows(f, BLOCK_SIZE)
+        
+        while True:
+            with stats.stage('read'):
+                data = next(blocks, None)
+            if data is None:
+                break
+            ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n')) + 1
+            bounds = [0] + ends[chunk_size - 1::chunk_size].tolist()
+            if bounds[-1] < len(data):
+                bounds.append(len(data))
+            for start, end in zip(bounds, bounds[1:]):
+                stats.count('chunks')
+                user_totals = process_chunk(data[start:end], user_totals, stats)
+                user_totals.check_memory()
+                print(f"\rОбработано строк: {user_totals.total_rows:,}", end='')
+        
+    return user_totals
+
 def analyze_top_users(csv_file: str, chunk_size: int = 100000):
     try:
         start_time = time.time()
-        user_totals = {}
-        total_rows = 0
-        
-        for chunk in pd.read_csv(csv_file, chunksize=chunk_size):
-            total_rows += len(chunk)
-            user_totals = process_chunk(chunk, user_totals)
-            print(f"\rОбработано строк: {total_rows:,}", end='')
-            
-        top_users = sorted(
-            [(user_id, total, count) 
-             for user_id, (total, count) in user_totals.items()],
-            key=lambda x: x[1],
-            reverse=True
-        )[:5]
-        
-        print("\n\nТоп 5 пользователей по сумме транзакций:")
-        print("-" * 80)
-        print(f"{'User ID':<10} {'Total Amount':>15} {'Transactions':>15} {'Avg Amount':>15}")
-        print("-" * 80)
-        
-        for user_id, total, count in top_users:
-            avg = total / count
-            print(f"{user_id:<10} {total:>15.2f} {count:>15d} {avg:>15.2f}")
-            
-        total_sum = sum(total for _, total, _ in user_totals.items())
-        print(f"\nВсего пользователей: {len(user_totals):,}")
-        print(f"Всего транзакций: {total_rows:,}")
-        print(f"Общая сумма всех транзакций: {total_sum:,.2f}")
-        
-        end_time = time.time()
-        print(f"\nВремя выполнения: {end_time - start_time:.2f} секунд")
+        aggregate = aggregate_file(csv_file, chunk_size)
+        print_report(AnalysisResult('chunked', csv_file, aggregate, time.time() - start_time))
             
     except Exception as e:
         print(f"\nОшибка при обработке файла: {e}")
@@ -0,0 +1,53 @@
+import sys
+import time
+import numpy as np
+import columnar
+from aggregate import Aggregate
+from instrument import NULL_STATS
+from report import AnalysisResult, print_report
+
+BLOCK_ROWS = 4 * 1024 * 1024
+
+def aggregate_file(path: str, stats=NULL_STATS) -> Aggregate:
+    columns = columnar.open_columns(path)
+    user_ids = columns['user_id']
+    amounts = columns['transaction_amount']
+    validity = columns['valid']
+
+    aggregate = Aggregate()
+    total_rows = len(user_ids)
+
+    # inf/nan amounts are valid floats, exactly as in parse_native; the
+    # generator stored which rows are valid
+    with np.errstate(over='ignore', invalid='ignore'):
+        for start in range(0, total_rows, BLOCK_ROWS):
+            users = user_ids[start:start + BLOCK_ROWS]
+            amount = amounts[start:start + BLOCK_ROWS]
+
+            with stats.stage('validate'):
+                valid = np.asarray(validity[start:start + BLOCK_ROWS], dtype=bool)
+            with stats.stage('aggregate'):
+                aggregate.add_invalid(len(valid) - int(valid.sum()))
+                aggregate.add_many(users[valid], amount[valid])
+
+            print(f"\rОбработано строк: {min(start + BLOCK_ROWS, total_rows):,}", end='')
+
+    return aggregate
+
+def analyze_top_users(path: str):
+    try:
+        start_time = time.time()
+        aggregate = aggregate_file(path)
+        print_report(AnalysisResult('columnar', path, aggregate, time.time() - start_time))
+            
+    except Exception as e:
+        print(f"\nОшибка при обработке файла: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Использование: python parse_columnar.py <path_to_npy_file_or_directory>")
+        sys.exit(1)
+
+    path = sys.argv[1]
+    analyze_top_users(path)
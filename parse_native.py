@@ -2,73 +2,282 @@ import csv
 import sys
 import time
 from array import array
-from collections import defaultdict
+from bisect import bisect_left
+import numpy as np
+import checkpoint
+from aggregate import Aggregate
+from dedup import Ids, keys_of
+from inputs import open_input
+from tokenizer import after_line, broken_rows, cut, is_fragment, join_rows, locate, reject_records
+from instrument import NULL_STATS
+from report import AnalysisResult, print_report
 
-def analyze_top_users(csv_file: str):
-    try:
-        start_time = time.time()
-        
-        amounts = defaultdict(lambda: array('d', [0.0]))
-        counts = defaultdict(int)
-        total_sum = 0.0
-        total_rows = 0
-        invalid_rows = 0
+BLOCK_SIZE = 16 * 1024 * 1024
+
+def parse_lines(lines, aggregate: Aggregate, metrics=None, dedup=None, whole=False):
+    # lines outside the fast loop below, decoded like text mode: the rest of
+    # the header line, an unterminated last line and lines whose fields do
+    # not parse as ASCII. With `whole` the lines are a stretch of the file
+    # and rows broken by raw line breaks are put back together first (see
+    # tokenizer). Returns the (first, last) indices of the lines that are
+    # not rows
+    if dedup is not None:
+        return parse_dedup_lines(lines, aggregate, dedup, metrics, text=True, whole=whole)
+    firsts = lasts = range(len(lines))
+    if whole:
+        lines, firsts, lasts = join_rows(lines)
+    fields = ([], [], [], [])
+    invalid = []
+    for index, line in enumerate(lines):
+        try:
+            parts = line.decode().split(',')
+            user_id = int(parts[1])
+            amount = float(parts[2])
+        except (ValueError, IndexError):
+            aggregate.add_invalid()
+            invalid.append((firsts[index], lasts[index]))
+            continue
+        aggregate.add(user_id, amount)
+        if metrics is not None:
+            collect(fields, user_id, amount, parts[0].encode(), parts[3].encode() if len(parts) > 3 else b'')
+    if metrics is not None:
+        metrics.add_fields(*fields)
+    return invalid
+
+def collect(fields, user_id, amount, transaction_id, date):
+    user_ids, amounts, ids, dates = fields
+    user_ids.append(user_id)
+    amounts.append(amount)
+    ids.append(transaction_id)
+    dates.append(date)
+
+def recover(lines, bad, ids=None, locate_all=False, indices=None):
+    # the lines of a block the fast loop could not parse, `bad` in order, as
+    # rows for the exact per-line path, with the rows broken by raw line
+    # breaks put back together (see tokenizer); those of them whose last
+    # line did parse get the head of their transaction id back in `ids`,
+    # the ids of the valid lines. Returns (rows, first line, last line),
+    # the line indices only if there are broken rows or `locate_all`;
+    # `indices` are those of `bad` if known
+    if not locate_all and not any(map(is_fragment, bad)):
+        return bad, None, None
+    indices = locate(lines, bad) if indices is None else indices
+    spans = broken_rows(lines, indices)
+    heads = {last: first for first, last in spans}
+    absorbed = {i for first, last in spans for i in range(first, last)}
+    rows, firsts, lasts = [], [], []
+    for i, line in zip(indices, bad):
+        if i in absorbed:
+            continue
+        first = heads.pop(i, i)
+        rows.append(line if first == i else b'\n'.join(lines[first:i + 1]))
+        firsts.append(first)
+        lasts.append(i)
+    if ids is not None:
+        for last, first in heads.items():
+            rank = last - bisect_left(indices, last)
+            ids[rank] = b'\n'.join(lines[first:last]) + b'\n' + ids[rank]
+    return rows, firsts, lasts
+
+def parse_bad_lines(lines, bad, aggregate: Aggregate, metrics=None, ids=None, invalid=None):
+    # the `bad` lines of the fast loops through recover() and parse_lines();
+    # the (first, last) indices of the lines that are not rows are appended
+    # to `invalid`
+    rows, firsts, lasts = recover(lines, bad, ids, invalid is not None)
+    wrong = parse_lines(rows, aggregate, metrics)
+    if invalid is not None:
+        invalid.extend((firsts[first], lasts[last]) for first, last in wrong)
+
+def parse_metrics_lines(lines, aggregate: Aggregate, metrics, invalid=None):
+    # the fast loop of aggregate_file that also keeps what the sketches need
+    # of every valid row; only used when metrics are asked for
+    fields = ([], [], [], [])
+    retry = []
+    for line in lines:
+        try:
+            parts = line.split(b',')
+            user_id = int(parts[1])
+            amount = float(parts[2])
+        except (ValueError, IndexError):
+            retry.append(line)
+            continue
+        aggregate.add(user_id, amount)
+        collect(fields, user_id, amount, parts[0], parts[3] if len(parts) > 3 else b'')
+    rows = recover(lines, retry, fields[2], invalid is not None)
+    metrics.add_fields(*fields)
+    wrong = parse_lines(rows[0], aggregate, metrics)
+    if invalid is not None:
+        invalid.extend((rows[1][first], rows[2][last]) for first, last in wrong)
+
+def parse_rows(lines, text=False):
+    # (line indices, transaction ids, user ids, amounts, dates) of the valid
+    # lines in order, parsed like the fast loop below, bytes first and then
+    # decoded; with `text` a line must also decode, like in parse_lines
+    rows = ([], [], [], [], [])
+    indices, ids, user_ids, amounts, dates = rows
+    for index, line in enumerate(lines):
+        parts = line.split(b',')
+        try:
+            if text:
+                line.decode()
+            user_id = int(parts[1])
+            amount = float(parts[2])
+        except (ValueError, IndexError):
+            try:
+                decoded = line.decode().split(',')
+                user_id = int(decoded[1])
+                amount = float(decoded[2])
+            except (ValueError, IndexError):
+                continue
+        indices.append(index)
+        ids.append(parts[0])
+        user_ids.append(user_id)
+        amounts.append(amount)
+        dates.append(parts[3] if len(parts) > 3 else b'')
+    return rows
+
+def parse_row_lines(lines, text=False, whole=True):
+    # parse_rows() and the (first, last) indices of the lines that are not
+    # rows; with `whole` the lines are a stretch of the file, and the rows
+    # broken by raw line breaks in it are put back together
+    rows = parse_rows(lines, text)
+    if len(rows[0]) == len(lines):
+        return rows, []
+    bad = np.setdiff1d(np.arange(len(lines)), rows[0]).tolist()
+    if not whole:
+        return rows, [(i, i) for i in bad]
+    # a broken row is valid exactly when its last line is
+    _, firsts, lasts = recover(lines, [lines[i] for i in bad], rows[1], True, bad)
+    return rows, list(zip(firsts, lasts))
+
+def add_rows(rows, keep, aggregate: Aggregate, metrics=None):
+    # the rows of parse_rows() whose entry in the `keep` mask is set
+    fields = ([], [], [], [])
+    _, ids, user_ids, amounts, dates = rows
+    for transaction_id, user_id, amount, date, wanted in zip(ids, user_ids, amounts, dates, keep.tolist()):
+        if wanted:
+            aggregate.add(user_id, amount)
+            if metrics is not None:
+                collect(fields, user_id, amount, transaction_id, date)
+    if metrics is not None:
+        metrics.add_fields(*fields)
+
+def parse_dedup_lines(lines, aggregate: Aggregate, dedup, metrics=None, text=False, whole=True):
+    # the loop of aggregate_file with --dedup: rows whose transaction id was
+    # seen before are left out; returns what parse_row_lines() does
+    rows, invalid = parse_row_lines(lines, text, whole)
+    aggregate.add_invalid(len(invalid))
+    add_rows(rows, ~dedup.check_and_add(keys_of(rows[1]), Ids.from_list(rows[1])), aggregate, metrics)
+    return invalid
+
+def aggregate_file(csv_file: str, use_checkpoint: bool = False, stats=NULL_STATS, metrics=None,
+                   dedup=None, aggregate=None, rejects=None) -> Aggregate:
+    # `rejects` is a tokenizer.RejectFile for the lines that are not rows
+    offset, aggregate = 0, Aggregate() if aggregate is None else aggregate
+    if use_checkpoint:
+        with stats.stage('checkpoint'):
+            offset, aggregate, status = checkpoint.load(csv_file)
+        print(checkpoint.describe(status, offset))
+    add = aggregate.add
+    
+    # a thread reads, and decompresses compressed input, while this one parses
+    with open_input(csv_file, start=offset, prefetch=True) as f:
+        if offset:
+            rest = b''
+        else:
+            # lines after '\r' breaks in the header line go with the first block
+            header = f.readline()
+            rest = header[after_line(header):]
+            offset = f.tell() - len(rest)
         
-        with open(csv_file, 'r', buffering=16*1024*1024) as f:
-            next(f)
+        while True:
+            with stats.stage('read'):
+                block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            stats.count('bytes', len(block))
+            stats.count('blocks')
             
-            for line in f:
-                total_rows += 1
-                try:
-                    parts = line.split(',')
-                    user_id = int(parts[1])
-                    amount = float(parts[2])
-                    
-                    amounts[user_id][0] += amount
-                    counts[user_id] += 1
-                    total_sum += amount
-                    
-                except (ValueError, IndexError):
-                    invalid_rows += 1
-                    continue
+            with stats.stage('split'):
+                block = rest + block
+                # fragments at the end of the block belong to a row in the next one
+                complete = cut(block, block.rfind(b'\n') + 1)
+                rest = block[complete:]
+                start, offset = offset, offset + complete
                 
-                if total_rows % 1000000 == 0:
-                    print(f"\rОбработано строк: {total_rows:,}", end='')
-        
-        top_users = sorted(
-            [(user_id, amounts[user_id][0], counts[user_id]) 
-             for user_id in amounts],
-            key=lambda x: x[1],
-            reverse=True
-        )[:5]
-        
-        print("\n\nТоп 5 пользователей по сумме транзакций:")
-        print("-" * 80)
-        print(f"{'User ID':<10} {'Total Amount':>15} {'Transactions':>15} {'Avg Amount':>15}")
-        print("-" * 80)
-        
-        for user_id, total, count in top_users:
-            avg = total / count
-            print(f"{user_id:<10} {total:>15.2f} {count:>15d} {avg:>15.2f}")
-        
-        print(f"\nВсего пользователей: {len(amounts):,}")
-        print(f"Всего транзакций: {total_rows:,}")
-        print(f"Общая сумма всех транзакций: {total_sum:,.2f}")
-        
-        if invalid_rows:
-            print(f"\nВнимание: найдено {invalid_rows:,} транзакций с невалидными данными!")
+                # splitlines() gives the '\r' and '\r\n' endings of text mode,
+                # so the rows match a text-mode read; most blocks have no '\r'
+                if b'\r' in block:
+                    lines = block[:complete].splitlines()
+                else:
+                    lines = block[:complete].split(b'\n')
+                    lines.pop()
+            
+            # number parsing and the aggregate update share one loop and one timer
+            with stats.stage('parse'):
+                invalid = [] if rejects is not None else None
+                bad = []
+                if dedup is not None:
+                    invalid = parse_dedup_lines(lines, aggregate, dedup, metrics)
+                elif metrics is not None:
+                    parse_metrics_lines(lines, aggregate, metrics, invalid)
+                else:
+                    # the valid rows are collected in flat arrays and added a
+                    # block at a time; ids beyond int64 go to the aggregate's dict
+                    user_ids, amounts = array('q'), array('d')
+                    add_user, add_amount = user_ids.append, amounts.append
+                    for line in lines:
+                        try:
+                            parts = line.split(b',')
+                            user_id = int(parts[1])
+                            amount = float(parts[2])
+                        except (ValueError, IndexError):
+                            bad.append(line)
+                            continue
+                        try:
+                            add_user(user_id)
+                        except OverflowError:
+                            add(user_id, amount)
+                            continue
+                        add_amount(amount)
+                    aggregate.add_many(np.frombuffer(user_ids, dtype=np.int64), np.frombuffer(amounts))
+                if bad:
+                    # bytes only parse ASCII digits, retry as text like the old
+                    # reader, with the rows broken by raw line breaks put together
+                    stats.count('slow_rows', len(bad))
+                    parse_bad_lines(lines, bad, aggregate, invalid=invalid)
+            
+            if rejects is not None and invalid:
+                rejects.add(reject_records(block[:complete], lines, invalid, start))
+            aggregate.check_memory()
+            print(f"\rОбработано строк: {aggregate.total_rows:,}", end='')
         
-        end_time = time.time()
-        print(f"\nВремя выполнения: {end_time - start_time:.2f} секунд")
+        # an unterminated last line may still be being written; it is
+        # counted in this report but not in the checkpoint
+        if use_checkpoint:
+            with stats.stage('checkpoint'):
+                checkpoint.save(csv_file, offset, aggregate)
+        lines = rest.splitlines()
+        invalid = parse_lines(lines, aggregate, metrics, dedup, whole=True)
+        if rejects is not None and invalid:
+            rejects.add(reject_records(rest, lines, invalid, offset))
+    
+    return aggregate
+
+def analyze_top_users(csv_file: str, use_checkpoint: bool = False):
+    try:
+        start_time = time.time()
+        aggregate = aggregate_file(csv_file, use_checkpoint)
+        print_report(AnalysisResult('native', csv_file, aggregate, time.time() - start_time))
             
     except Exception as e:
         print(f"\nОшибка при обработке файла: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Использование: python analyze_transactions_pure.py <path_to_csv>")
+    if len(sys.argv) not in (2, 3) or sys.argv[2:] not in ([], ['--checkpoint']):
+        print("Использование: python analyze_transactions_pure.py <path_to_csv> [--checkpoint]")
         sys.exit(1)
         
     csv_file = sys.argv[1]
-    analyze_top_users(csv_file) 
\ No newline at end of file
+    analyze_top_users(csv_file, use_checkpoint='--checkpoint' in sys.argv[2:]) 
\ No newline at end of file
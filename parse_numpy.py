@@ -0,0 +1,257 @@
+import sys
+import time
+import mmap
+import numpy as np
+import checkpoint
+from aggregate import Aggregate
+from instrument import NULL_STATS
+from dedup import KEY_WIDTH, Ids, keys_of, mix_long
+from inputs import detect_compression, open_input
+from parse_native import add_rows, parse_lines, parse_rows
+from tokenizer import cut, is_fragment, join_rows, line_starts, reject_records
+from sketches import DATE_WIDTH, ID_WIDTH, gather, hash_ids
+from report import AnalysisResult, print_report
+
+BLOCK_SIZE = 32 * 1024 * 1024
+# longest digit runs that still fit an int64 (and an exact float for amounts)
+MAX_USER_DIGITS = 18
+MAX_WHOLE_DIGITS = 13
+
+def parse_digits(data, ends, lengths, max_length):
+    # the decimal value of data[end - length:end] for every row, and whether
+    # all of those bytes were digits; `max_length` bounds the loop
+    values = np.zeros(len(ends), dtype=np.int64)
+    ok = np.ones(len(ends), dtype=bool)
+    min_length = int(lengths.min()) if len(lengths) else 0
+    power = 1
+    for k in range(max_length):
+        # non-digits wrap around to values above 9
+        digits = data.take(ends - 1 - k, mode='clip') - np.uint8(ord('0'))
+        if k < min_length:
+            ok &= digits < 10
+        else:
+            inside = k < lengths
+            ok &= (digits < 10) | ~inside
+            digits *= inside
+        values += digits.astype(np.int64) * power
+        power *= 10
+    return values, ok
+
+def parse_block(data, after_fragment=False):
+    # splits a block of whole lines into rows the vectorized path parsed and
+    # the indices of the lines left for the exact per-line path; `fields` are
+    # the line index, line start, first and third comma and line end of the
+    # parsed rows. `after_fragment` tells that the line before the block has
+    # no comma
+    newlines = np.flatnonzero(data == ord('\n'))
+    ends = newlines if len(newlines) and newlines[-1] == len(data) - 1 else np.append(newlines, len(data))
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    commas = np.flatnonzero(data == ord(','))
+    first = np.searchsorted(commas, starts)
+    counts = np.searchsorted(commas, ends) - first
+    fast = counts == 3
+    broken = counts == 0
+    carriage_returns = np.flatnonzero(data == ord('\r'))
+    if len(carriage_returns):
+        split = np.searchsorted(carriage_returns, ends) != np.searchsorted(carriage_returns, starts)
+        fast &= ~split
+        for i in np.flatnonzero(split & ~broken).tolist():
+            broken[i] = is_fragment((data[starts[i]:ends[i]].tobytes() + b'\n').splitlines()[-1])
+    # a line without commas can be the head of the next row's transaction id
+    # (see tokenizer), that row is left to the per-line path to join them
+    fast[1:] &= ~broken[:-1]
+    if after_fragment and len(fast):
+        fast[0] = False
+
+    rows = np.flatnonzero(fast)
+    first = first[rows]
+    comma1 = commas[first]
+    comma2 = commas[first + 1]
+    comma3 = commas[first + 2]
+
+    user_lengths = comma2 - comma1 - 1
+    whole_lengths = comma3 - comma2 - 4
+    ok = (user_lengths >= 1) & (user_lengths <= MAX_USER_DIGITS) & \
+         (whole_lengths >= 1) & (whole_lengths <= MAX_WHOLE_DIGITS)
+    ok &= data[np.where(ok, comma3 - 3, 0)] == ord('.')
+
+    user_ids, user_ok = parse_digits(data, comma2, np.where(ok, user_lengths, 0),
+                                     int(user_lengths[ok].max()) if ok.any() else 0)
+    whole, whole_ok = parse_digits(data, comma3 - 3, np.where(ok, whole_lengths, 0),
+                                   int(whole_lengths[ok].max()) if ok.any() else 0)
+    cents, cents_ok = parse_digits(data, comma3, np.where(ok, 2, 0), 2)
+    ok &= user_ok & whole_ok & cents_ok
+
+    # an exact integer divided by 100 rounds exactly like float('123.45')
+    amounts = (whole * 100 + cents) / 100
+    slow = np.concatenate((np.flatnonzero(~fast), rows[~ok]))
+    slow.sort()
+    fields = (rows[ok], starts[rows][ok], comma1[ok], comma3[ok], ends[rows][ok])
+    return user_ids[ok], amounts[ok], starts, ends, slow, fields
+
+def gather_ids(data, line_starts, comma1, width):
+    # the transaction ids of the parsed rows, only as wide as the longest;
+    # hash_ids gives the same hash for any width past it
+    id_lengths = comma1 - line_starts
+    id_width = min(int(id_lengths.max()) if len(id_lengths) else 0, width)
+    return gather(data, line_starts, id_lengths, id_width)
+
+def find_duplicates(dedup, keys, ids, lines, line_rows, slow_rows):
+    # duplicate masks of the vectorized rows (their keys, Ids and line
+    # indices) and of the slow path's rows, judged in line order
+    slow_keys = keys_of(slow_rows[1])
+    lines = np.concatenate((lines, np.array(line_rows, dtype=np.int64)[slow_rows[0]]))
+    order = np.argsort(lines, kind='stable')
+    duplicate = np.empty(len(order), dtype=bool)
+    duplicate[order] = dedup.check_and_add(np.concatenate((keys, slow_keys))[order],
+                                           (ids + Ids.from_list(slow_rows[1])).take(order))
+    return duplicate[:len(keys)], duplicate[len(keys):]
+
+def process_range(mm: mmap.mmap, pos: int, stop: int, aggregate: Aggregate, stats=NULL_STATS, metrics=None,
+                  dedup=None, header: bool = True, rejects=None, base: int = 0):
+    # parses the whole lines in mm[pos:stop]; pos and stop follow a line
+    # break and are not inside a row broken by raw line breaks (see
+    # tokenizer). `mm` may also be a bytes block, which starts with the
+    # header only if `header` is set; `base` is its offset in the
+    # (decompressed) input, for the records of `rejects`
+    header_lines, header_starts = [], []
+    if pos == 0 and header:
+        # the header is skipped as the first line in parse_native's sense
+        pos = min(mm.find(b'\n') + 1 or len(mm), stop)
+        header_lines = (mm[:pos]).splitlines()[1:]
+        header_starts = line_starts(mm[:pos])[1:] if header_lines else []
+
+    while pos < stop or header_lines:
+        block_end = mm.find(b'\n', min(pos + BLOCK_SIZE, stop) - 1, stop) + 1 or stop
+        block_end = max(block_end, pos)
+        if block_end < stop:
+            # fragments at the end of the block belong to a row in the next one
+            block_end = cut(mm, block_end, pos)
+        # rows outside the fast path, split and decoded exactly like
+        # parse_native's text-mode lines (int() takes any Unicode digits);
+        # the header's rest counts as line -1
+        lines, line_rows, offsets = header_lines, [-1] * len(header_lines), header_starts
+        header_lines, header_starts = [], []
+        data = np.zeros(0, dtype=np.uint8)
+        user_ids, amounts = np.zeros(0, dtype=np.int64), np.zeros(0)
+        fields = (np.zeros(0, dtype=np.int64),) * 5
+        if block_end > pos:
+            stats.count('bytes', block_end - pos)
+            stats.count('blocks')
+            with stats.stage('parse'):
+                data = np.frombuffer(mm, dtype=np.uint8, count=block_end - pos, offset=pos)
+                user_ids, amounts, starts, ends, slow, fields = parse_block(data, bool(lines) and is_fragment(lines[-1]))
+            for i in slow.tolist():
+                segment = mm[pos + starts[i]:pos + ends[i]] + b'\n'
+                split = segment.splitlines()
+                lines.extend(split)
+                line_rows.extend([i] * len(split))
+                if rejects is not None:
+                    offsets.extend(pos + starts[i] + start for start in (line_starts(segment) if len(split) > 1 else [0]))
+        stats.count('slow_rows', len(lines))
+        # the rows broken by raw line breaks, put together, take the line
+        # index of their first line
+        pieces = lines
+        lines, firsts, lasts = join_rows(lines, line_rows)
+        if lines is not pieces:
+            line_rows = [line_rows[i] for i in firsts]
+
+        if dedup is not None:
+            with stats.stage('dedup'):
+                slow_rows = parse_rows(lines, text=True)
+                line_indices, row_starts, comma1, _, _ = fields
+                ids = Ids(data, row_starts, comma1)
+                keys = hash_ids(gather_ids(data, row_starts, comma1, KEY_WIDTH), KEY_WIDTH)
+                mix_long(keys, ids, np.flatnonzero(ids.lengths() > KEY_WIDTH).tolist())
+                duplicate, slow_duplicate = find_duplicates(dedup, keys, ids, line_indices, line_rows, slow_rows)
+                del ids
+                user_ids, amounts = user_ids[~duplicate], amounts[~duplicate]
+                fields = tuple(field[~duplicate] for field in fields)
+        _, row_starts, comma1, comma3, line_ends = fields
+        if metrics is not None:
+            with stats.stage('metrics'):
+                metrics.add_arrays(user_ids, amounts, gather_ids(data, row_starts, comma1, ID_WIDTH),
+                                   gather(data, comma3 + 1, line_ends - comma3 - 1, DATE_WIDTH))
+        # the mapping cannot be closed while a view into it is alive
+        del data
+        pos = block_end
+
+        with stats.stage('aggregate'):
+            aggregate.add_many(user_ids, amounts)
+
+        with stats.stage('slow_path'):
+            if dedup is not None:
+                wrong = np.setdiff1d(np.arange(len(lines)), slow_rows[0]).tolist()
+                aggregate.add_invalid(len(wrong))
+                add_rows(slow_rows, ~slow_duplicate, aggregate, metrics)
+            else:
+                wrong = [first for first, _ in parse_lines(lines, aggregate, metrics)]
+        if rejects is not None and wrong:
+            rejects.add(reject_records(mm, pieces, [(firsts[i], lasts[i]) for i in wrong], base, offsets))
+        aggregate.check_memory()
+
+        print(f"\rОбработано строк: {aggregate.total_rows:,}", end='')
+
+def process_stream(f, aggregate: Aggregate, stats=NULL_STATS, metrics=None, dedup=None, rejects=None):
+    # process_range over a file that cannot be mapped, such as compressed
+    # input decompressed by open_input()'s thread, a block of whole lines at a time
+    rest, header, base = b'', True, 0
+    while True:
+        with stats.stage('read'):
+            block = f.read(BLOCK_SIZE)
+        if not block:
+            break
+        block = rest + block
+        complete = cut(block, block.rfind(b'\n') + 1)
+        rest = block[complete:]
+        if complete:
+            process_range(block, 0, complete, aggregate, stats, metrics, dedup, header, rejects, base)
+            header = False
+            base += complete
+    process_range(rest, 0, len(rest), aggregate, stats, metrics, dedup, header, rejects, base)
+
+def aggregate_file(csv_file: str, use_checkpoint: bool = False, stats=NULL_STATS, metrics=None,
+                   dedup=None, aggregate=None, rejects=None) -> Aggregate:
+    # `rejects` is a tokenizer.RejectFile for the lines that are not rows
+    offset, aggregate = 0, Aggregate() if aggregate is None else aggregate
+    if use_checkpoint:
+        with stats.stage('checkpoint'):
+            offset, aggregate, status = checkpoint.load(csv_file)
+        print(checkpoint.describe(status, offset))
+    # compressed input cannot be mapped and is decompressed by a thread instead
+    if detect_compression(csv_file) is not None:
+        with open_input(csv_file) as f:
+            process_stream(f, aggregate, stats, metrics, dedup, rejects)
+        return aggregate
+
+    with open(csv_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if use_checkpoint:
+            # an unterminated last line may still be being written; it is
+            # counted in this report but not in the checkpoint
+            complete = cut(mm, checkpoint.last_line_end(mm), offset)
+            process_range(mm, offset, complete, aggregate, stats, metrics, dedup, rejects=rejects)
+            with stats.stage('checkpoint'):
+                checkpoint.save(csv_file, complete, aggregate)
+            offset = complete
+        process_range(mm, offset, len(mm), aggregate, stats, metrics, dedup, rejects=rejects)
+
+    return aggregate
+
+def analyze_top_users(csv_file: str, use_checkpoint: bool = False):
+    try:
+        start_time = time.time()
+        aggregate = aggregate_file(csv_file, use_checkpoint)
+        print_report(AnalysisResult('numpy', csv_file, aggregate, time.time() - start_time))
+            
+    except Exception as e:
+        print(f"\nОшибка при обработке файла: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3) or sys.argv[2:] not in ([], ['--checkpoint']):
+        print("Использование: python parse_numpy.py <path_to_csv> [--checkpoint]")
+        sys.exit(1)
+
+    csv_file = sys.argv[1]
+    analyze_top_users(csv_file, use_checkpoint='--checkpoint' in sys.argv[2:])
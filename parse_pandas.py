@@ -1,42 +1,133 @@
+import csv
+import io
+import warnings
+import numpy as np
 import pandas as pd
 import sys
 import time
+from aggregate import INT64_MAX, INT64_MIN, Aggregate
+from inputs import open_input
+from instrument import NULL_STATS
+from report import AnalysisResult, print_report
+from tokenizer import rows
 
-def analyze_top_users(csv_file):
+NAMES = ['transaction_id', 'user_id', 'transaction_amount', 'transaction_date']
+COLUMNS = ['user_id', 'transaction_amount']
+BLOCK_SIZE = 16 * 1024 * 1024
+
+def read_rows(data, columns=COLUMNS):
+    # a DataFrame of `columns` of a block of tokenizer.rows(), fields by
+    # position and without quoting like parse_native splits a line, or None
+    # if no row has the three fields a valid row needs. user_id and
+    # transaction_amount come as int64 and float64 when all of them convert,
+    # as text otherwise
+    options = dict(header=None, quoting=csv.QUOTE_NONE, keep_default_na=False, skip_blank_lines=False,
+                   float_precision='round_trip', encoding_errors='surrogateescape')
     try:
-        start_time = time.time()
-        
-        df = pd.read_csv(csv_file)
-        df['amount_clean'] = pd.to_numeric(df['transaction_amount'], errors='coerce')
-        user_totals = df.groupby('user_id')['amount_clean'].agg([
-            'sum',
-            'count',
-            'mean'
-        ]).reset_index()
-        top_users = user_totals.nlargest(5, 'sum')
-        
-        print("\nТоп 5 пользователей по сумме транзакций:")
-        print("-" * 80)
-        print(f"{'User ID':<10} {'Total Amount':>15} {'Transactions':>15} {'Avg Amount':>15}")
-        print("-" * 80)
-        
-        for _, row in top_users.iterrows():
-            print(f"{row['user_id']:<10} {row['sum']:>15.2f} {row['count']:>15.0f} {row['mean']:>15.2f}")
-            
+        # 'inf' ids fail the int64 cast with a warning before the error
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            frame = pd.read_csv(io.BytesIO(data), names=NAMES, usecols=columns,
+                                dtype={'user_id': 'int64', 'transaction_amount': 'float64'}, **options)
+        if not float_ids(data):
+            return frame
+    except (ValueError, OverflowError):
+        pass
+    # pandas takes the number of fields from the first row, names for the
+    # most fields of any row keep it from failing on longer ones
+    array = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(array == ord('\n'))
+    fields = int(np.diff(np.searchsorted(np.flatnonzero(array == ord(',')), ends), prepend=0).max()) + 1
+    if fields < 3:
+        return None
+    positions = [NAMES.index(column) for column in columns]
+    frame = pd.read_csv(io.BytesIO(data), names=range(fields), usecols=lambda position: position in positions,
+                        dtype=str, **options)
+    frame.columns = [NAMES[position] for position in frame.columns]
+    return frame
+
+def float_ids(data):
+    # whether the user id of a row of `data` with three fields or more has a
+    # '.' or an exponent: the C parser reads '2.0' and '1e3' as int64, int()
+    # does not. Any other id or amount it converts, int() and float() convert
+    # to the same value
+    array = np.frombuffer(data, dtype=np.uint8)
+    marks = np.flatnonzero((array == ord('.')) | (array == ord('e')) | (array == ord('E')))
+    commas = np.flatnonzero(array == ord(','))
+    ends = np.flatnonzero(array == ord('\n'))
+    if not len(marks) or len(commas) < 2:
+        return False
+    first = np.searchsorted(commas, np.concatenate(([0], ends[:-1] + 1)))
+    rows = first + 1 < len(commas)
+    first, ends = first[rows], ends[rows]
+    rows = commas[first + 1] < ends
+    start, stop = commas[first[rows]], commas[first[rows] + 1]
+    return bool((np.searchsorted(marks, stop) > np.searchsorted(marks, start)).any())
+
+def valid_rows(data, frame):
+    # (int64 user ids, float64 amounts, [(user id, amount)] of the ids
+    # beyond int64, invalid rows) of read_rows(data), by parse_native's
+    # rules: an int() user id and a float() amount; fields a row does not
+    # have come as NaN
+    rows = data.count(b'\n') if frame is None else len(frame)
+    if frame is None:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), [], rows
+    user_ids, amounts = frame['user_id'].to_numpy(), frame['transaction_amount'].to_numpy()
+    if user_ids.dtype == np.int64 and amounts.dtype == np.float64:
+        # text amounts are never NaN here, 'nan' does not convert
+        present = ~np.isnan(amounts)
+        return user_ids[present], amounts[present], [], rows - int(present.sum())
     
-        print(f"Всего пользователей: {len(user_totals)}")
-        print(f"Всего транзакций: {len(df)}")
-        print(f"Общая сумма всех транзакций: {df['amount_clean'].sum():,.2f}")
-        
-        invalid_amounts = df[pd.isna(df['amount_clean'])].shape[0]
-        if invalid_amounts > 0:
-            print(f"\nВнимание: найдено {invalid_amounts} транзакций с невалидными суммами!")
-            
-        end_time = time.time()
-        print(f"\nВремя выполнения: {end_time - start_time:.2f} секунд")
+    # only text is left: int() and float() one by one, as parse_native does
+    ids, values, others = [], [], []
+    for user_id, amount in zip(user_ids.tolist(), amounts.tolist()):
+        if not isinstance(amount, str):
+            continue
+        try:
+            user_id = int(user_id)
+            amount = float(amount)
+        except ValueError:
+            continue
+        if INT64_MIN <= user_id <= INT64_MAX:
+            ids.append(user_id)
+            values.append(amount)
+        else:
+            others.append((user_id, amount))
+    return np.array(ids, dtype=np.int64), np.array(values, dtype=np.float64), others, rows - len(ids) - len(others)
+
+def add_rows(aggregate: Aggregate, user_ids, amounts, others, invalid_rows):
+    # the result of valid_rows(); ids beyond int64 go through add()
+    aggregate.add_many(user_ids, amounts)
+    for user_id, amount in others:
+        aggregate.add(user_id, amount)
+    aggregate.add_invalid(invalid_rows)
+
+def read_blocks(csv_file, columns):
+    # (block, read_rows()) of every block of the file
+    with open_input(csv_file) as f:
+        return [(data, read_rows(data, columns)) for data in rows(f, BLOCK_SIZE)]
+
+def aggregate_file(csv_file: str, stats=NULL_STATS) -> Aggregate:
+    with stats.stage('read'):
+        blocks = read_blocks(csv_file, NAMES)
+    with stats.stage('validate'):
+        blocks = [valid_rows(data, frame) for data, frame in blocks]
+    
+    aggregate = Aggregate()
+    with stats.stage('aggregate'):
+        for block in blocks:
+            add_rows(aggregate, *block)
+    
+    return aggregate
+
+def analyze_top_users(csv_file: str):
+    try:
+        start_time = time.time()
+        aggregate = aggregate_file(csv_file)
+        print_report(AnalysisResult('pandas', csv_file, aggregate, time.time() - start_time))
             
     except Exception as e:
-        print(f"Ошибка при обработке файла: {e}")
+        print(f"\nОшибка при обработке файла: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -1,145 +1,313 @@
 import sys
 import time
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
-from threading import Lock
+from concurrent.futures import ProcessPoolExecutor
 import mmap
 import os
+import numpy as np
+import checkpoint
+import rowindex
+from aggregate import Aggregate, SpillingAggregate
+from instrument import NULL_STATS, Stats
+from dedup import Ids, keys_of
+from inputs import detect_compression, member_bounds, open_input
+from parse_native import parse_bad_lines, parse_lines, parse_row_lines
+from tokenizer import after_line, cut, is_fragment, reject_records, resume
+from sketches import DATE_WIDTH, ID_WIDTH, INT64_MAX, INT64_MIN, Metrics, to_matrix
+from report import AnalysisResult, print_report
 
-def process_chunk(chunk_start: int, chunk_size: int, mm: mmap.mmap, lock: Lock, amounts: dict, counts: dict) -> tuple:
-    chunk_sum = 0
-    chunk_invalid = 0
-    rows = 0
-    local_amounts = defaultdict(float)
-    local_counts = defaultdict(int)
-    
-    pos = chunk_start
-    chunk_end = chunk_start + chunk_size
-    
-    while pos < chunk_end:
-        try:
+BLOCK_SIZE = 64 * 1024 * 1024
 
-            line_end = mm.find(b'\n', pos)
-            if line_end == -1:
-                break
-                
-            line = memoryview(mm[pos:line_end])
-            
-            comma1 = -1
-            comma2 = -1
-            comma3 = -1
-            for i, char in enumerate(line):
-                if char == 44:  # ,
-                    if comma1 == -1:
-                        comma1 = i
-                    elif comma2 == -1:
-                        comma2 = i
-                    else:
-                        comma3 = i
-                        break
-            
-            user_id = int(line[comma1+1:comma2])
-            amount = float(line[comma2+1:comma3])
-            
-            local_amounts[user_id] += amount
-            local_counts[user_id] += 1
-            chunk_sum += amount
-            rows += 1
-            
-            pos = line_end + 1
-            
-        except (ValueError, IndexError):
-            chunk_invalid += 1
-            pos = mm.find(b'\n', pos) + 1
-            if pos <= 0:
+def line_start(mm: mmap.mmap, pos: int) -> int:
+    # the first line that starts at or after `pos`; every line, '\r'-terminated
+    # ones included, lies entirely on one side of a position following a '\n'
+    if pos <= 0:
+        return 0
+    end = mm.find(b'\n', pos - 1)
+    return len(mm) if end == -1 else end + 1
+
+def row_start(mm: mmap.mmap, pos: int) -> int:
+    # line_start() moved back before the fragments of a row broken by raw
+    # line breaks that would otherwise be split (see tokenizer); a position
+    # already after a lone '\r', where such a cut can fall, is kept
+    if 0 < pos < len(mm) and mm[pos - 1:pos] == b'\r' and mm[pos:pos + 1] != b'\n':
+        return cut(mm, pos)
+    pos = line_start(mm, pos)
+    return cut(mm, pos) if 0 < pos < len(mm) else pos
+
+def mapped_blocks(csv_file: str, chunk_start: int, chunk_end: int, stats):
+    # the lines of csv_file[chunk_start:chunk_end] in blocks, moved to whole
+    # rows, with the bytes they come from and the offset of those
+    with open(csv_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = row_start(mm, chunk_start)
+        chunk_end = row_start(mm, chunk_end)
+        stats.count('bytes', max(chunk_end - pos, 0))
+        
+        while pos < chunk_end:
+            with stats.stage('split'):
+                block_end = min(cut(mm, line_start(mm, pos + BLOCK_SIZE), pos), chunk_end)
+                block = mm[pos:block_end]
+                # the header is skipped as the first line in parse_native's sense
+                start = after_line(block) if pos == 0 else 0
+                if start:
+                    block = block[start:]
+                # splitlines ends lines at '\n', '\r\n' and '\r' like parse_native's text mode
+                lines = block.splitlines()
+            yield lines, block, pos + start
+            pos = block_end
+
+def compressed_blocks(csv_file: str, codec: str, chunk_start: int, chunk_end: int, stats, edges: list):
+    # the lines of the members in csv_file[chunk_start:chunk_end] in blocks,
+    # with the bytes they come from and the offset of those in the chunk's
+    # decompressed bytes; lines do not end with members, so the bytes up to
+    # the first '\n' and the fragments of a broken row right after them (see
+    # tokenizer), and the bytes after the last row, are left to the parent as
+    # `edges` (head, tail, decompressed size), or (everything, None, size)
+    # without any '\n'
+    head, rest, position = None, b'', 0
+    with open_input(csv_file, codec, chunk_start, chunk_end) as f:
+        while True:
+            with stats.stage('read'):
+                block = f.read(BLOCK_SIZE)
+            if not block:
                 break
+            stats.count('bytes', len(block))
+            with stats.stage('split'):
+                block = rest + block
+                if head is None:
+                    first = block.find(b'\n') + 1
+                    if not first:
+                        rest = block
+                        continue
+                    if is_fragment(block[:first].splitlines()[-1]):
+                        first = resume(block, first)
+                    head, block = block[:first], block[first:]
+                    position = first
+                complete = cut(block, block.rfind(b'\n') + 1)
+                rest = block[complete:]
+                block = block[:complete]
+                lines = block.splitlines()
+            yield lines, block, position
+            position += complete
+    edges.extend((rest, None, len(rest)) if head is None else (head, rest, position + len(rest)))
+
+def row_arrays(rows, with_metrics: bool):
+    # the valid rows of parse_rows() for the parent to check for duplicates
+    # and add: (keys, Ids, int64 user ids, amounts, (index, user id) of the
+    # user ids beyond int64, which are 0 in the array, date matrix or None)
+    _, ids, user_ids, amounts, dates = rows
+    big = [(i, user_id) for i, user_id in enumerate(user_ids) if not INT64_MIN <= user_id <= INT64_MAX]
+    if big:
+        user_ids = list(user_ids)
+        for i, _ in big:
+            user_ids[i] = 0
+    user_ids = np.array(user_ids, dtype=np.int64)
+    return (keys_of(ids), Ids.from_list(ids), user_ids, np.array(amounts, dtype=np.float64), big,
+            to_matrix(dates, DATE_WIDTH) if with_metrics else None)
+
+def add_kept(rows, keep, aggregate: Aggregate, metrics=None):
+    # the rows of row_arrays() whose entry in the `keep` mask is set
+    _, ids, user_ids, amounts, big, dates = rows
+    fits = keep.copy()
+    fits[[i for i, _ in big]] = False
+    aggregate.add_many(user_ids[fits], amounts[fits])
+    for i, user_id in big:
+        if keep[i]:
+            aggregate.add(user_id, float(amounts[i]))
+    if metrics is not None:
+        kept = np.flatnonzero(keep)
+        metrics.add_arrays(user_ids[kept], amounts[kept], ids.matrix(kept, ID_WIDTH), dates[kept],
+                           fits[kept] if big else None)
+
+def process_chunk(csv_file: str, chunk_start: int, chunk_end: int, instrument: bool = False,
+                  with_metrics: bool = False, with_rows: bool = False, spill: tuple = None,
+                  codec: str = None, with_rejects: bool = False):
+    # (serialized aggregate, the worker's Stats.to_dict() or None,
+    # serialized Metrics or None, the row_arrays() of each block or None,
+    # the partition files spilled to or None, the edges of compressed_blocks()
+    # or None, the reject_records() of the lines that are not rows or None);
+    # `with_rows` leaves the valid rows to the parent, which checks them for
+    # duplicates, `spill` is the memory budget and the directory of a
+    # SpillingAggregate; with a `codec` the chunk bounds are member starts
+    # and reject offsets are counted from the chunk's first decompressed byte
+    aggregate = Aggregate() if spill is None else SpillingAggregate(spill[0], directory=spill[1])
+    add = aggregate.add
+    stats = Stats() if instrument else NULL_STATS
+    metrics = Metrics() if with_metrics else None
+    row_blocks = []
+    edges = []
+    records = []
     
-    with lock:
-        for user_id, amount in local_amounts.items():
-            amounts[user_id] += amount
-            counts[user_id] += local_counts[user_id]
+    if codec is None:
+        blocks = mapped_blocks(csv_file, chunk_start, chunk_end, stats)
+    else:
+        blocks = compressed_blocks(csv_file, codec, chunk_start, chunk_end, stats, edges)
+    for lines, block, base in blocks:
+        with stats.stage('parse'):
+            invalid = [] if with_rejects else None
+            bad = []
+            if with_rows:
+                rows, invalid = parse_row_lines(lines, text=True)
+                aggregate.add_invalid(len(invalid))
+                row_blocks.append(row_arrays(rows, with_metrics))
+            elif metrics is not None:
+                invalid = parse_lines(lines, aggregate, metrics, whole=True)
+            else:
+                for line in lines:
+                    try:
+                        parts = line.decode().split(',')
+                        user_id = int(parts[1])
+                        amount = float(parts[2])
+                        
+                        add(user_id, amount)
+                        
+                    except (ValueError, IndexError):
+                        bad.append(line)
+            if bad:
+                # with the rows broken by raw line breaks put together
+                parse_bad_lines(lines, bad, aggregate, invalid=invalid)
+        if with_rejects and invalid:
+            records.extend(reject_records(block, lines, invalid, base))
+        aggregate.check_memory()
             
-    return chunk_sum, chunk_invalid, rows
+    # the serialized aggregate is much cheaper to send back than two dicts
+    with stats.stage('serialize'):
+        data = aggregate.to_bytes()
+        metrics_data = metrics.to_bytes() if metrics is not None else None
+    stats.count('rows', aggregate.total_rows + sum(len(rows[0]) for rows in row_blocks))
+    if spill is not None:
+        stats.count('spills', aggregate.spills)
+    return (data, stats.to_dict(), metrics_data, row_blocks if with_rows else None,
+            aggregate.files if spill is not None else None, tuple(edges) if codec is not None else None, records if with_rejects else None)
 
-def analyze_top_users(csv_file: str):
-    try:
-        start_time = time.time()
-        amounts = defaultdict(float)
-        counts = defaultdict(int)
-        total_sum = 0
-        total_rows = 0
-        invalid_rows = 0
-        lock = Lock()
+def aggregate_file(csv_file: str, workers: int = None, use_checkpoint: bool = False, stats=NULL_STATS,
+                   metrics=None, dedup=None, aggregate=None, rejects=None) -> Aggregate:
+    # `rejects` is a tokenizer.RejectFile for the lines that are not rows
+    offset, aggregate = 0, Aggregate() if aggregate is None else aggregate
+    if use_checkpoint:
+        with stats.stage('checkpoint'):
+            offset, aggregate, status = checkpoint.load(csv_file)
+        print(checkpoint.describe(status, offset))
+    
+    codec = detect_compression(csv_file)
+    with stats.stage('plan'):
+        if codec is None:
+            with open(csv_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                file_size = len(mm)
+                # an unterminated last line may still be being written; it is
+                # counted in this report but not in the checkpoint
+                complete = checkpoint.last_line_end(mm) if use_checkpoint else file_size
+        else:
+            file_size = complete = os.path.getsize(csv_file)
         
+        workers = workers or os.cpu_count() or 1
+        # a few chunks per worker keep every core busy until the end; with an
+        # up-to-date index they are cut at indexed rows and need no line
+        # search. Compressed input is cut at member starts, a file of one
+        # gzip member or bz2/xz stream is read by one worker
+        index = rowindex.RowIndex.load(csv_file) if codec is None else None
+        progress = ""
+        if codec is not None:
+            bounds = member_bounds(csv_file, codec, workers * 4)
+        elif index is not None:
+            bounds = [min(bound, complete) for bound in index.split(workers * 4, offset)]
+            progress = f" из {index.rows:,}"
+        else:
+            chunk_size = max(-(-(complete - offset) // (workers * 4)), 1024*1024)
+            bounds = list(range(offset, complete, chunk_size)) + [complete]
+        # workers spill into the same directory, each within an equal share
+        # of the budget on top of this process's own
+        spill = None
+        if isinstance(aggregate, SpillingAggregate):
+            spill = (aggregate.memory_budget // workers, aggregate.spill_directory())
+    
+    def merge(result):
+        data, worker_stats, metrics_data, _, files, _, _ = result
+        with stats.stage('merge'):
+            aggregate.merge(Aggregate.from_bytes(data))
+            if metrics_data is not None:
+                metrics.merge(Metrics.from_bytes(metrics_data))
+            if files is not None:
+                aggregate.adopt(files)
+            aggregate.check_memory()
+        stats.add_worker(worker_stats)
+        print(f"\rОбработано строк: {aggregate.total_rows:,}{progress}", end='')
 
-        file_size = os.path.getsize(csv_file)
-        chunk_size = max(file_size // 12, 1024*1024) 
-        
-        with open(csv_file, 'rb') as f:
+    # the lines that cross from one compressed chunk into the next are put
+    # together here, in file order, the first of them after the header;
+    # `position` is the decompressed offset of the chunk being merged
+    carry, carry_start, position, header = b'', 0, 0, True
+    def stitch(data, base):
+        nonlocal header
+        # the header is skipped as the first line in parse_native's sense
+        start = after_line(data) if header else 0
+        data, base, header = data[start:], base + start, False
+        lines = data.splitlines()
+        invalid = parse_lines(lines, aggregate, metrics, dedup, whole=True)
+        if rejects is not None and invalid:
+            rejects.add(reject_records(data, lines, invalid, base))
 
-            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-            
-            first_line_end = mm.find(b'\n') + 1
-            
-            chunk_starts = range(first_line_end, file_size, chunk_size)
-            
-            with ThreadPoolExecutor(max_workers=6) as executor:
-                futures = [
-                    executor.submit(
-                        process_chunk, 
-                        chunk_start,
-                        chunk_size,
-                        mm,
-                        lock,
-                        amounts,
-                        counts
-                    )
-                    for chunk_start in chunk_starts
-                ]
-                
-                for future in futures:
-                    chunk_sum, chunk_invalid, chunk_rows = future.result()
-                    total_sum += chunk_sum
-                    invalid_rows += chunk_invalid
-                    total_rows += chunk_rows
-                    print(f"\rОбработано строк: {total_rows:,}", end='')
-            
-            mm.close()
-        
-        top_users = sorted(
-            ((user_id, amounts[user_id], counts[user_id]) 
-             for user_id in amounts),
-            key=lambda x: (x[1], -x[0]),
-            reverse=True
-        )[:5]
-        
-        print("\n\nТоп 5 пользователей по сумме транзакций:")
-        print("-" * 80)
-        print(f"{'User ID':<10} {'Total Amount':>15} {'Transactions':>15} {'Avg Amount':>15}")
-        print("-" * 80)
+    chunks = [(chunk_start, chunk_end) for chunk_start, chunk_end in zip(bounds, bounds[1:])
+              if chunk_start < chunk_end]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(process_chunk, csv_file, chunk_start, chunk_end, stats.enabled, metrics is not None,
+                            dedup is not None, spill, codec, rejects is not None)
+            for chunk_start, chunk_end in chunks
+        ]
+        stats.count('chunks', len(futures))
         
-        for user_id, total, count in top_users:
-            avg = total / count
-            print(f"{user_id:<10} {total:>15.2f} {count:>15d} {avg:>15.2f}")
-        
-        print(f"\nВсего пользователей: {len(amounts):,}")
-        print(f"Всего транзакций: {total_rows:,}")
-        print(f"Общая сумма всех транзакций: {total_sum:,.2f}")
-        
-        if invalid_rows:
-            print(f"\nВнимание: найдено {invalid_rows:,} транзакций с невалидными данными!")
-        
-        end_time = time.time()
-        print(f"\nВремя выполнения: {end_time - start_time:.2f} секунд")
+        # results are merged in file order by this process alone, 'wait' is
+        # the time spent blocked on workers that have not finished yet; with
+        # dedup the workers send their valid rows, which are checked and
+        # added here in file order, all but the duplicates
+        for future in futures:
+            with stats.stage('wait'):
+                result = future.result()
+            base = position
+            if codec is not None:
+                head, tail, size = result[5]
+                carry += head
+                if tail is not None:
+                    stitch(carry, carry_start)
+                    carry, carry_start = tail, position + size - len(tail)
+                position += size
+            if rejects is not None:
+                rejects.add([(offset + base, length, row) for offset, length, row in result[6]])
+            for rows in result[3] or []:
+                with stats.stage('dedup'):
+                    keep = ~dedup.check_and_add(rows[0], rows[1])
+                with stats.stage('aggregate'):
+                    add_kept(rows, keep, aggregate, metrics)
+            merge(result)
+        if carry:
+            stitch(carry, carry_start)
+            
+    if use_checkpoint:
+        with stats.stage('checkpoint'):
+            checkpoint.save(csv_file, complete, aggregate)
+        if complete < file_size:
+            result = process_chunk(csv_file, complete, file_size, stats.enabled, metrics is not None,
+                                   with_rejects=rejects is not None)
+            if rejects is not None:
+                rejects.add(result[6])
+            merge(result)
+    
+    return aggregate
+
+def analyze_top_users(csv_file: str, workers: int = None, use_checkpoint: bool = False):
+    try:
+        start_time = time.time()
+        aggregate = aggregate_file(csv_file, workers, use_checkpoint)
+        print_report(AnalysisResult('parallel', csv_file, aggregate, time.time() - start_time))
             
     except Exception as e:
         print(f"\nОшибка при обработке файла: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Использование: python analyze_transactions_parallel.py <path_to_csv>")
+    if len(sys.argv) not in (2, 3) or sys.argv[2:] not in ([], ['--checkpoint']):
+        print("Использование: python analyze_transactions_parallel.py <path_to_csv> [--checkpoint]")
         sys.exit(1)
         
     csv_file = sys.argv[1]
-    analyze_top_users(csv_file) 
\ No newline at end of file
+    analyze_top_users(csv_file, use_checkpoint='--checkpoint' in sys.argv[2:]) 
\ No newline at end of file
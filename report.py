@@ -0,0 +1,143 @@
+import json
+import math
+
+TOP_USERS = 5
+QUANTILES = [0.5, 0.9, 0.99]
+
+class AnalysisResult:
+    def __init__(self, engine, source, aggregate, elapsed, top=TOP_USERS):
+        self.engine = engine
+        self.source = source
+        self.aggregate = aggregate
+        self.elapsed = elapsed
+        self.top = top
+        self.top_users = aggregate.top(top)
+        self.users = aggregate.users
+        self.total_rows = aggregate.total_rows
+        self.invalid_rows = aggregate.invalid_rows
+        self.total_sum = aggregate.total_sum
+        # filled in by analyze.py when instrumentation is on
+        self.stats = None
+        self.profile = None
+        self.metrics = None
+        self.duplicate_rows = None
+        self.reject_file = None
+        self.rejected_rows = None
+
+    def to_dict(self):
+        return {
+            'engine': self.engine,
+            'source': self.source,
+            'top_users': [
+                {'user_id': user_id, 'total': _number(total), 'count': count, 'average': _number(total / count)}
+                for user_id, total, count in self.top_users
+            ],
+            'users': self.users,
+            'total_rows': self.total_rows,
+            'invalid_rows': self.invalid_rows,
+            **({'duplicate_rows': self.duplicate_rows} if self.duplicate_rows is not None else {}),
+            **({'reject_file': self.reject_file, 'rejected_rows': self.rejected_rows}
+               if self.reject_file is not None else {}),
+            'total_sum': _number(self.total_sum),
+            'elapsed': round(self.elapsed, 3),
+            **({'metrics': metrics_dict(self)} if self.metrics else {}),
+            **({'stats': self.stats} if self.stats else {}),
+            **(self.profile or {})
+        }
+
+def metrics_dict(result):
+    metrics = result.metrics
+    sketch = metrics.quantiles
+    names = [f"p{round(q * 100)}" for q in QUANTILES]
+    return {
+        'relative_accuracy': sketch.relative_accuracy,
+        'distinct_transactions': round(metrics.distinct.estimate()),
+        'amount_quantiles': dict(zip(names, map(_number, sketch.quantiles(sketch.overall, QUANTILES)))),
+        'top_users': [
+            {'user_id': user_id, **dict(zip(names, map(_number, sketch.user_quantiles(user_id, QUANTILES))))}
+            for user_id, _, _ in result.top_users
+        ],
+        'daily': [{'date': day.isoformat(), 'rows': rows, 'amount': _number(amount)}
+                  for day, rows, amount in metrics.daily.days()],
+        'invalid_dates': metrics.daily.invalid,
+        'dates_out_of_range': metrics.daily.out_of_range
+    }
+
+def _number(value):
+    # strict JSON has no NaN or Infinity, and fuzzed amounts produce both
+    return value if math.isfinite(value) else str(value)
+
+def print_report(result: AnalysisResult):
+    print(f"\n\nТоп {result.top} пользователей по сумме транзакций:")
+    print("-" * 80)
+    print(f"{'User ID':<10} {'Total Amount':>15} {'Transactions':>15} {'Avg Amount':>15}")
+    print("-" * 80)
+
+    for user_id, total, count in result.top_users:
+        avg = total / count
+        print(f"{user_id:<10} {total:>15.2f} {count:>15d} {avg:>15.2f}")
+
+    print(f"\nВсего пользователей: {result.users:,}")
+    print(f"Всего транзакций: {result.total_rows:,}")
+    print(f"Общая сумма всех транзакций: {result.total_sum:,.2f}")
+
+    if result.invalid_rows:
+        print(f"\nВнимание: найдено {result.invalid_rows:,} транзакций с невалидными данными!")
+    if result.duplicate_rows is not None:
+        print(f"Пропущено повторов transaction_id: {result.duplicate_rows:,}")
+    if result.reject_file is not None:
+        print(f"Невалидные строки ({result.rejected_rows:,}) записаны в {result.reject_file}")
+
+    print(f"\nВремя выполнения: {result.elapsed:.2f} секунд")
+
+    if result.metrics:
+        print_metrics(metrics_dict(result))
+    if result.stats:
+        print_stats(result.stats, result.elapsed)
+    if result.profile:
+        print_profile(result.profile)
+
+def print_metrics(metrics):
+    accuracy = f"±{metrics['relative_accuracy']:.0%}"
+    print(f"\nУникальных transaction_id (оценка): {metrics['distinct_transactions']:,}")
+    print(f"Перцентили сумм ({accuracy}): " +
+          '  '.join(f"{name} {value:.2f}" for name, value in metrics['amount_quantiles'].items()))
+    if metrics['top_users']:
+        print(f"{'User ID':<10} " + ' '.join(f"{name:>15}" for name in metrics['amount_quantiles']))
+        for user in metrics['top_users']:
+            print(f"{user['user_id']:<10} " + ' '.join(f"{user[name]:>15.2f}" for name in metrics['amount_quantiles']))
+    daily = metrics['daily']
+    if daily:
+        busiest = max(daily, key=lambda day: day['rows'])
+        print(f"По дням: {len(daily):,} дней с {daily[0]['date']} по {daily[-1]['date']}, больше всего "
+              f"{busiest['date']}: {busiest['rows']:,} транзакций")
+    if metrics['invalid_dates'] or metrics['dates_out_of_range']:
+        print(f"Дат с ошибками: {metrics['invalid_dates']:,}, вне диапазона: {metrics['dates_out_of_range']:,}")
+
+def print_stats(stats, elapsed):
+    print("\nЭтапы:")
+    for name, seconds in sorted(stats['timings'].items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name:<12} {seconds:>10.3f} с {seconds / max(elapsed, 1e-9):>7.1%}")
+    print("Счётчики:")
+    for name, value in stats['counters'].items():
+        print(f"  {name:<12} {value:>14,}")
+    if stats['workers']:
+        stages = sorted({name for worker in stats['workers'].values() for name in worker['timings']})
+        print("Процессы:")
+        print(f"  {'PID':<8} {'Чанков':>7} " + ' '.join(f"{name:>10}" for name in stages) + f" {'Строк':>12}")
+        for pid, worker in sorted(stats['workers'].items()):
+            timings = ' '.join(f"{worker['timings'].get(name, 0.0):>10.3f}" for name in stages)
+            print(f"  {pid:<8} {worker['chunks']:>7} {timings} {worker['counters'].get('rows', 0):>12,}")
+
+def print_profile(profile):
+    if 'profile' in profile:
+        print("\nПрофиль (по накопленному времени):")
+        for row in profile['profile']:
+            print(f"  {row['cumulative']:>9.3f} с {row['total']:>9.3f} с {row['calls']:>10,}  {row['function']}")
+    if 'memory' in profile:
+        print(f"\nПик памяти Python: {profile['memory']['peak'] / (1024 * 1024):,.1f} MB")
+        for row in profile['memory']['top']:
+            print(f"  {row['size'] / 1024:>12,.1f} KB {row['count']:>10,}  {row['where']}")
+
+def print_json(result: AnalysisResult):
+    print(json.dumps(result.to_dict(), ensure_ascii=False, indent=2))
@@ -0,0 +1,192 @@
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import numpy as np
+
+# a sidecar <file>.idx with the byte offset of every K-th row, as (row,
+# offset) pairs so that shards written in parallel can each restart the
+# count; a row is a '\n'-terminated line after the header, which is also
+# what the analyzers may safely split on. The file's size, mtime and a
+# digest of its head and tail are kept, a file rewritten in place at the
+# same size does not match its old index
+MAGIC = b'RIX2'
+HEADER = struct.Struct('<4sqqqqq16s16s')
+DEFAULT_EVERY = 65536
+SCAN_BLOCK_SIZE = 64 * 1024 * 1024
+HEAD_SIZE = 64 * 1024
+TAIL_SIZE = 64 * 1024
+
+def index_path(csv_file):
+    return f"{csv_file}.idx"
+
+def discard(csv_file):
+    # removes the index of a file that is about to be rewritten
+    try:
+        os.remove(index_path(csv_file))
+    except FileNotFoundError:
+        pass
+
+def fingerprint(csv_file):
+    # (size, mtime_ns, head digest, tail digest), like checkpoint's digests
+    with open(csv_file, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        head = f.read(min(HEAD_SIZE, stat.st_size))
+        f.seek(max(stat.st_size - TAIL_SIZE, 0))
+        tail = f.read()
+    return (stat.st_size, stat.st_mtime_ns, hashlib.blake2b(head, digest_size=16).digest(),
+            hashlib.blake2b(tail, digest_size=16).digest())
+
+def header_end(mm):
+    return mm.find(b'\n') + 1 or len(mm)
+
+def scan(csv_file, start, stop, every=DEFAULT_EVERY):
+    # rows in [start, stop), which must begin at a row, and the offsets of
+    # rows 0, every, 2 * every, ... of that range
+    rows = 0
+    offsets = []
+    with open(csv_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        stop = min(stop, len(mm))
+        for block in range(start, stop, SCAN_BLOCK_SIZE):
+            count = min(SCAN_BLOCK_SIZE, stop - block)
+            data = np.frombuffer(mm, dtype=np.uint8, count=count, offset=block)
+            starts = np.flatnonzero(data == ord('\n')) + 1 + block
+            del data
+            starts = starts[starts < stop]
+            if block == start:
+                starts = np.concatenate(([start], starts))
+            first = -rows % every
+            offsets.append(starts[first::every])
+            rows += len(starts)
+    return rows, np.concatenate(offsets) if offsets else np.zeros(0, dtype=np.int64)
+
+class RowIndex:
+    def __init__(self, every, rows, size, entry_rows, entry_offsets):
+        self.every = every
+        self.rows = rows
+        self.size = size
+        self.entry_rows = np.asarray(entry_rows, dtype=np.int64)
+        self.entry_offsets = np.asarray(entry_offsets, dtype=np.int64)
+
+    @classmethod
+    def build(cls, csv_file, every=DEFAULT_EVERY):
+        with open(csv_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start, size = header_end(mm), len(mm)
+        rows, offsets = scan(csv_file, start, size, every)
+        return cls(every, rows, size, np.arange(len(offsets)) * every, offsets)
+
+    @classmethod
+    def from_shards(cls, every, size, shards):
+        # shards: (rows, offsets) of consecutive ranges, each indexed from 0
+        entry_rows = []
+        first_row = 0
+        for rows, offsets in shards:
+            entry_rows.append(first_row + np.arange(len(offsets)) * every)
+            first_row += rows
+        return cls(every, first_row, size, np.concatenate(entry_rows),
+                   np.concatenate([offsets for _, offsets in shards]))
+
+    def save(self, csv_file, path=None):
+        # the file must be complete, its fingerprint is taken now
+        size, mtime_ns, head, tail = fingerprint(csv_file)
+        if size != self.size:
+            raise ValueError(f"index of {self.size:,} bytes does not match {csv_file} of {size:,} bytes")
+        with open(path or index_path(csv_file), 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.every, self.rows, self.size, len(self.entry_rows), mtime_ns, head, tail))
+            f.write(self.entry_rows.astype('<i8').tobytes())
+            f.write(self.entry_offsets.astype('<i8').tobytes())
+
+    @classmethod
+    def load(cls, csv_file, path=None):
+        # None if there is no index or it no longer matches the file
+        path = path or index_path(csv_file)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        magic, every, rows, size, entries, mtime_ns, head, tail = HEADER.unpack_from(data)
+        if magic != MAGIC or (size, mtime_ns, head, tail) != fingerprint(csv_file):
+            return None
+        entry_rows = np.frombuffer(data, dtype='<i8', count=entries, offset=HEADER.size)
+        entry_offsets = np.frombuffer(data, dtype='<i8', count=entries, offset=HEADER.size + 8 * entries)
+        return cls(every, rows, size, entry_rows, entry_offsets)
+
+    def locate(self, row):
+        # the nearest indexed row at or before `row` and its offset
+        if not 0 <= row <= self.rows:
+            raise IndexError(f"row {row} out of range 0..{self.rows}")
+        if row == self.rows:
+            return row, self.size
+        entry = int(np.searchsorted(self.entry_rows, row, side='right')) - 1
+        return int(self.entry_rows[entry]), int(self.entry_offsets[entry])
+
+    def offset(self, mm, row):
+        # at most `every` - 1 rows are skipped from the nearest entry
+        entry_row, offset = self.locate(row)
+        for _ in range(row - entry_row):
+            offset = mm.find(b'\n', offset) + 1 or len(mm)
+        return offset
+
+    def split(self, parts, start=0):
+        # byte offsets from `start` to the end of the file cutting it into
+        # about `parts` ranges at indexed rows
+        offsets = self.entry_offsets[self.entry_offsets > start]
+        steps = np.unique(np.linspace(0, len(offsets), parts + 1)[1:-1].astype(np.int64))
+        steps = steps[steps < len(offsets)]
+        return [start] + offsets[steps].tolist() + [self.size]
+
+def read_rows(csv_file, start, stop, index=None):
+    index = index or RowIndex.load(csv_file)
+    if index is None:
+        raise ValueError(f"no up-to-date index for {csv_file}")
+    with open(csv_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        begin = index.offset(mm, start)
+        end = index.offset(mm, max(start, min(stop, index.rows)))
+        return mm[begin:end]
+
+def sample_rows(csv_file, count, seed=None, index=None):
+    index = index or RowIndex.load(csv_file)
+    if index is None:
+        raise ValueError(f"no up-to-date index for {csv_file}")
+    rows = np.random.default_rng(seed).choice(index.rows, size=min(count, index.rows), replace=False)
+    with open(csv_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        samples = []
+        for row in np.sort(rows).tolist():
+            begin = index.offset(mm, row)
+            samples.append(mm[begin:mm.find(b'\n', begin) + 1 or len(mm)])
+        return samples
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build or use a sidecar row-offset index of a CSV file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='Index an existing file')
+    build.add_argument('file')
+    build.add_argument('--every', type=int, default=DEFAULT_EVERY, help='Rows between indexed offsets')
+    rows = commands.add_parser('slice', help='Print rows START to STOP (exclusive)')
+    rows.add_argument('file')
+    rows.add_argument('start', type=int)
+    rows.add_argument('stop', type=int)
+    sample = commands.add_parser('sample', help='Print N random rows')
+    sample.add_argument('file')
+    sample.add_argument('count', type=int)
+    sample.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'build':
+            index = RowIndex.build(args.file, args.every)
+            index.save(args.file)
+            print(f"Indexed {index.rows:,} rows of {args.file} every {index.every:,} rows "
+                  f"({len(index.entry_rows):,} entries) into {index_path(args.file)}")
+        elif args.command == 'slice':
+            sys.stdout.buffer.write(read_rows(args.file, args.start, args.stop))
+        else:
+            sys.stdout.buffer.write(b''.join(sample_rows(args.file, args.count, args.seed)))
+    except (OSError, ValueError, IndexError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,386 @@
+import math
+import struct
+import numpy as np
+from datetime import date, timedelta
+from distributions import MAX_AMOUNT
+
+# transaction ids are hashed from their first ID_WIDTH bytes, dates are
+# read from the first DATE_WIDTH bytes ('YYYY-MM-DD') of transaction_date
+ID_WIDTH = 32
+DATE_WIDTH = 10
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+# users with ids in [0, DENSE_USERS) find their sketch row through an array
+DENSE_USERS = 1 << 24
+
+MAGIC = b'MET2'
+HEADER = struct.Struct('<4sddqqqqqqq')
+
+def gather(data, starts, lengths, width):
+    # an (n, width) uint8 matrix of data[start:start + length], zero padded,
+    # built a column at a time to avoid an (n, width) index array
+    matrix = np.empty((len(starts), width), dtype=np.uint8, order='F')
+    for k in range(width):
+        column = data.take(starts + k, mode='clip')
+        column[lengths <= k] = 0
+        matrix[:, k] = column
+    return matrix
+
+def to_matrix(values, width):
+    # the same matrix from a list of bytes objects
+    return np.array(values, dtype=f'S{width}').view(np.uint8).reshape(-1, width)
+
+def hash_ids(matrix, width=ID_WIDTH):
+    # FNV-1a over the bytes zero padded to `width`, then the splitmix64
+    # finalizer so that the top bits HyperLogLog indexes by are well mixed;
+    # the padding columns only multiply, so a narrower matrix hashes the same
+    h = np.full(len(matrix), FNV_OFFSET, dtype=np.uint64)
+    for column in matrix.T:
+        h ^= column
+        h *= np.uint64(FNV_PRIME)
+    h *= np.uint64(pow(FNV_PRIME, width - matrix.shape[1], 1 << 64))
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xbf58476d1ce4e5b9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94d049bb133111eb)
+    h ^= h >> np.uint64(31)
+    return h
+
+def days_from_civil(year, month, day):
+    # days since 1970-01-01 of proleptic Gregorian dates, as int64 arrays
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+def parse_days(matrix):
+    # (epoch days, valid) of 'YYYY-MM-DD' rows of a DATE_WIDTH matrix; the
+    # few distinct dates of a block are converted once each
+    valid = (matrix[:, 4] == ord('-')) & (matrix[:, 7] == ord('-'))
+    key = np.zeros(len(matrix), dtype=np.int64)
+    for k in (0, 1, 2, 3, 5, 6, 8, 9):
+        # non-digits wrap around to values above 9
+        digit = matrix[:, k] - np.uint8(ord('0'))
+        valid &= digit < 10
+        key = key * 10 + digit
+    key[~valid] = 0
+    keys, inverse = np.unique(key, return_inverse=True)
+    year, month, day = keys // 10000, keys // 100 % 100, keys % 100
+    days = days_from_civil(year, np.clip(month, 1, 12), 1) + day - 1
+    # a day past the end of its month would run into the next one
+    ok = (month >= 1) & (month <= 12) & (day >= 1) & \
+         (days < days_from_civil(year + (month == 12), np.clip(month, 1, 12) % 12 + 1, 1))
+    return days[inverse], valid & ok[inverse]
+
+class QuantileSketch:
+    # per-user counts in logarithmic buckets, so any quantile is known to
+    # within relative_accuracy; memory follows the (user, bucket) cells that
+    # have rows, at most users x buckets whatever the rows. Values below
+    # min_value (zero, negative) share the lowest bucket and values above
+    # max_value the highest; NaN amounts are not counted
+    def __init__(self, relative_accuracy=0.02, min_value=0.01, max_value=MAX_AMOUNT):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.buckets = math.ceil(math.log(max_value / min_value) / math.log(self.gamma)) + 2
+        # users get rows in order of appearance: through `index` for ids in
+        # [0, DENSE_USERS), the sorted sparse_ids / sparse_rows otherwise
+        self.users = 0
+        self.user_ids = np.zeros(0, dtype=np.int64)
+        self.index = np.zeros(0, dtype=np.int32)
+        self.sparse_ids = np.zeros(0, dtype=np.int64)
+        self.sparse_rows = np.zeros(0, dtype=np.int64)
+        # sorted row * buckets + bucket of the cells with rows, and their counts
+        self.cells = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.uint32)
+        self.overall = np.zeros(self.buckets, dtype=np.int64)
+
+    def bucket(self, amounts):
+        with np.errstate(all='ignore'):
+            index = np.ceil(np.log(amounts / self.min_value) / math.log(self.gamma)) + 1
+        return np.clip(np.nan_to_num(index, nan=0, posinf=self.buckets - 1, neginf=0), 0,
+                       self.buckets - 1).astype(np.int64)
+
+    def _new_rows(self, user_ids):
+        # rows for the new, distinct `user_ids`, in order
+        rows = np.arange(self.users, self.users + len(user_ids), dtype=np.int64)
+        if self.users + len(user_ids) > len(self.user_ids):
+            grown = np.zeros(max(self.users + len(user_ids), 2 * len(self.user_ids)), dtype=np.int64)
+            grown[:self.users] = self.user_ids[:self.users]
+            self.user_ids = grown
+        self.user_ids[rows] = user_ids
+        self.users += len(user_ids)
+        return rows
+
+    def _restore(self, user_ids):
+        # the rows of serialized sketches, user_ids[row] for every row
+        self.users = len(user_ids)
+        self.user_ids = user_ids.copy()
+        rows = np.arange(len(user_ids), dtype=np.int64)
+        dense = (user_ids >= 0) & (user_ids < DENSE_USERS)
+        self.index = np.full(int(user_ids[dense].max()) + 1 if dense.any() else 0, -1, dtype=np.int32)
+        self.index[user_ids[dense]] = rows[dense]
+        order = np.argsort(user_ids[~dense], kind='stable')
+        self.sparse_ids = user_ids[~dense][order]
+        self.sparse_rows = rows[~dense][order]
+
+    def _rows_of(self, user_ids):
+        # rows for each user, all the users not seen before added at once
+        rows = np.empty(len(user_ids), dtype=np.int64)
+        dense = (user_ids >= 0) & (user_ids < DENSE_USERS)
+        if dense.any():
+            ids = user_ids[dense]
+            size = int(ids.max()) + 1
+            if size > len(self.index):
+                grown = np.full(min(max(size, 2 * len(self.index)), DENSE_USERS), -1, dtype=np.int32)
+                grown[:len(self.index)] = self.index
+                self.index = grown
+            found = self.index[ids]
+            if (found < 0).any():
+                new = np.unique(ids[found < 0])
+                self.index[new] = self._new_rows(new)
+                found = self.index[ids]
+            rows[dense] = found
+        if not dense.all():
+            keys, inverse = np.unique(user_ids[~dense], return_inverse=True)
+            positions = np.searchsorted(self.sparse_ids, keys)
+            found = positions < len(self.sparse_ids)
+            found[found] = self.sparse_ids[positions[found]] == keys[found]
+            key_rows = np.empty(len(keys), dtype=np.int64)
+            key_rows[found] = self.sparse_rows[positions[found]]
+            if not found.all():
+                new = ~found
+                key_rows[new] = self._new_rows(keys[new])
+                self.sparse_ids = np.insert(self.sparse_ids, positions[new], keys[new])
+                self.sparse_rows = np.insert(self.sparse_rows, positions[new], key_rows[new])
+            rows[~dense] = key_rows[inverse]
+        return rows
+
+    def _add_cells(self, cells, counts=None):
+        # cells (counts=None means one row each) into the sorted arrays: the
+        # cells already there are added to in place, the new ones inserted
+        if counts is None:
+            keys, key_counts = np.unique(cells, return_counts=True)
+        else:
+            keys, inverse = np.unique(cells, return_inverse=True)
+            key_counts = np.zeros(len(keys), dtype=np.int64)
+            np.add.at(key_counts, inverse, counts)
+        key_counts = key_counts.astype(np.uint32)
+        positions = np.searchsorted(self.cells, keys)
+        found = positions < len(self.cells)
+        found[found] = self.cells[positions[found]] == keys[found]
+        self.counts[positions[found]] += key_counts[found]
+        if not found.all():
+            new = ~found
+            self.cells = np.insert(self.cells, positions[new], keys[new])
+            self.counts = np.insert(self.counts, positions[new], key_counts[new])
+
+    def add(self, user_ids, amounts):
+        keep = ~np.isnan(amounts)
+        user_ids, amounts = user_ids[keep], amounts[keep]
+        if not len(user_ids):
+            return
+        buckets = self.bucket(amounts)
+        self.overall += np.bincount(buckets, minlength=self.buckets)
+        self._add_cells(self._rows_of(user_ids) * self.buckets + buckets)
+
+    def merge(self, other):
+        if other.users:
+            rows = self._rows_of(other.user_ids[:other.users])
+            cells = rows[other.cells // other.buckets] * self.buckets + other.cells % other.buckets
+            self._add_cells(cells, other.counts)
+        self.overall += other.overall
+        return self
+
+    def _value(self, index):
+        # bucket i > 0 holds (min_value * gamma**(i-2), min_value * gamma**(i-1)]
+        if index == 0:
+            return 0.0
+        return self.min_value * self.gamma ** (index - 1) * 2 / (1 + self.gamma)
+
+    def quantiles(self, counts, qs):
+        total = int(counts.sum())
+        if not total:
+            return [math.nan for _ in qs]
+        cumulative = np.cumsum(counts)
+        return [self._value(int(np.searchsorted(cumulative, q * (total - 1) + 1))) for q in qs]
+
+    def row_of(self, user_id):
+        # the row of a user, None if it has none
+        if 0 <= user_id < DENSE_USERS:
+            row = int(self.index[user_id]) if user_id < len(self.index) else -1
+            return row if row >= 0 else None
+        if not INT64_MIN <= user_id <= INT64_MAX:
+            return None
+        position = int(np.searchsorted(self.sparse_ids, user_id))
+        if position < len(self.sparse_ids) and self.sparse_ids[position] == user_id:
+            return int(self.sparse_rows[position])
+        return None
+
+    def user_counts(self, row):
+        # the bucket counts of a row
+        start, stop = np.searchsorted(self.cells, [row * self.buckets, (row + 1) * self.buckets])
+        counts = np.zeros(self.buckets, dtype=np.int64)
+        counts[self.cells[start:stop] - row * self.buckets] = self.counts[start:stop]
+        return counts
+
+    def user_quantiles(self, user_id, qs):
+        row = self.row_of(user_id)
+        if row is None:
+            return [math.nan for _ in qs]
+        return self.quantiles(self.user_counts(row), qs)
+
+class HyperLogLog:
+    # distinct count of 64-bit hashes in 2**precision one-byte registers,
+    # about 1.04 / sqrt(2**precision) relative error (0.8% at 14)
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, hashes):
+        if not len(hashes):
+            return
+        shift = np.uint64(64 - self.precision)
+        index = (hashes >> shift).astype(np.int64)
+        rest = hashes << np.uint64(self.precision)
+        # leading zeros of the remaining bits plus one, from the exact
+        # exponent of each 32-bit half
+        high = (rest >> np.uint64(32)).astype(np.float64)
+        low = (rest & np.uint64(0xffffffff)).astype(np.float64)
+        high_bits = np.frexp(high)[1]
+        low_bits = np.frexp(low)[1]
+        rank = np.where(high_bits > 0, 33 - high_bits, 65 - low_bits)
+        rank = np.minimum(rank, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int64))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return raw
+
+class DailyRollup:
+    # rows and amount per calendar day in fixed arrays from `start`; dates
+    # outside the window or unparsable are only counted
+    def __init__(self, start=date(1970, 1, 1), days=47482):
+        self.start = start
+        self.first_day = (start - date(1970, 1, 1)).days
+        self.rows = np.zeros(days, dtype=np.int64)
+        self.amounts = np.zeros(days)
+        self.out_of_range = 0
+        self.invalid = 0
+
+    def add(self, date_matrix, amounts):
+        days, valid = parse_days(date_matrix)
+        index = days - self.first_day
+        inside = valid & (index >= 0) & (index < len(self.rows))
+        self.invalid += int(np.count_nonzero(~valid))
+        self.out_of_range += int(np.count_nonzero(valid & ~inside))
+        self.rows += np.bincount(index[inside], minlength=len(self.rows))
+        # inf and nan amounts are valid, like in the totals
+        with np.errstate(over='ignore', invalid='ignore'):
+            self.amounts += np.bincount(index[inside], weights=amounts[inside], minlength=len(self.rows))
+
+    def merge(self, other):
+        self.rows += other.rows
+        with np.errstate(over='ignore', invalid='ignore'):
+            self.amounts += other.amounts
+        self.out_of_range += other.out_of_range
+        self.invalid += other.invalid
+        return self
+
+    def days(self):
+        # (date, rows, amount) of every day with at least one row
+        return [(self.start + timedelta(days=int(i)), int(self.rows[i]), float(self.amounts[i]))
+                for i in np.flatnonzero(self.rows)]
+
+class Metrics:
+    # the optional second set of results of one scan: amount quantiles per
+    # user and overall, distinct transaction ids and per-day volumes; every
+    # part is mergeable, so parallel workers each fill their own
+    def __init__(self, relative_accuracy=0.02, precision=14):
+        self.quantiles = QuantileSketch(relative_accuracy)
+        self.distinct = HyperLogLog(precision)
+        self.daily = DailyRollup()
+
+    def add_arrays(self, user_ids, amounts, id_matrix, date_matrix, fits=None):
+        # valid rows: int64 user ids, float64 amounts and the uint8 matrices
+        # of their ids (ID_WIDTH) and dates (DATE_WIDTH); with a `fits` mask
+        # the rows outside it, whose user ids are beyond int64, are left out
+        # of the per-user quantiles only
+        if fits is None:
+            self.quantiles.add(user_ids, amounts)
+        else:
+            self.quantiles.add(user_ids[fits], amounts[fits])
+        self.distinct.add(hash_ids(id_matrix))
+        self.daily.add(date_matrix, amounts)
+
+    def add_fields(self, user_ids, amounts, ids, dates):
+        # the same from the lists a per-line parser collects
+        fits = np.array([INT64_MIN <= user_id <= INT64_MAX for user_id in user_ids], dtype=bool)
+        self.add_arrays(np.array([u if f else 0 for u, f in zip(user_ids, fits.tolist())], dtype=np.int64),
+                        np.array(amounts, dtype=np.float64), to_matrix(ids, ID_WIDTH), to_matrix(dates, DATE_WIDTH),
+                        None if fits.all() else fits)
+
+    def merge(self, other):
+        self.quantiles.merge(other.quantiles)
+        self.distinct.merge(other.distinct)
+        self.daily.merge(other.daily)
+        return self
+
+    def to_bytes(self):
+        quantiles, daily = self.quantiles, self.daily
+        return b''.join((
+            HEADER.pack(MAGIC, quantiles.relative_accuracy, quantiles.min_value, self.distinct.precision,
+                        quantiles.users, len(quantiles.cells), daily.first_day, len(daily.rows),
+                        daily.out_of_range, daily.invalid),
+            quantiles.user_ids[:quantiles.users].astype('<i8').tobytes(),
+            quantiles.cells.astype('<i8').tobytes(),
+            quantiles.counts.astype('<u4').tobytes(),
+            quantiles.overall.astype('<i8').tobytes(),
+            self.distinct.registers.tobytes(),
+            daily.rows.astype('<i8').tobytes(),
+            daily.amounts.astype('<f8').tobytes()
+        ))
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, accuracy, min_value, precision, users, cells, first_day, days, out_of_range, invalid = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not serialized metrics")
+        metrics = cls(accuracy, precision)
+        quantiles, daily = metrics.quantiles, metrics.daily
+        daily.start = date(1970, 1, 1) + timedelta(days=first_day)
+        daily.first_day = first_day
+
+        offset = HEADER.size
+        def read(dtype, count):
+            nonlocal offset
+            values = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += values.nbytes
+            return values
+
+        quantiles._restore(read('<i8', users))
+        quantiles.cells = read('<i8', cells).copy()
+        quantiles.counts = read('<u4', cells).copy()
+        quantiles.overall = read('<i8', quantiles.buckets).copy()
+        metrics.distinct.registers = read('u1', 1 << precision).copy()
+        daily.rows = read('<i8', days).copy()
+        daily.amounts = read('<f8', days).copy()
+        daily.out_of_range = out_of_range
+        daily.invalid = invalid
+        return metrics
@@ -0,0 +1,131 @@
+import numpy as np
+import parse_chunked
+import parse_native
+import parse_numpy
+import parse_parallel
+from aggregate import DENSE_USERS, Aggregate, SpillingAggregate
+from dedup import Deduplicator
+
+def expected_totals(parts):
+    totals = {}
+    for user_ids, amounts in parts:
+        for user_id, amount in zip(user_ids, amounts):
+            entry = totals.setdefault(user_id, [0.0, 0])
+            entry[0] += amount
+            entry[1] += 1
+    return totals
+
+def test_merge_of_sparse_ids_matches_per_row_adds(tmp_path):
+    rng = np.random.default_rng(7)
+    parts = []
+    for _ in range(4):
+        user_ids = rng.integers(-10 ** 12, 10 ** 12, 3000).tolist() + rng.integers(0, 100, 500).tolist()
+        user_ids += [2 ** 70, -(2 ** 64), DENSE_USERS, DENSE_USERS - 1]
+        parts.append((user_ids, rng.integers(1, 10 ** 6, len(user_ids)).astype(float).tolist()))
+    expected = expected_totals(parts)
+
+    merged = Aggregate()
+    for user_ids, amounts in parts:
+        part = Aggregate()
+        for user_id, amount in zip(user_ids, amounts):
+            part.add(user_id, amount)
+        merged.merge(Aggregate.from_bytes(part.to_bytes()))
+    assert merged.users == len(expected)
+    assert merged.total_rows == sum(len(user_ids) for user_ids, _ in parts)
+    ranked = sorted(expected.items(), key=lambda item: (-item[1][0], item[0]))[:10]
+    assert merged.top(10) == [(user_id, total, count) for user_id, (total, count) in ranked]
+
+    again = Aggregate.from_bytes(merged.to_bytes())
+    assert again.users == merged.users and again.top(10) == merged.top(10)
+
+    spilling = SpillingAggregate(0, spill_dir=str(tmp_path))
+    spilling.merge(merged)
+    spilling.check_memory()
+    assert spilling.spilled and spilling.top(10) == merged.top(10)
+    spilling.close()
+
+def test_add_many_sparse_ids():
+    aggregate = Aggregate()
+    user_ids = np.array([DENSE_USERS + 5, -3, 2 ** 40, -3, DENSE_USERS + 5, 7], dtype=np.int64)
+    aggregate.add_many(user_ids, np.arange(1.0, 7.0))
+    aggregate.add_many(user_ids[:3], np.ones(3))
+    assert aggregate.users == 4
+    assert aggregate.top(4) == [(-3, 7.0, 3), (DENSE_USERS + 5, 7.0, 3), (7, 6.0, 1), (2 ** 40, 4.0, 2)]
+
+def test_spilling_engines_match_exact_totals(tmp_path):
+    # a budget far below the users of one block spills on every check, in
+    # this process and in the parallel engine's workers
+    rng = np.random.default_rng(8)
+    user_ids = np.concatenate((rng.integers(0, 50000, 60000), rng.integers(-10 ** 15, 10 ** 15, 20000)))
+    amounts = rng.integers(1, 10 ** 5, len(user_ids))
+    csv_file = str(tmp_path / 'users.csv')
+    with open(csv_file, 'w') as f:
+        f.write('transaction_id,user_id,transaction_amount,transaction_date\n')
+        for i, (user_id, amount) in enumerate(zip(user_ids.tolist(), amounts.tolist())):
+            f.write(f"tx{i % 70000},{user_id},{amount},2024-01-01\n")
+        f.write(f"big,{2 ** 70},5,2024-01-01\n")
+    # the last 10000 ids repeat the first ones
+    kept = list(zip(user_ids.tolist(), amounts.astype(float).tolist()))
+    expected = expected_totals([([u for u, _ in kept[:70000]] + [2 ** 70], [a for _, a in kept[:70000]] + [5.0])])
+    ranked = sorted(((user_id, total, count) for user_id, (total, count) in expected.items()),
+                    key=lambda item: (-item[1], item[0]))[:50]
+
+    for engine, options in ((parse_numpy, {}), (parse_parallel, {'workers': 2})):
+        aggregate = SpillingAggregate(0, spill_dir=str(tmp_path))
+        dedup = Deduplicator(spill_dir=str(tmp_path))
+        assert engine.aggregate_file(csv_file, aggregate=aggregate, dedup=dedup, **options) is aggregate
+        assert aggregate.spilled and aggregate.memory() == 0
+        assert aggregate.users == len(expected)
+        assert aggregate.top(50) == ranked
+        aggregate.close()
+        dedup.close()
+
+def test_merge_leaves_other_as_it_is():
+    other = Aggregate()
+    for user_id, amount in ((5, 1.0), (2 ** 40, 2.0), (2 ** 70, 3.0), (5, 4.0), (-7, 0.5)):
+        other.add(user_id, amount)
+    sparse = {user_id: list(entry) for user_id, entry in other.sparse.items()}
+    merged = Aggregate().merge(other).merge(other)
+    assert other.sparse == sparse and not len(other.sums)
+    assert merged.top(5) == [(5, 10.0, 4), (2 ** 70, 6.0, 2), (2 ** 40, 4.0, 2), (-7, 1.0, 2)]
+
+def test_spills_of_many_blocks_and_adopted_files(tmp_path, monkeypatch):
+    rng = np.random.default_rng(9)
+    user_ids = np.concatenate((rng.integers(0, 20000, 30000), rng.integers(-10 ** 15, 10 ** 15, 10000)))
+    csv_file = str(tmp_path / 'users.csv')
+    with open(csv_file, 'w') as f:
+        f.write('transaction_id,user_id,transaction_amount,transaction_date\n')
+        for i, user_id in enumerate(user_ids.tolist()):
+            f.write(f"tx{i},{user_id},{i % 100 + 1},2024-01-01\n")
+        f.write(f"big,{2 ** 70},5,2024-01-01\nbad,x,1,2024-01-01\n")
+    expected = parse_native.aggregate_file(csv_file)
+
+    monkeypatch.setattr(parse_native, 'BLOCK_SIZE', 64 * 1024)
+    monkeypatch.setattr(parse_chunked, 'BLOCK_SIZE', 64 * 1024)
+    for engine, options in ((parse_native, {}), (parse_chunked, {'chunk_size': 5000})):
+        aggregate = SpillingAggregate(1 << 14, spill_dir=str(tmp_path))
+        assert engine.aggregate_file(csv_file, aggregate=aggregate, **options) is aggregate
+        assert aggregate.spills > 3 and aggregate.spilled_bytes > 0
+        assert (aggregate.total_rows, aggregate.invalid_rows) == (expected.total_rows, expected.invalid_rows)
+        assert aggregate.users == expected.users
+        assert aggregate.top(20) == expected.top(20)
+        directory = aggregate.directory
+        aggregate.close()
+        assert not (tmp_path / directory).exists()
+
+    # partitions spilled into a shared directory are taken over by another
+    # aggregate, as the parallel engine does with its workers' files
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    merged = SpillingAggregate(1 << 14, directory=str(shared))
+    for part in np.array_split(np.arange(len(user_ids)), 2):
+        worker = SpillingAggregate(1 << 14, directory=str(shared))
+        worker.add_many(user_ids[part], part % 100 + 1.0)
+        worker.spill()
+        merged.adopt(worker.files)
+        worker.close()
+    merged.add(2 ** 70, 5.0)
+    assert merged.users == expected.users
+    assert merged.top(20) == expected.top(20)
+    merged.close()
+    assert shared.exists() and len(list(shared.iterdir())) > 2
@@ -0,0 +1,49 @@
+import pytest
+import analyze
+import gen_csv
+
+MB = 1024 * 1024
+
+def test_choose_engine(tmp_path):
+    csv_file = str(tmp_path / 'small.csv')
+    gen_csv.generate_transactions(0.1, output_file=csv_file, seed=1)
+    assert analyze.choose_engine(csv_file)[0] == 'native'
+    assert analyze.choose_engine(csv_file, file_size=64 * MB, memory=100 * MB, cores=8)[0] == 'native'
+    assert analyze.choose_engine(csv_file, file_size=64 * MB, memory=8192 * MB, cores=8)[0] == 'numpy'
+    assert analyze.choose_engine(csv_file, file_size=1024 * MB, memory=8192 * MB, cores=1)[0] == 'numpy'
+    assert analyze.choose_engine(csv_file, file_size=1024 * MB, memory=8192 * MB, cores=8)[:2] == ('parallel', 8)
+    # workers are limited by memory, too few of them fall back to numpy
+    assert analyze.choose_engine(csv_file, file_size=1024 * MB, memory=1536 * MB, cores=8)[:2] == ('parallel', 6)
+    assert analyze.choose_engine(csv_file, file_size=1024 * MB, memory=768 * MB, cores=8)[0] == 'numpy'
+
+def test_engines_give_the_same_result(tmp_path, capsys):
+    csv_file = str(tmp_path / 'fuzzed.csv')
+    gen_csv.generate_transactions(0.5, output_file=csv_file, error_rate=0.05, seed=2)
+
+    expected = analyze.analyze(csv_file, 'native').to_dict()
+    assert expected['engine'] == 'native' and expected['invalid_rows'] > 0
+    for engine in ('numpy', 'parallel', 'chunked', 'pandas', 'pandas_fast'):
+        result = analyze.analyze(csv_file, engine, workers=2, top=5).to_dict()
+        assert result['engine'] == engine
+        assert result['top_users'] == expected['top_users'][:5]
+        assert [result[name] for name in ('users', 'total_rows', 'invalid_rows')] == \
+            [expected[name] for name in ('users', 'total_rows', 'invalid_rows')]
+    assert analyze.analyze(csv_file).engine == 'native'
+    assert 'native' in capsys.readouterr().out
+
+@pytest.mark.parametrize('engine, options', [
+    ('pandas', {'use_checkpoint': True}),
+    ('chunked', {'with_metrics': True}),
+    ('columnar', {'with_dedup': True}),
+    ('pandas_fast', {'memory_budget': MB}),
+    ('pandas', {'reject_file': 'rejects.txt'}),
+    ('native', {'with_metrics': True, 'use_checkpoint': True}),
+    ('numpy', {'with_dedup': True, 'use_checkpoint': True}),
+    ('parallel', {'memory_budget': MB, 'use_checkpoint': True})
+])
+def test_rejects_options_the_engine_lacks(tmp_path, engine, options):
+    csv_file = str(tmp_path / 'small.csv')
+    gen_csv.generate_transactions(0.01, output_file=csv_file, seed=3)
+    with pytest.raises(ValueError):
+        analyze.analyze(csv_file, engine, **options)
+    assert not (tmp_path / 'small.csv.checkpoint').exists()
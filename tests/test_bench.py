@@ -0,0 +1,42 @@
+import copy
+import bench
+
+def test_run_benchmark_reuses_data_and_agrees(tmp_path):
+    data_dir = tmp_path / 'data'
+    report = bench.run_benchmark([0.2], [0.01], [0.0], ['native', 'numpy'], repeat=2, seed=4,
+                                 data_dir=str(data_dir))
+    path = bench.dataset_path(data_dir, 0.2, 0.01, 0.0, 4)
+    assert path.stat().st_size == int(0.2 * 1024 * 1024)
+    modified = path.stat().st_mtime_ns
+    bench.generate_dataset(path, 0.2, 0.01, 0.0, 4)
+    assert path.stat().st_mtime_ns == modified
+
+    assert report['mismatches'] == []
+    assert [entry['engine'] for entry in report['results']] == ['native', 'numpy']
+    for entry in report['results']:
+        assert 'error' not in entry
+        assert entry['elapsed_min'] <= entry['elapsed'] and entry['max_rss'] > 0
+        assert entry['total_rows'] > 0 and entry['invalid_rows'] > 0
+
+def test_summarize_and_compare():
+    run = {'elapsed': 2.0, 'wall': 2.5, 'max_rss': 100, 'total_rows': 1000, 'invalid_rows': 3, 'users': 2,
+           'total_sum': 30.0, 'top_users': [{'user_id': 1, 'total': 20.0, 'count': 600},
+                                            {'user_id': 2, 'total': 10.0, 'count': 400}]}
+    runs = [dict(run, elapsed=elapsed, wall=elapsed + 0.5, max_rss=rss)
+            for elapsed, rss in ((3.0, 50), (1.0, 300), (2.0, 100))]
+    summary = bench.summarize(runs, 4 * 1024 * 1024)
+    assert (summary['elapsed'], summary['elapsed_min'], summary['wall'], summary['max_rss']) == (2.0, 1.0, 2.5, 300)
+    assert (summary['rows_per_second'], summary['mb_per_second']) == (500.0, 2.0)
+
+    other = copy.deepcopy(summary)
+    # sums taken in another order differ in the last bits only
+    other['total_sum'] += 1e-12
+    other['top_users'][0]['total'] += 1e-12
+    assert bench.compare(summary, other) == []
+    other['invalid_rows'] += 1
+    other['top_users'][1]['count'] += 1
+    assert bench.compare(summary, other) == ['invalid_rows', 'top_users']
+    other = copy.deepcopy(summary)
+    other['total_sum'] = 'nan'
+    other['top_users'][0]['total'] = 20.5
+    assert bench.compare(summary, other) == ['total_sum', 'top_users']
@@ -0,0 +1,35 @@
+import checkpoint
+import gen_csv
+import parse_native
+import parse_numpy
+import parse_parallel
+
+def summary(aggregate):
+    return aggregate.total_rows, aggregate.invalid_rows, aggregate.users, aggregate.top(20)
+
+def test_resumes_after_appends_and_rescans_rewrites(tmp_path):
+    generated = str(tmp_path / 'generated.csv')
+    gen_csv.generate_transactions(0.6, output_file=generated, error_rate=0.05, seed=12)
+    with open(generated, 'rb') as f:
+        data = f.read()
+    # the last row is still being written when the first runs happen
+    first, second = data.find(b'\n', len(data) // 3) + 1, data.find(b'\n', 2 * len(data) // 3) + 1
+    stages = [data[:first] + b'half,4', data[:second], data]
+
+    for engine, options in ((parse_native, {}), (parse_numpy, {}), (parse_parallel, {'workers': 2})):
+        csv_file = str(tmp_path / f"{engine.__name__}.csv")
+        for stage in stages:
+            with open(csv_file, 'wb') as f:
+                f.write(stage)
+            resumed = engine.aggregate_file(csv_file, use_checkpoint=True, **options)
+            assert summary(resumed) == summary(parse_native.aggregate_file(csv_file))
+        offset, _, status = checkpoint.load(csv_file)
+        assert status == 'resumed' and offset == len(data)
+
+        # a rewritten head is noticed and the file is scanned again
+        with open(csv_file, 'r+b') as f:
+            f.seek(100)
+            f.write(b'X')
+        assert checkpoint.load(csv_file)[2] == 'rewritten'
+        rescanned = engine.aggregate_file(csv_file, use_checkpoint=True, **options)
+        assert summary(rescanned) == summary(parse_native.aggregate_file(csv_file))
@@ -0,0 +1,53 @@
+import math
+import columnar
+import parse_columnar
+import parse_native
+
+ROWS = [
+    ('t1', '1', '10.50', '2024-01-01 00:00:00'),
+    ('t2', '1', 'nan', '2024-01-01 00:00:00'),
+    ('t3', '2', 'inf', '2024-01-02 00:00:00'),
+    ('t4', '2', '-inf', '2024-01-02 00:00:00'),
+    ('t5', '3', 'abc', '2024-01-03 00:00:00'),
+    ('t6', 'x', '1.0', '2024-01-03 00:00:00'),
+    ('t7', '3', '2.25', 'not a date'),
+]
+
+def write_both(tmp_path, output_format):
+    csv_path = tmp_path / 'rows.csv'
+    csv_path.write_text('transaction_id,user_id,transaction_amount,transaction_date\n' +
+                        ''.join(','.join(row) + '\n' for row in ROWS))
+    path = str(tmp_path / ('rows.npy' if output_format == 'records' else 'rows'))
+    columnar.create(path, output_format, len(ROWS))
+    columns = columnar.open_columns(path, mode='r+')
+    for i, (transaction_id, user_id, amount, date) in enumerate(ROWS):
+        columns['transaction_id'][i] = transaction_id.encode()
+        columns['user_id'][i], user_valid = columnar.parse_user_id(user_id)
+        columns['transaction_amount'][i], amount_valid = columnar.parse_amount(amount)
+        columns['transaction_date'][i] = columnar.parse_date(date)
+        columns['valid'][i] = user_valid and amount_valid
+    for column in columns.values():
+        if hasattr(column, 'flush'):
+            column.flush()
+    del columns
+    return str(csv_path), path
+
+def summary(aggregate):
+    return (aggregate.total_rows, aggregate.invalid_rows,
+            sorted((user_id, repr(total), count) for user_id, total, count in aggregate.top(10)))
+
+def test_nan_amount_counts_like_parse_native(tmp_path):
+    for output_format in columnar.FORMATS:
+        csv_path, path = write_both(tmp_path, output_format)
+        native = parse_native.aggregate_file(csv_path)
+        mapped = parse_columnar.aggregate_file(path)
+        assert summary(mapped) == summary(native)
+        assert mapped.invalid_rows == 2
+        assert math.isnan(mapped.total_sum)
+
+def test_parsers_report_validity():
+    assert columnar.parse_amount('nan')[1]
+    assert columnar.parse_amount('-inf') == (float('-inf'), True)
+    assert columnar.parse_amount('1,5')[1] is False
+    assert columnar.parse_user_id(str(2 ** 63))[1] is False
+    assert columnar.parse_user_id(str(-2 ** 63)) == (-2 ** 63, True)
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import parse_native
+import parse_numpy
+import parse_parallel
+from dedup import KEY_WIDTH, MAX_RUNS, Deduplicator, Ids, keys_of
+
+def small_deduplicator(tmp_path, max_keys=4096):
+    # spills every few thousand keys, so a test run goes through the Bloom
+    # filter, the sorted runs, their compaction and the ids on disk
+    dedup = Deduplicator(memory_budget=1 << 18, spill_dir=str(tmp_path))
+    dedup.max_keys = max_keys
+    return dedup
+
+def test_matches_exact_set_through_spills(tmp_path):
+    rng = np.random.default_rng(11)
+    # ids that share their first KEY_WIDTH bytes, and some forced to share
+    # one of three keys, are still told apart
+    pool = [b'tx%d' % i for i in range(60000)] + [b'p' * KEY_WIDTH + b'%d' % i for i in range(500)]
+    dedup = small_deduplicator(tmp_path)
+    seen = set()
+    for _ in range(30):
+        rows = rng.integers(0, len(pool), 5000)
+        ids = [pool[i] for i in rows]
+        keys = keys_of(ids)
+        shared = rows % 400 == 0
+        keys[shared] = rows[shared] // 400 % 3
+        expected = []
+        for transaction_id in ids:
+            expected.append(transaction_id in seen)
+            seen.add(transaction_id)
+        assert dedup.check_and_add(keys, Ids.from_list(ids)).tolist() == expected
+
+    assert dedup.distinct == len(seen)
+    assert dedup.spills > MAX_RUNS and len(dedup.runs) <= MAX_RUNS
+    assert dedup.lookups > 0 and dedup.collisions > 0 and dedup.log.flushed > 0
+    directory = dedup.directory
+    dedup.close()
+    assert not os.path.exists(directory)
+
+def test_engines_drop_exactly_the_repeated_ids(tmp_path):
+    rng = np.random.default_rng(12)
+    rows = rng.integers(0, 40000, 120000)
+    csv_file = str(tmp_path / 'dups.csv')
+    with open(csv_file, 'w') as f:
+        f.write('transaction_id,user_id,transaction_amount,transaction_date\n')
+        for i, row in enumerate(rows.tolist()):
+            # a repeated id comes with other values, which must not count
+            f.write(f"tx{row:06d}{'x' * (row % 3 * 40)},{row % 97},{i % 1000}.5,2024-01-01\n")
+    totals = {}
+    for i, row in enumerate(rows.tolist()):
+        if row not in totals:
+            totals[row] = (row % 97, i % 1000 + 0.5)
+    expected = {}
+    for user_id, amount in totals.values():
+        entry = expected.setdefault(user_id, [0.0, 0])
+        entry[0] += amount
+        entry[1] += 1
+    ranked = sorted(((user_id, total, count) for user_id, (total, count) in expected.items()),
+                    key=lambda item: (-item[1], item[0]))
+
+    for engine, options in ((parse_native, {}), (parse_numpy, {}), (parse_parallel, {'workers': 2})):
+        dedup = small_deduplicator(tmp_path)
+        aggregate = engine.aggregate_file(csv_file, dedup=dedup, **options)
+        assert dedup.spills > 0
+        assert dedup.duplicates == len(rows) - len(totals)
+        assert aggregate.total_rows == len(totals)
+        assert aggregate.top(len(expected)) == ranked
+        dedup.close()
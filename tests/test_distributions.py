@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+from distributions import MAX_AMOUNT, AmountSampler
+
+@pytest.mark.parametrize('distribution, params', [
+    ('loguniform', (5, 1)), ('lognormal', (3, -1)), ('lognormal', (3, 0)),
+    ('pareto', (0, 1)), ('pareto', (-1, 1)), ('pareto', (1.16, -2))])
+def test_bad_amount_params_are_rejected(distribution, params):
+    with pytest.raises(ValueError):
+        AmountSampler(distribution, params)
+
+@pytest.mark.parametrize('distribution', ['loguniform', 'lognormal', 'pareto'])
+def test_amounts_stay_within_range(distribution):
+    amounts = AmountSampler(distribution).sample(np.random.default_rng(1), 100000)
+    assert amounts.min() >= 0 and amounts.max() <= MAX_AMOUNT
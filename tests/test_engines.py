@@ -0,0 +1,86 @@
+import gen_csv
+import parse_chunked
+import parse_native
+import parse_numpy
+import parse_pandas
+import parse_pandas_fast
+import parse_parallel
+
+# rows the fuzzer may not hit in a small file: raw line breaks inside the
+# transaction id, '\r' endings, short and long rows, ids beyond int64 and
+# numbers only some parsers take
+EDGE_ROWS = (b'tx\nbroken\rid,42,10.5,2024-01-01\n'
+             b'tx1,42,1.5\r\n'
+             b'short,42\n'
+             b'\n'
+             b'tx2,43,2.0,2024-01-01,extra,fields\n'
+             b'tx3,%d,7.25,2024-01-01\n'
+             b'tx4,1_0,3.0,2024-01-01\n'
+             b'tx5,44,nan,2024-01-01\n'
+             b'tx6,44,inf,2024-01-01\n'
+             b'tx7,5.0,1.0,2024-01-01\n'
+             b'tx8, 45 ,0.30000000000000004,2024-01-01\n'
+             b'unterminated\rrow,46,4.0' % (2 ** 70))
+
+def summary(aggregate):
+    return aggregate.total_rows, aggregate.invalid_rows, aggregate.users, aggregate.top(20)
+
+def test_engines_agree_on_fuzzed_rows(tmp_path):
+    csv_file = str(tmp_path / 'fuzzed.csv')
+    gen_csv.generate_transactions(1, output_file=csv_file, error_rate=0.05, seed=3)
+    with open(csv_file, 'ab') as f:
+        f.write(EDGE_ROWS)
+
+    expected = summary(parse_native.aggregate_file(csv_file))
+    assert expected[2] > 0 and expected[1] > 0
+    assert summary(parse_numpy.aggregate_file(csv_file)) == expected
+    assert summary(parse_pandas.aggregate_file(csv_file)) == expected
+    assert summary(parse_pandas_fast.aggregate_file(csv_file)) == expected
+    for chunk_size in (7, 997, 100000):
+        assert summary(parse_chunked.aggregate_file(csv_file, chunk_size=chunk_size)) == expected
+
+def test_typed_reads_reject_float_ids(tmp_path):
+    # every other row converts, so the block is read as int64 / float64
+    csv_file = str(tmp_path / 'ids.csv')
+    with open(csv_file, 'wb') as f:
+        f.write(b'transaction_id,user_id,transaction_amount,transaction_date\n')
+        f.write(b''.join(b'e%d.5,%d,1.5,2024-01-01\n' % (i, i % 7) for i in range(100)))
+        f.write(b'a,5.0,1.0,2024-01-01\nb,1e3,1.0,2024-01-01\nc,5.,1.0\n')
+
+    expected = summary(parse_native.aggregate_file(csv_file))
+    assert expected[:3] == (103, 3, 7)
+    assert summary(parse_pandas.aggregate_file(csv_file)) == expected
+    assert summary(parse_pandas_fast.aggregate_file(csv_file)) == expected
+    assert summary(parse_chunked.aggregate_file(csv_file, chunk_size=10)) == expected
+
+def test_parallel_chunks_agree_on_rows_at_their_bounds(tmp_path):
+    # the parallel engine cuts chunks of at least 1 MB; the edge rows are
+    # put just before every such bound
+    generated = str(tmp_path / 'generated.csv')
+    gen_csv.generate_transactions(3.5, output_file=generated, error_rate=0.05, seed=9)
+    with open(generated, 'rb') as f:
+        data = f.read()
+    parts, start = [], 0
+    for bound in range(1 << 20, len(data), 1 << 20):
+        cut = data.rfind(b'\n', 0, bound - 40) + 1
+        parts += [data[start:cut], EDGE_ROWS[:-len(b'unterminated\rrow,46,4.0')]]
+        start = cut
+    csv_file = str(tmp_path / 'bounds.csv')
+    with open(csv_file, 'wb') as f:
+        f.write(b''.join(parts) + data[start:] + EDGE_ROWS)
+
+    expected = summary(parse_native.aggregate_file(csv_file))
+    for workers in (1, 2, 3):
+        assert summary(parse_parallel.aggregate_file(csv_file, workers=workers)) == expected
+
+def test_numpy_blocks_agree_with_native(tmp_path, monkeypatch):
+    # blocks of a few KiB put many rows, broken ones included, across block ends
+    csv_file = str(tmp_path / 'blocks.csv')
+    gen_csv.generate_transactions(0.5, output_file=csv_file, error_rate=0.05, seed=10, users=10 ** 8)
+    with open(csv_file, 'ab') as f:
+        f.write(EDGE_ROWS * 3)
+
+    expected = summary(parse_native.aggregate_file(csv_file))
+    for block_size in (4096, 65536):
+        monkeypatch.setattr(parse_numpy, 'BLOCK_SIZE', block_size)
+        assert summary(parse_numpy.aggregate_file(csv_file)) == expected
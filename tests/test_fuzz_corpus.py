@@ -0,0 +1,26 @@
+import json
+import numpy as np
+from fuzz_corpus import CSV_CASES, FuzzCorpus
+
+def test_weights_payloads_and_budget(tmp_path):
+    corpus = FuzzCorpus({'string': [{'value': 'rare', 'weight': 1}, {'value': 'never', 'weight': 0},
+                                    {'repeat': 'ab', 'sizes': [10, 5000], 'size_weights': [3, 1], 'weight': 2}]},
+                        max_payload_bytes=6000)
+    draws = [corpus.choose('string', choice) for choice in np.linspace(0, 1, 12000, endpoint=False).tolist()]
+    counts = {value[:12]: draws.count(value) for value in set(draws)}
+    # weights 1 : 2 * 3/4 : 2 * 1/4, up to a draw on a rounded boundary
+    expected = {'rare': 4000, 'ababababab': 6000, 'abababababab': 2000}
+    assert counts.keys() == expected.keys() and all(abs(counts[key] - expected[key]) <= 1 for key in expected)
+    # an oversized value is built once and handed out as the same object
+    payloads = {id(value) for value in draws if len(value) == 5000}
+    assert len(payloads) == 1 and corpus.payload_bytes == 5010
+
+    small = FuzzCorpus(CSV_CASES, max_payload_bytes=1000)
+    assert small.dropped == [('a', 1000000)] and 'a' * 1000000 not in small.values['string']
+
+    path = tmp_path / 'cases.json'
+    path.write_text(json.dumps({'number': ['-1', {'value': '1e999', 'weight': 5}]}))
+    extended = FuzzCorpus.from_file(str(path), max_payload_bytes=0)
+    assert extended.values['number'][-2:] == ['-1', '1e999'] and extended.values['date'] == CSV_CASES['date']
+    path.write_text(json.dumps({'extend': False, 'number': ['-1']}))
+    assert FuzzCorpus.from_file(str(path)).values == {'number': ['-1']}
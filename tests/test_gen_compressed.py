@@ -0,0 +1,18 @@
+import bz2
+import gzip
+import lzma
+import pytest
+import gen_csv
+
+OPENERS = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+@pytest.mark.parametrize('codec', list(gen_csv.CODECS))
+def test_compressed_size_reaches_target(tmp_path, codec):
+    output_file = tmp_path / f"data{gen_csv.CODECS[codec][0]}"
+    gen_csv.generate_transactions(1, output_file=str(output_file), seed=1, compression=codec,
+                                  compression_threads=1, size_of='compressed')
+    size = output_file.stat().st_size
+    assert 1024 * 1024 <= size < 1.05 * 1024 * 1024
+    with OPENERS[codec](output_file, 'rb') as f:
+        assert f.readline().startswith(b'transaction_id,')
+        assert sum(1 for _ in f) > 0
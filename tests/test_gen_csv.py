@@ -0,0 +1,59 @@
+import time
+import gen_csv
+from fuzz_corpus import CSV_CASES, FuzzCorpus
+
+def read_rows(path):
+    with open(path, 'rb') as f:
+        header = f.readline()
+        return header, f.read().split(b'\n')
+
+def test_sharded_file_is_exact_and_reproducible(tmp_path):
+    paths = [str(tmp_path / f"sharded{i}.csv") for i in range(2)]
+    for path in paths:
+        gen_csv.generate_transactions(2.5, output_file=path, workers=2, seed=5)
+    with open(paths[0], 'rb') as first, open(paths[1], 'rb') as second:
+        data = first.read()
+        assert data == second.read()
+    assert len(data) == int(2.5 * 1024 * 1024)
+
+    header, rows = read_rows(paths[0])
+    assert header == b'transaction_id,user_id,transaction_amount,transaction_date\n'
+    assert rows[-1] == b''
+    rows = [row.split(b',') for row in rows[:-1]]
+    assert all(len(row) == 4 and len(row[0]) == 20 for row in rows)
+    # the shards draw from separate streams, so no row repeats another shard's
+    assert len({row[0] for row in rows}) == len(rows)
+
+def test_encoder_matches_per_row_lines(tmp_path):
+    # without the 1 MB payload, which would only slow the comparison down
+    corpus = FuzzCorpus(CSV_CASES, max_payload_bytes=0)
+    generator = gen_csv.TransactionGenerator(error_rate=0.2, seed=6, fuzz_corpus=corpus)
+    encoder = gen_csv.CsvEncoder()
+    for _ in range(2):
+        batch = generator.generate_batch(3000, enable_fuzzing=True)
+        pieces, lengths = encoder.encode(batch)
+        lines = [gen_csv.transaction_to_csv_line(gen_csv.batch_row(batch, i)).encode() for i in range(3000)]
+        assert b''.join(pieces) == b''.join(lines)
+        assert lengths.tolist() == [len(line) for line in lines]
+
+    # a single writer fills an odd budget to the byte
+    path = str(tmp_path / 'exact.csv')
+    gen_csv.generate_transactions(1.337, output_file=path, error_rate=0.05, seed=6)
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert len(data) == int(1.337 * 1024 * 1024) and data.endswith(b'\n')
+
+def test_stream_keeps_limit_and_rate(tmp_path):
+    path = str(tmp_path / 'limited.csv')
+    gen_csv.stream_transactions(path, limit_mb=0.2, seed=7, report_interval=60)
+    header, rows = read_rows(path)
+    size = len(header) + sum(len(row) + 1 for row in rows[:-1])
+    assert rows[-1] == b'' and 0.2 * 1024 * 1024 - gen_csv.MAX_ROW_SIZE < size <= 0.2 * 1024 * 1024
+
+    # the token bucket holds the stream to the rate plus its burst
+    path = str(tmp_path / 'paced.csv')
+    started = time.perf_counter()
+    gen_csv.stream_transactions(path, rate_rows=20000, duration=0.5, seed=7, report_interval=60)
+    elapsed = time.perf_counter() - started
+    _, rows = read_rows(path)
+    assert 0 < len(rows) - 1 <= 20000 * elapsed + 2000
@@ -0,0 +1,35 @@
+import numpy as np
+import gen_csv
+
+def test_row_ranges_match_across_blocks():
+    generator = gen_csv.TransactionGenerator(error_rate=0.1, duplicate_rate=0.3, seed=4)
+    start, stop = gen_csv.ROWS_PER_BLOCK - 50, gen_csv.ROWS_PER_BLOCK + 50
+    whole = generator.generate_rows(start, stop, enable_fuzzing=True)
+    generator.position = start
+    rows = [generator.generate_transaction(enable_fuzzing=True) for _ in range(stop - start)]
+    assert rows == [gen_csv.batch_row(whole, i) for i in range(stop - start)]
+    assert generator.last_transaction == gen_csv.batch_row(whole, stop - start - 1, fuzzed=False)
+
+def test_valid_transactions_are_not_duplicates():
+    generator = gen_csv.TransactionGenerator(duplicate_rate=0.5, seed=1)
+    rows = [generator.generate_valid_transaction() for _ in range(5000)]
+    assert len({row['transaction_id'] for row in rows}) == len(rows)
+    assert generator.last_transaction == rows[-1]
+    # the batch path does apply duplicates
+    batch = generator.generate_batch(5000)
+    assert len(np.unique(batch['transaction_id'])) < 4000
+
+def test_batch_columns():
+    generator = gen_csv.TransactionGenerator(error_rate=0, duplicate_rate=0, seed=2)
+    batch = generator.generate_batch(20000)
+    assert {len(batch[name]) for name in ('transaction_id', 'user_id', 'amount', 'date')} == {20000}
+    ids = batch['transaction_id']
+    assert ids.dtype == np.dtype('S20') and all(transaction_id.isdigit() for transaction_id in ids.tolist())
+    assert batch['user_id'].min() >= 1 and batch['user_id'].max() <= 9999
+    assert batch['amount'].min() >= 0 and np.array_equal(np.round(batch['amount'], 2), batch['amount'])
+    days = batch['date'].astype('datetime64[D]')
+    assert days.min() >= np.datetime64('2024-01-01') and days.max() < np.datetime64('2025-01-01')
+    # the same seed and position give the same batch
+    again = gen_csv.TransactionGenerator(error_rate=0, duplicate_rate=0, seed=2).generate_batch(20000)
+    assert all(np.array_equal(batch[name], again[name]) for name in batch)
+    assert generator.position == 20000
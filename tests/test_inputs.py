@@ -0,0 +1,62 @@
+import gzip
+import gen_csv
+import inputs
+import numpy as np
+import parse_native
+import parse_numpy
+
+def test_member_bounds_past_large_members(tmp_path):
+    # members of a few KiB after one far larger than the first search window
+    rng = np.random.default_rng(9)
+    members = [gzip.compress(rng.bytes(size)) for size in (3 * inputs.SCAN_WINDOW, 5000, 7000, 9000)]
+    path = tmp_path / 'data.gz'
+    path.write_bytes(b''.join(members))
+    starts = np.cumsum([0] + [len(member) for member in members]).tolist()
+
+    size = starts[-1]
+    bounds = inputs.member_bounds(str(path), 'gzip', 4)
+    # every split point falls in the first member, each takes the next start
+    assert bounds == starts
+    assert inputs.member_bounds(str(path), 'gzip', 1) == [0, size]
+    # a split point after the last member start finds none
+    assert inputs._next_member(path.read_bytes(), starts[-2] + 1, size, 'gzip') is None
+
+def test_prefetched_reads_match_the_file(tmp_path, monkeypatch):
+    # buffers of a few KiB, so the ring of them is reused many times over
+    monkeypatch.setattr(inputs, 'READ_SIZE', 4096)
+    rng = np.random.default_rng(10)
+    data = rng.bytes(100000)
+    path = tmp_path / 'data.bin'
+    path.write_bytes(data)
+    for start, end in ((0, None), (123, 98765), (5000, 5000), (99999, None)):
+        with inputs.open_input(str(path), start=start, end=end, prefetch=True) as f:
+            assert f.read() == data[start:end]
+        # a slow reader taking small, odd sizes sees the same bytes
+        with inputs.open_input(str(path), start=start, end=end, prefetch=True) as f:
+            parts = iter(lambda: f.read(777), b'')
+            assert b''.join(parts) == data[start:end]
+            assert f.tell() == len(data[start:end])
+    # closing before the end does not wait for the reading thread
+    with inputs.open_input(str(path), prefetch=True) as f:
+        assert f.read(10) == data[:10]
+
+    members = [gzip.compress(data[i:i + 30000]) for i in range(0, len(data), 30000)]
+    path = tmp_path / 'data.gz'
+    path.write_bytes(b''.join(members))
+    starts = np.cumsum([0] + [len(member) for member in members]).tolist()
+    with inputs.open_input(str(path)) as f:
+        assert f.read() == data
+    with inputs.open_input(str(path), 'gzip', starts[1], starts[3]) as f:
+        assert f.read() == data[30000:90000]
+
+def test_native_blocks_read_ahead(tmp_path, monkeypatch):
+    csv_file = str(tmp_path / 'data.csv')
+    gen_csv.generate_transactions(0.5, output_file=csv_file, error_rate=0.05, seed=11, users=10 ** 8)
+    expected = parse_numpy.aggregate_file(csv_file)
+    monkeypatch.setattr(inputs, 'READ_SIZE', 8192)
+    for block_size in (1000, 65536):
+        monkeypatch.setattr(parse_native, 'BLOCK_SIZE', block_size)
+        aggregate = parse_native.aggregate_file(csv_file)
+        assert (aggregate.total_rows, aggregate.invalid_rows, aggregate.users) == \
+            (expected.total_rows, expected.invalid_rows, expected.users)
+        assert aggregate.top(20) == expected.top(20)
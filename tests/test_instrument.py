@@ -0,0 +1,55 @@
+import os
+import pstats
+import analyze
+import gen_csv
+import parse_parallel
+from instrument import NULL_STATS, Profiler, Stats
+
+def test_stats_and_null_stats():
+    stats = Stats()
+    with stats.stage('parse'):
+        pass
+    with stats.stage('parse'):
+        stats.count('rows', 5)
+    stats.count('rows')
+    for pid in (1, 2, 1):
+        stats.add_worker({'pid': pid, 'timings': {'parse': 1.5}, 'counters': {'rows': 10}, 'workers': {}})
+    stats.add_worker(None)
+    result = stats.to_dict()
+    assert result['pid'] == os.getpid() and list(result['timings']) == ['parse']
+    assert result['counters'] == {'rows': 6}
+    assert result['workers'] == {1: {'chunks': 2, 'timings': {'parse': 3.0}, 'counters': {'rows': 20}},
+                                 2: {'chunks': 1, 'timings': {'parse': 1.5}, 'counters': {'rows': 10}}}
+
+    with NULL_STATS.stage('parse'):
+        NULL_STATS.count('rows')
+        NULL_STATS.add_worker(result)
+    assert not NULL_STATS.enabled and NULL_STATS.to_dict() is None
+
+def test_parallel_workers_report_their_chunks(tmp_path):
+    csv_file = str(tmp_path / 'data.csv')
+    gen_csv.generate_transactions(3, output_file=csv_file, error_rate=0.01, seed=5)
+    stats = Stats()
+    aggregate = parse_parallel.aggregate_file(csv_file, workers=2, stats=stats)
+
+    workers = stats.to_dict()['workers'].values()
+    assert sum(worker['chunks'] for worker in workers) == stats.counters['chunks'] > 1
+    assert sum(worker['counters']['rows'] for worker in workers) == aggregate.total_rows
+    assert sum(worker['counters']['bytes'] for worker in workers) == os.path.getsize(csv_file)
+    assert all(worker['timings']['parse'] > 0 for worker in workers)
+    assert stats.timings['wait'] > 0
+
+def test_profiler_and_analyze_stats(tmp_path):
+    csv_file = str(tmp_path / 'data.csv')
+    gen_csv.generate_transactions(0.2, output_file=csv_file, error_rate=0.01, seed=6)
+    profile_file = str(tmp_path / 'analyze.prof')
+    with Profiler(profile_file, trace_memory=True, limit=5) as profiler:
+        result = analyze.analyze(csv_file, 'numpy', stats=Stats())
+
+    assert result.stats['counters']['rows'] == result.total_rows
+    assert result.stats['counters']['invalid_rows'] == result.invalid_rows
+    assert 'parse' in result.stats['timings'] and 'top' in result.stats['timings']
+    assert any(name == 'aggregate_file' for _, _, name in pstats.Stats(profile_file).stats)
+    assert len(profiler.report['profile']) == 5 and len(profiler.report['memory']['top']) == 5
+    assert profiler.report['memory']['peak'] > 0
+    assert analyze.analyze(csv_file, 'numpy').stats is None
@@ -0,0 +1,23 @@
+import os
+import gen_csv
+import rowindex
+
+def test_index_follows_rewrites(tmp_path):
+    csv_file = str(tmp_path / 'data.csv')
+    gen_csv.generate_transactions(0.5, output_file=csv_file, seed=1, index_every=1000)
+    index = rowindex.RowIndex.load(csv_file)
+    assert index is not None and index.size == os.path.getsize(csv_file)
+    assert rowindex.read_rows(csv_file, 0, 1).count(b'\n') == 1
+
+    # same size, different rows, the old mtime put back
+    stat = os.stat(csv_file)
+    with open(csv_file, 'r+b') as f:
+        f.seek(len(b'transaction_id,user_id,transaction_amount,transaction_date\n'))
+        f.write(b'0' * 20)
+    os.utime(csv_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.path.getsize(csv_file) == stat.st_size
+    assert rowindex.RowIndex.load(csv_file) is None
+
+    # regenerated without --index, the stale sidecar is gone
+    gen_csv.generate_transactions(0.5, output_file=csv_file, seed=2)
+    assert not os.path.exists(rowindex.index_path(csv_file))
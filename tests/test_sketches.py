@@ -0,0 +1,44 @@
+import math
+import numpy as np
+from sketches import DENSE_USERS, INT64_MAX, INT64_MIN, Metrics, QuantileSketch
+
+QS = [0.5, 0.9, 0.99]
+
+def expected_quantiles(sketch, user_ids, amounts, user_id):
+    counts = np.bincount(sketch.bucket(amounts[user_ids == user_id]), minlength=sketch.buckets)
+    return sketch.quantiles(counts, QS)
+
+def test_many_users_with_large_ids():
+    rng = np.random.default_rng(5)
+    n = 400000
+    user_ids = np.concatenate((rng.integers(0, DENSE_USERS, n // 4), rng.integers(INT64_MIN, INT64_MAX, n // 4),
+                               rng.integers(DENSE_USERS, 10 ** 12, n // 4), rng.integers(0, 1000, n // 4)))
+    user_ids[:4] = [INT64_MIN, INT64_MAX, DENSE_USERS - 1, DENSE_USERS]
+    amounts = rng.lognormal(4, 2, n)
+
+    parts = [QuantileSketch(), QuantileSketch()]
+    for k, (ids, values) in enumerate(zip(np.array_split(user_ids, 8), np.array_split(amounts, 8))):
+        parts[k % 2].add(ids, values)
+    metrics = Metrics()
+    metrics.quantiles.merge(parts[0]).merge(parts[1])
+    sketch = Metrics.from_bytes(metrics.to_bytes()).quantiles
+
+    assert sketch.users == len(np.unique(user_ids))
+    assert int(sketch.counts.sum()) == n
+    # a user has a cell per bucket with rows, not a row of every bucket
+    assert len(sketch.cells) < 2 * n
+    for user_id in user_ids[:4].tolist() + rng.choice(user_ids, 50).tolist():
+        assert sketch.user_quantiles(user_id, QS) == expected_quantiles(sketch, user_ids, amounts, user_id)
+    assert all(math.isnan(q) for q in sketch.user_quantiles(2 ** 70, QS))
+    assert sketch.quantiles(sketch.overall, QS) == sketch.quantiles(np.bincount(sketch.bucket(amounts)), QS)
+
+def test_merge_leaves_other_as_it_is():
+    rng = np.random.default_rng(6)
+    other = Metrics()
+    other.add_fields([1, 2, 2 ** 40, 2 ** 70], [1.5, 2.5, 3.5, 4.5], [b'a', b'b', b'c', b'd'],
+                     [b'2024-01-01', b'2024-01-02', b'bad', b'2024-01-03'])
+    other.quantiles.add(rng.integers(0, 10 ** 6, 1000), rng.lognormal(3, 1, 1000))
+    data = other.to_bytes()
+    merged = Metrics().merge(other).merge(other)
+    assert other.to_bytes() == data
+    assert int(merged.quantiles.counts.sum()) == 2 * int(other.quantiles.counts.sum())
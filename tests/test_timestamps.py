@@ -0,0 +1,15 @@
+from datetime import datetime, timedelta
+import numpy as np
+from timestamps import FORMAT, TimestampEncoder
+
+def test_matches_strftime_inside_and_outside_the_table():
+    encoder = TimestampEncoder(datetime(2024, 1, 1), days=10)
+    rng = np.random.default_rng(3)
+    # days before the table and far after it make it grow both ways
+    seconds = np.concatenate((rng.integers(-400 * 86400, 800 * 86400, 5000), [59 * 86400, 86399, 0]))
+    values = np.datetime64('2024-01-01T00:00:00') + seconds.astype('timedelta64[s]')
+    expected = [(datetime(2024, 1, 1) + timedelta(seconds=int(s))).strftime(FORMAT) for s in seconds]
+    assert encoder.encode(values).view('S19').ravel().astype(str).tolist() == expected
+    assert [encoder.format(*divmod(int(s), 86400)) for s in seconds] == expected
+    assert [encoder.format_datetime64(value) for value in values[:100]] == expected[:100]
+    assert expected[-3] == '2024-02-29 00:00:00'
@@ -0,0 +1,68 @@
+from datetime import datetime
+import numpy as np
+
+FORMAT = '%Y-%m-%d %H:%M:%S'
+TIMESTAMP_SIZE = 19
+
+def _epoch_day(date):
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+class TimestampEncoder:
+    # '%Y-%m-%d %H:%M:%S' from two lookup tables: an 'YYYY-MM-DD ' prefix per
+    # day and an 'HH:MM:SS' suffix per second of the day
+    def __init__(self, start_date=datetime(2024, 1, 1), days=366):
+        self.start_date = start_date
+        self.start_day = _epoch_day(start_date)
+
+        seconds = np.arange(86400)
+        times = np.empty((86400, 8), dtype=np.uint8)
+        for column, value in zip((0, 3, 6), (seconds // 3600, seconds // 60 % 60, seconds % 60)):
+            times[:, column] = value // 10 + ord('0')
+            times[:, column + 1] = value % 10 + ord('0')
+        times[:, 2] = times[:, 5] = ord(':')
+        self.times = times
+        self.time_strings = times.view('S8').ravel().astype(str).tolist()
+
+        self.first_day = self.start_day
+        self.days = np.empty((0, 11), dtype=np.uint8)
+        self.day_strings = []
+        self._extend(self.start_day, self.start_day + days - 1)
+
+    def _extend(self, first, last):
+        # the day table grows to cover whatever range it is asked for
+        first = min(first, self.first_day)
+        last = max(last, self.first_day + len(self.days) - 1)
+        if first == self.first_day and last < self.first_day + len(self.days):
+            return
+        count = last - first + 1
+        days = np.empty((count, 11), dtype=np.uint8)
+        dates = np.datetime_as_string(np.arange(first, last + 1).astype('datetime64[D]'))
+        days[:, :10] = dates.astype('S10').view(np.uint8).reshape(count, 10)
+        days[:, 10] = ord(' ')
+        self.first_day = first
+        self.days = days
+        self.day_strings = days.view('S11').ravel().astype(str).tolist()
+
+    def format(self, day, second):
+        # `day` counts from start_date
+        index = self.start_day + day - self.first_day
+        if not 0 <= index < len(self.day_strings):
+            self._extend(self.start_day + day, self.start_day + day)
+            index = self.start_day + day - self.first_day
+        return self.day_strings[index] + self.time_strings[second]
+
+    def format_datetime64(self, value):
+        day, second = divmod(int(np.datetime64(value, 's').astype(np.int64)), 86400)
+        return self.format(day - self.start_day, second)
+
+    def encode(self, values, out=None):
+        # datetime64 array -> (n, 19) uint8 rows, written into `out` if given
+        seconds = np.asarray(values, dtype='datetime64[s]').astype(np.int64)
+        day, second = np.divmod(seconds, 86400)
+        if len(day):
+            self._extend(int(day.min()), int(day.max()))
+        if out is None:
+            out = np.empty((len(seconds), TIMESTAMP_SIZE), dtype=np.uint8)
+        out[:, :11] = self.days[day - self.first_day]
+        out[:, 11:] = self.times[second]
+        return out
@@ -0,0 +1,218 @@
+import numpy as np
+
+# gen_csv does not quote fuzzed values, so a transaction id with a raw '\n'
+# or '\r' comes out as lines without any comma followed by the line with the
+# rest of the row. Such lines are not rows of their own but the head of the
+# next row's transaction id; up to MAX_FRAGMENTS of them right before a line
+# with commas are put back in front of it (joined by '\n'), lines further
+# back are rejected. Every row boundary is resolved within that many lines,
+# so parsing resynchronizes on the next line with commas.
+MAX_FRAGMENTS = 8
+# bytes of a rejected row written to the reject file
+REJECT_PREVIEW = 256
+
+def is_fragment(line):
+    return b',' not in line
+
+def broken_rows(lines, candidates=None, rows=None):
+    # (first, last) index pairs: lines[first:last] are the head of the
+    # transaction id of the row that ends with lines[last]. Only the
+    # `candidates` (sorted indices) can be fragments, every line if None;
+    # with `rows`, lines i and i + 1 only follow each other in the file
+    # when rows[i + 1] - rows[i] is 0 or 1
+    spans = []
+    start = previous = None
+    for i in range(len(lines)) if candidates is None else candidates:
+        if not is_fragment(lines[i]):
+            continue
+        if previous is None or i != previous + 1 or (rows is not None and not 0 <= rows[i] - rows[previous] <= 1):
+            _close(lines, rows, start, previous, spans)
+            start = i
+        previous = i
+    _close(lines, rows, start, previous, spans)
+    return spans
+
+def _close(lines, rows, start, end, spans):
+    # the run of fragments lines[start:end + 1] is joined to the line after
+    # it, from its first non-empty line within MAX_FRAGMENTS lines
+    if start is None:
+        return
+    last = end + 1
+    if last >= len(lines) or is_fragment(lines[last]) or (rows is not None and not 0 <= rows[last] - rows[end] <= 1):
+        return
+    first = max(start, last - MAX_FRAGMENTS)
+    while first < last and not lines[first]:
+        first += 1
+    if first < last:
+        spans.append((first, last))
+
+def rejoin(items, spans, join):
+    # `items` with the items of every span replaced by join() of them:
+    # b'\n'.join for lines, min and max for their indices
+    if not spans:
+        return items
+    result = []
+    position = 0
+    for first, last in spans:
+        result.extend(items[position:first])
+        result.append(join(items[first:last + 1]))
+        position = last + 1
+    result.extend(items[position:])
+    return result
+
+def join_rows(lines, rows=None):
+    # (lines, first, last): the lines with the broken rows among them put
+    # back together, and the indices of the first and last line of each;
+    # `rows` as for broken_rows()
+    spans = broken_rows(lines, rows=rows)
+    if not spans:
+        return lines, range(len(lines)), range(len(lines))
+    indices = range(len(lines))
+    return rejoin(lines, spans, b'\n'.join), rejoin(indices, spans, min), rejoin(indices, spans, max)
+
+def fragments(data):
+    # the indices of the lines of data.splitlines() without a comma
+    if not data:
+        return []
+    array = np.frombuffer(data, dtype=np.uint8)
+    if b'\r' in data:
+        starts = line_starts(data)
+    else:
+        newlines = np.flatnonzero(array == ord('\n'))
+        starts = np.concatenate(([0], newlines[newlines < len(data) - 1] + 1))
+    commas = np.flatnonzero(array == ord(','))
+    counts = np.diff(np.searchsorted(commas, starts), append=len(commas))
+    return np.flatnonzero(counts == 0).tolist()
+
+def _rows_of(data):
+    # `data` with every row one '\n'-terminated line, see rows()
+    candidates = fragments(data)
+    if not candidates and b'\r' not in data and data.endswith(b'\n'):
+        return data
+    lines = data.splitlines()
+    return b'\n'.join(rejoin(lines, broken_rows(lines, candidates), lambda run: run[-1])) + b'\n'
+
+def rows(f, block_size):
+    # the rows of the binary file object `f` after its header, in blocks of
+    # about `block_size` bytes of '\n'-terminated lines, for readers that do
+    # not need the transaction id: line breaks as in parse_native and the
+    # fragments of every broken row left out
+    header = f.readline()
+    rest = header[after_line(header):]
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        block = rest + block
+        complete = cut(block, block.rfind(b'\n') + 1)
+        rest = block[complete:]
+        if complete:
+            yield _rows_of(block[:complete])
+    if rest:
+        yield _rows_of(rest)
+
+def locate(lines, subset):
+    # the indices in `lines` of `subset`, lines of it taken in order
+    indices = []
+    position = 0
+    for line in subset:
+        position = lines.index(line, position)
+        indices.append(position)
+        position += 1
+    return indices
+
+def line_starts(data):
+    # the offsets in `data` at which the lines of data.splitlines() start
+    array = np.frombuffer(data, dtype=np.uint8)
+    newlines = array == ord('\n')
+    returns = array == ord('\r')
+    # a '\r' right before a '\n' ends the same line
+    returns[:-1] &= ~newlines[1:]
+    ends = np.flatnonzero(newlines | returns)
+    ends = ends[ends < len(data) - 1]
+    return np.concatenate(([0], ends + 1)).tolist()
+
+def _line_before(data, end):
+    # start of the line that ends at `end`, which follows a line break
+    stop = end - 1
+    if stop > 0 and data[stop - 1:stop + 1] == b'\r\n':
+        stop -= 1
+    return max(data.rfind(b'\n', 0, stop), data.rfind(b'\r', 0, stop)) + 1
+
+def cut(data, end, start=0):
+    # where rows can be cut at or before `end`, which follows a line break:
+    # before the fragments that end there, if any, as they belong to a row
+    # that continues beyond `end`. Only depends on what precedes `end`, so
+    # two readers of neighbouring ranges cut at the same place; `start`
+    # bounds the search, and past it `end` is kept
+    position = end
+    for _ in range(MAX_FRAGMENTS):
+        if position <= start:
+            return end
+        line = _line_before(data, position)
+        if data.find(b',', line, position) != -1:
+            break
+        position = max(line, start)
+    return position if position > start else end
+
+def after_line(data, start=0):
+    # the position after the line that starts at `start` and its line break
+    newline = data.find(b'\n', start)
+    ret = data.find(b'\r', start)
+    if ret != -1 and (newline == -1 or ret < newline):
+        return ret + 2 if ret + 1 == newline else ret + 1
+    return len(data) if newline == -1 else newline + 1
+
+def resume(data, start):
+    # where a reader that does not know what precedes data[start:] (which
+    # follows a line break) can start on rows: after the first line with a
+    # comma among the next MAX_FRAGMENTS + 1, or at `start` if there is none
+    position = start
+    for _ in range(MAX_FRAGMENTS + 1):
+        end = after_line(data, position)
+        # a last '\r' may be the first half of a '\r\n'
+        if end >= len(data):
+            break
+        if data.find(b',', position, end) != -1:
+            return end
+        position = end
+    return start
+
+class RejectFile:
+    # the quarantined rows, a line "offset<TAB>length<TAB>row" each: where
+    # the row starts in the (decompressed) input, its length in bytes and
+    # its first REJECT_PREVIEW bytes with non-printable bytes escaped
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.file = open(path, 'w', encoding='ascii')
+
+    def add(self, records):
+        # the records of reject_records()
+        for offset, length, row in records:
+            self.file.write(f"{offset}\t{length}\t{escape(row)}\n")
+            self.rows += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def escape(row):
+    return row.decode('latin-1').encode('unicode_escape').decode('ascii')
+
+def reject_records(data, lines, invalid, base=0, starts=None):
+    # (offset, length, first bytes) of the rows made of lines[first:last + 1]
+    # for the (first, last) pairs in `invalid`, `lines` being the lines of
+    # `data`, which starts at offset `base`; `starts` are its line_starts()
+    starts = line_starts(data) if starts is None else starts
+    records = []
+    for first, last in invalid:
+        start, end = starts[first], starts[last] + len(lines[last])
+        records.append((base + start, end - start, data[start:min(end, start + REJECT_PREVIEW)]))
+    return records
@@ -1,63 +1,31 @@
 import asyncio
 import websockets
 import random
-from datetime import datetime, timedelta
+from datetime import datetime
 import json
 import argparse
+from timestamps import TimestampEncoder
+from fuzz_corpus import WS_CASES, FuzzCorpus
+
+# one set of lookup tables for every connection
+TIMESTAMPS = TimestampEncoder()
 
 class FuzzingDataGenerator:
-    def __init__(self, error_rate=0.1):
+    def __init__(self, error_rate=0.1, fuzz_corpus=None):
         self.start_date = datetime(2024, 1, 1)
         self.error_rate = error_rate
+        self.fuzz_corpus = fuzz_corpus if fuzz_corpus is not None else FuzzCorpus(WS_CASES)
         self.last_transaction = None
         
     def generate_fuzzed_value(self, field_type):
-        fuzz_types = {
-            'string': [
-                lambda: 'a' * 1000000,  
-                lambda: '', 
-                lambda: None,
-                lambda: '"\'\\/\b\f\n\r\t',
-                lambda: '诶比伊艾弗吉',
-                lambda: '★☆⚡⚔',
-                lambda: ' ',
-                lambda: '\x00\x01\x02\x03'
-            ],
-            'number': [
-                lambda: float('inf'),
-                lambda: float('-inf'),
-                lambda: float('nan'),
-                lambda: 2**53 + 1,
-                lambda: -(2**53 + 1),
-                lambda: 2**64,
-                lambda: 0.1 + 0.2,
-                lambda: -0,
-                lambda: 1e308,
-                lambda: 1e-308
-            ],
-            'date': [
-                lambda: '2024-13-32 25:61:61',   
-                lambda: '0000-00-00 00:00:00', 
-                lambda: '9999-99-99 99:99:99', 
-                lambda: '',  
-                lambda: 'Not a date',
-                lambda: '2024-01-01T00:00:00Z',
-                lambda: '1970-01-01 00:00:00', 
-                lambda: datetime.max.strftime('%Y-%m-%d %H:%M:%S')
-            ]
-        }
-        
-        return random.choice(fuzz_types[field_type])()
+        return self.fuzz_corpus.choose(field_type)
 
     def generate_valid_transaction(self):
         transaction = {
             'transaction_id': ''.join(random.choices('0123456789', k=20)),
             'user_id': random.randint(1, 9999),
             'amount': round(min(100000, 10 ** random.uniform(0, 5)), 2),
-            'date': (self.start_date + timedelta(
-                days=random.randint(0, 365),
-                seconds=random.randint(0, 86399)
-            )).strftime('%Y-%m-%d %H:%M:%S')
+            'date': TIMESTAMPS.format(random.randint(0, 365), random.randint(0, 86399))
         }
         self.last_transaction = transaction.copy()
         return transaction
@@ -94,8 +62,8 @@ class FuzzingDataGenerator:
             
         return transaction
 
-async def data_stream(websocket, path, delay_ms):
-    generator = FuzzingDataGenerator()
+async def data_stream(websocket, path, delay_ms, fuzz_corpus):
+    generator = FuzzingDataGenerator(fuzz_corpus=fuzz_corpus)
     
     try:
         while True:
@@ -116,9 +84,13 @@ async def data_stream(websocket, path, delay_ms):
     except Exception as e:
         print(f"\nerror: {e}")
 
-async def main(delay_ms):
+async def main(delay_ms, fuzz_corpus_path=None):
+    if fuzz_corpus_path:
+        fuzz_corpus = FuzzCorpus.from_file(fuzz_corpus_path, defaults=WS_CASES)
+    else:
+        fuzz_corpus = FuzzCorpus(WS_CASES)
     server = await websockets.serve(
-        lambda ws, path: data_stream(ws, path, delay_ms),
+        lambda ws, path: data_stream(ws, path, delay_ms, fuzz_corpus),
         'localhost',
         8888,
         max_size=None
@@ -130,6 +102,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--delay', type=int, default=100, 
                       help='delay between messages in milliseconds')
+    parser.add_argument('--fuzz-corpus', type=str, default=None,
+                      help='JSON file with extra (or replacement) fuzz cases and weights')
     args = parser.parse_args()
     
-    asyncio.run(main(args.delay))
\ No newline at end of file
+    asyncio.run(main(args.delay, args.fuzz_corpus))
\ No newline at end of file
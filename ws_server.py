@@ -1,9 +1,13 @@
 import asyncio
 import websockets
 import random
-from datetime import datetime, timedelta
+from datetime import datetime
 import json
 import argparse
+from timestamps import TimestampEncoder
+
+# one set of lookup tables for every connection
+TIMESTAMPS = TimestampEncoder()
 
 class DataGenerator:
     def __init__(self):
@@ -18,13 +22,13 @@ class DataGenerator:
         
         random_days = random.randint(0, 365)
         random_seconds = random.randint(0, 86399)
-        date = self.start_date + timedelta(days=random_days, seconds=random_seconds)
+        date = TIMESTAMPS.format(random_days, random_seconds)
         
         return {
             'transaction_id': transaction_id,
             'user_id': user_id,
             'amount': amount,
-            'date': date.strftime('%Y-%m-%d %H:%M:%S')
+            'date': date
         }
 
 async def data_stream(websocket, path, delay_ms):